@@ -19,7 +19,10 @@ from managers.customer_manager import CustomerManager
 from managers.promotion_manager import PromotionManager
 from managers.pos_manager import POSManager
 from managers.report_manager import ReportManager
+from managers.report_scheduler import get_report_scheduler, start_rollup_backfill
 from managers.admin_manager import AdminManager
+from managers.image_prefetcher import start_best_seller_warmup
+from managers.image_server import start_image_server
 from managers.transaction_manager import TransactionManager
 
 # --- Import UI Pages ---
@@ -130,7 +133,11 @@ def init_managers():
     st.session_state.cost_mgr = CostManager(fb_client)
     st.session_state.price_mgr = PriceManager(fb_client)
     st.session_state.product_mgr = ProductManager(fb_client, price_mgr=st.session_state.price_mgr)
-    st.session_state.report_mgr = ReportManager(fb_client, st.session_state.cost_mgr)
+    if st.session_state.product_mgr.image_handler:
+        start_best_seller_warmup(fb_client, st.session_state.product_mgr.image_handler)
+        start_image_server(st.session_state.product_mgr.image_handler)
+    start_rollup_backfill(fb_client)
+    st.session_state.report_mgr = ReportManager(fb_client, st.session_state.cost_mgr, scheduler=get_report_scheduler(fb_client))
     st.session_state.admin_mgr = AdminManager(fb_client, st.session_state.inventory_mgr)
     st.session_state.txn_mgr = TransactionManager(fb_client)
     st.session_state.pos_mgr = POSManager(
@@ -0,0 +1,76 @@
+"""
+So sánh thời gian giải mã + thu nhỏ + nén và dung lượng đầu ra của ảnh sản phẩm (ảnh chụp điện thoại ~12MP):
+  - legacy: giải mã đầy đủ, LANCZOS, JPEG q80 (cách làm cũ của ImageHandler._optimize_image)
+  - draft + JPEG / WEBP / AVIF: pipeline mới trong managers.image_pipeline
+
+Chạy: python -m benchmarks.image_pipeline_benchmark [đường_dẫn_ảnh ...]
+Không truyền ảnh thì dùng một ảnh tổng hợp 4032x3024, một lần không xoay và một lần có thẻ EXIF xoay dọc
+(cách cũ bỏ qua thẻ xoay nên ảnh dọc ra sai chiều; kích thước đầu ra được in kèm để đối chiếu).
+"""
+import io
+import sys
+import time
+from PIL import Image, ImageDraw, ImageFilter
+
+from managers.image_pipeline import optimize_image, resolve_output_format, DEFAULT_MAX_WIDTH, DEFAULT_QUALITY
+
+def synthetic_photo(width: int = 4032, height: int = 3024, orientation: int = 1, seed: int = 7) -> bytes:
+    """Ảnh JPEG tổng hợp có chi tiết (gradient + hình khối + nhiễu) để bộ mã hoá không nén quá dễ."""
+    img = Image.radial_gradient('L').resize((width, height)).convert('RGB')
+    draw = ImageDraw.Draw(img)
+    for i in range(60):
+        x, y = (seed * 7919 * (i + 1)) % width, (seed * 104729 * (i + 3)) % height
+        draw.ellipse((x, y, x + width // 8, y + height // 8), fill=((i * 37) % 256, (i * 91) % 256, (i * 53) % 256))
+    noise = Image.effect_noise((width, height), 24).convert('RGB')
+    img = Image.blend(img, noise, 0.15).filter(ImageFilter.SMOOTH)
+    exif = Image.Exif()
+    exif[0x0112] = orientation  # 6 = ảnh chụp dọc, cần xoay 90° khi hiển thị
+    output = io.BytesIO()
+    img.save(output, format='JPEG', quality=92, exif=exif)
+    return output.getvalue()
+
+def legacy_optimize_image(image_file, max_width: int = DEFAULT_MAX_WIDTH, quality: int = DEFAULT_QUALITY):
+    with Image.open(image_file) as img:
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        if img.width > max_width:
+            ratio = max_width / float(img.width)
+            height = int(float(img.height) * ratio)
+            img = img.resize((max_width, height), Image.LANCZOS)
+        output = io.BytesIO()
+        img.save(output, format='JPEG', quality=quality, optimize=True)
+        output.seek(0)
+        return output
+
+def _best_of(fn, repeat: int = 3):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+def benchmark_image(name: str, source: bytes):
+    print(f"\n{name}: {len(source) / 1024:,.0f} KB, {Image.open(io.BytesIO(source)).size}")
+    legacy_time, legacy = _best_of(lambda: legacy_optimize_image(io.BytesIO(source)))
+    legacy_size = len(legacy.getvalue())
+    print(f"  {'legacy (LANCZOS, JPEG)':<26} {legacy_time * 1000:8.1f} ms  {legacy_size / 1024:8.1f} KB  {Image.open(legacy).size}")
+    for fmt in ('JPEG', 'WEBP', 'AVIF'):
+        if resolve_output_format(fmt) != fmt:
+            print(f"  {'draft + ' + fmt:<26} (Pillow không hỗ trợ)")
+            continue
+        elapsed, (output, _, _) = _best_of(lambda: optimize_image(io.BytesIO(source), output_format=fmt))
+        size = len(output.getvalue())
+        print(f"  {'draft + ' + fmt:<26} {elapsed * 1000:8.1f} ms  {size / 1024:8.1f} KB  {Image.open(output).size}"
+              f"  (x{legacy_time / elapsed:.1f} nhanh hơn, tiết kiệm {1 - size / legacy_size:.0%})")
+
+def main(paths: list):
+    if not paths:
+        benchmark_image("ảnh tổng hợp 12MP", synthetic_photo())
+        benchmark_image("ảnh tổng hợp 12MP, EXIF xoay dọc", synthetic_photo(orientation=6))
+    for path in paths:
+        with open(path, 'rb') as f:
+            benchmark_image(path, f.read())
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,126 @@
+"""
+So sánh thời gian dựng báo cáo phân tích lợi nhuận trên ~500k dòng hàng, mỗi cách đo trọn gói từ nguồn dữ liệu
+mà ReportManager thực sự đọc, gồm cả bước dựng DataFrame:
+  - legacy: vòng lặp Python lồng nhau + DataFrame.apply(axis=1) trên tài liệu giao dịch đã tải về (cách làm cũ)
+  - rollups (backend Firestore): line_frame_from_rollups trên tài liệu tổng hợp (chi nhánh, ngày, SKU) + builder
+  - parquet (backend Parquet): AnalyticsStore.sku_lines đọc kho cục bộ (quét, loại bản sao, cộng dồn bằng Arrow) + builder
+
+Không cách nào đạt 10 lần so với vòng lặp cũ khi đo trọn gói: backend Firestore phải đọc từng trường của từng
+tài liệu tổng hợp trong Python, còn backend Parquet bị giới hạn bởi việc quét và giải mã các cột chuỗi của từng
+dòng hàng. Bước builder vector hoá riêng lẻ không được báo cáo vì không nơi gọi thực tế nào có sẵn line frame.
+
+Chạy: python -m benchmarks.profit_analysis_benchmark [số_dòng]
+"""
+import sys
+import time
+import random
+import tempfile
+from datetime import datetime, timedelta
+import pandas as pd
+
+from managers.analytics_store import AnalyticsStore
+from managers.report_builders import line_frame_from_rollups, build_profit_analysis
+
+def generate_transactions(line_count: int, skus: int = 2000, categories: int = 40, seed: int = 7):
+    rng = random.Random(seed)
+    start = datetime(2026, 1, 1)
+    product_categories = {f"PROD-{i:05d}": f"CAT-{i % categories:02d}" for i in range(skus)}
+    category_names = {f"CAT-{i:02d}": f"Danh mục {i}" for i in range(categories)}
+    transactions, produced = [], 0
+    while produced < line_count:
+        n_items = min(rng.randint(1, 8), line_count - produced)
+        items = []
+        for _ in range(n_items):
+            sku = f"PROD-{rng.randrange(skus):05d}"
+            quantity = rng.randint(1, 5)
+            final_price = rng.randint(10, 500) * 1000
+            items.append({'sku': sku, 'name': f"Sản phẩm {sku}", 'quantity': quantity,
+                          'final_price': final_price, 'line_cogs': final_price * quantity * 0.6})
+        transactions.append({'type': 'SALE', 'branch_id': f"BR-{rng.randrange(10)}",
+                             'created_at': start + timedelta(minutes=len(transactions)), 'items': items})
+        produced += n_items
+    return transactions, product_categories, category_names
+
+def rollup_records(transactions) -> list:
+    """Các tài liệu tổng hợp (chi nhánh, ngày, SKU) tương ứng, như RollupManager lưu trong `daily_sku_rollups`."""
+    rollups = {}
+    for trans_data in transactions:
+        day = trans_data['created_at'].strftime('%Y-%m-%d')
+        for item in trans_data['items']:
+            key = (trans_data['branch_id'], day, item['sku'])
+            record = rollups.setdefault(key, {'branch_id': key[0], 'date': day, 'sku': key[2], 'name': item['name'],
+                                              'quantity_sold': 0, 'revenue': 0.0, 'cogs': 0.0})
+            record['quantity_sold'] += item['quantity']
+            record['revenue'] += item['final_price'] * item['quantity']
+            record['cogs'] += item['line_cogs']
+    return list(rollups.values())
+
+def build_parquet_store(transactions, root_dir: str) -> AnalyticsStore:
+    """Ghi các giao dịch vào kho Parquet cục bộ giống một lần AnalyticsStore.export_all."""
+    store = AnalyticsStore(root_dir=root_dir)
+    docs = [{'id': f"T{i:07d}", **trans_data} for i, trans_data in enumerate(transactions)]
+    for name, (df, time_column) in store._transaction_rows(docs).items():
+        df[time_column] = pd.to_datetime(df[time_column])
+        store._write_partitioned(name, df, time_column)
+    return store
+
+def legacy_profit_analysis(transactions, product_categories, category_details):
+    product_profit_data = {}
+    for trans_data in transactions:
+        for item in trans_data.get('items', []):
+            sku = item.get('sku')
+            if not sku: continue
+            quantity = item.get('quantity', 0)
+            revenue = item.get('final_price', 0) * quantity
+            cogs = item.get('line_cogs', 0)
+            profit = revenue - cogs
+            if sku not in product_profit_data:
+                product_profit_data[sku] = {
+                    'product_name': item.get('name', 'N/A'),
+                    'category_id': product_categories.get(sku),
+                    'total_quantity_sold': 0, 'total_revenue': 0, 'total_profit': 0
+                }
+            product_profit_data[sku]['total_quantity_sold'] += quantity
+            product_profit_data[sku]['total_revenue'] += revenue
+            product_profit_data[sku]['total_profit'] += profit
+
+    profit_df = pd.DataFrame.from_dict(product_profit_data, orient='index').reset_index().rename(columns={'index': 'product_id'})
+    profit_df['category_name'] = profit_df['category_id'].map(category_details).fillna('Không có danh mục')
+    profit_df['profit_margin'] = profit_df.apply(
+        lambda row: (row['total_profit'] / row['total_revenue']) * 100 if row['total_revenue'] > 0 else 0, axis=1)
+    category_profit_df = profit_df.groupby('category_name').agg(
+        total_revenue=('total_revenue', 'sum'), total_profit=('total_profit', 'sum')).reset_index()
+    category_profit_df['profit_margin'] = category_profit_df.apply(
+        lambda row: (row['total_profit'] / row['total_revenue']) * 100 if row['total_revenue'] > 0 else 0, axis=1)
+    return profit_df.sort_values(by='total_profit', ascending=False), category_profit_df
+
+def _best_of(fn, repeat: int = 3):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+def main(line_count: int = 500_000):
+    transactions, product_categories, category_names = generate_transactions(line_count)
+    rollups = rollup_records(transactions)
+    start_date, end_date = transactions[0]['created_at'], transactions[-1]['created_at']
+
+    legacy_time, legacy = _best_of(lambda: legacy_profit_analysis(transactions, product_categories, category_names))
+    rollup_time, _ = _best_of(lambda: build_profit_analysis(line_frame_from_rollups(rollups), product_categories, category_names))
+    with tempfile.TemporaryDirectory() as root_dir:
+        store = build_parquet_store(transactions, root_dir)
+        parquet_time, result = _best_of(lambda: build_profit_analysis(
+            store.sku_lines(start_date, end_date), product_categories, category_names))
+
+    merged = legacy[0].set_index('product_id')['total_profit'].sub(result['product_profit_df'].set_index('product_id')['total_profit'])
+    assert merged.abs().max() < 1e-6, "Kết quả không khớp với cách tính cũ."
+
+    print(f"Số dòng hàng: {line_count:,} ({len(transactions):,} giao dịch, {len(rollups):,} tài liệu tổng hợp)")
+    print(f"legacy (loop + apply):        {legacy_time:8.3f}s")
+    print(f"rollups (Firestore backend):  {rollup_time:8.3f}s  (x{legacy_time / rollup_time:.1f})")
+    print(f"parquet (AnalyticsStore):     {parquet_time:8.3f}s  (x{legacy_time / parquet_time:.1f})")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500_000)
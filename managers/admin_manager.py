@@ -3,67 +3,121 @@ import streamlit as st
 import logging
 import traceback
 from google.cloud import firestore
+from managers.rollup_manager import RollupManager
+from managers.report_cache import get_daily_aggregate_cache
+from managers.bulk_delete import BulkDeleteEngine, DEFAULT_MAX_OPS_PER_SECOND, DEFAULT_PARALLEL_COLLECTIONS
+from managers.transaction_search import TransactionSearch
+from managers.backup_manager import BackupManager, DEFAULT_BACKUP_DIR
+from managers.inventory_integrity import InventoryIntegrityChecker
+from managers.image_gc import DriveImageGC
+
+# Số giao dịch tối đa trên một trang của màn hình xoá (giới hạn cứng bộ nhớ giữ trong phiên).
+ADMIN_PAGE_SIZE = 50
+# Mỗi nhóm huỷ hàng loạt là một Firestore transaction; giữ nhỏ để không vượt giới hạn 500 lượt ghi.
+BULK_VOID_BATCH_SIZE = 10
+BULK_VOID_MAX_ORDERS = 200
+INVENTORY_COLLECTIONS = ['inventory', 'inventory_vouchers', 'inventory_transactions']
 
 class AdminManager:
     def __init__(self, firebase_client, inventory_mgr):
         self.db = firebase_client.db
         self.inventory_mgr = inventory_mgr
+        self.rollup_mgr = RollupManager(firebase_client)
+        self.transactions_col = self.db.collection('transactions')
+        self.searcher = TransactionSearch(firebase_client)
+        self.bulk_deleter = BulkDeleteEngine(
+            firebase_client,
+            max_ops_per_second=int(st.secrets.get("bulk_delete_max_ops_per_second", DEFAULT_MAX_OPS_PER_SECOND)),
+            parallel_collections=int(st.secrets.get("bulk_delete_parallel_collections", DEFAULT_PARALLEL_COLLECTIONS)),
+        )
+        self.integrity_checker = InventoryIntegrityChecker(firebase_client, inventory_mgr)
+        self.backup_mgr = BackupManager(firebase_client, backup_dir=st.secrets.get("backup_dir", DEFAULT_BACKUP_DIR))
+        self.image_gc = DriveImageGC(firebase_client)
 
     # --------------------------------------------------------------------------
     # HÀM DỌN DẸP DỮ LIỆU
     # --------------------------------------------------------------------------
 
-    def _delete_collection_in_batches(self, coll_ref, batch_size):
-        deleted_count = 0
-        last_doc = None
-        while True:
-            query = coll_ref.order_by('__name__').limit(batch_size)
-            if last_doc:
-                query = query.start_after(last_doc)
-            docs = list(query.stream())
-            if not docs:
-                break
-            batch = self.db.batch()
-            for doc in docs:
-                batch.delete(doc.reference)
-            batch.commit()
-            deleted_count += len(docs)
-            last_doc = docs[-1]
-            logging.info(f"Đã xóa một lô {len(docs)} tài liệu từ {coll_ref.id}.")
-        return deleted_count
-
-    def clear_inventory_data(self):
-        collections_to_clear = [
-            'inventory',
-            'inventory_vouchers',
-            'inventory_transactions'
-        ]
-        deleted_counts = {}
-        for coll_name in collections_to_clear:
-            try:
-                coll_ref = self.db.collection(coll_name)
-                count = self._delete_collection_in_batches(coll_ref, 200)
-                deleted_counts[coll_name] = count
-            except Exception as e:
-                deleted_counts[coll_name] = f"Lỗi: {e}"
-        return deleted_counts
+    def clear_inventory_data(self, dry_run: bool = False, progress_callback=None):
+        """
+        Xoá toàn bộ dữ liệu kho bằng BulkDeleteEngine (song song, tự tăng tốc, thử lại khi tranh chấp).
+        dry_run=True chỉ đếm số tài liệu sẽ bị xoá. Trả về {collection: snapshot tiến độ}.
+        """
+        return self.bulk_deleter.delete_collections(INVENTORY_COLLECTIONS, dry_run=dry_run, progress_callback=progress_callback)
+
+    def rebuild_report_rollups(self, start_date, end_date):
+        """Tính lại dữ liệu tổng hợp báo cáo theo ngày từ các giao dịch gốc."""
+        try:
+            result = self.rollup_mgr.rebuild_rollups(start_date, end_date)
+            get_daily_aggregate_cache().invalidate()
+            return True, result
+        except Exception as e:
+            logging.error(f"Lỗi khi tính lại dữ liệu tổng hợp: {e}\n{traceback.format_exc()}")
+            return False, str(e)
 
     # --------------------------------------------------------------------------
     # HÀM QUẢN LÝ GIAO DỊCH (REFACTORED FROM ORDERS)
     # --------------------------------------------------------------------------
 
-    def get_all_transactions(self):
-        """Lấy tất cả các giao dịch, sắp xếp theo ngày tạo mới nhất."""
+    def search_sale_transactions(self, criteria: dict = None, page_size: int = ADMIN_PAGE_SIZE, cursor=None):
+        """
+        Tìm giao dịch bán hàng theo trang cho màn hình xoá: điều kiện `type == 'SALE'` được lọc phía máy chủ
+        (có chỉ mục), chỉ tải các trường hiển thị và không bao giờ đọc toàn bộ collection.
+        Trả về {"transactions": [...], "next_cursor": ...} như TransactionSearch.search.
+        """
+        criteria = {**(criteria or {}), 'type': 'SALE'}
         try:
-            transactions_ref = self.db.collection('transactions')
-            query = transactions_ref.order_by("created_at", direction=firestore.Query.DESCENDING)
-            docs = query.stream()
-            transactions = [doc.to_dict() for doc in docs]
-            return transactions
+            return self.searcher.search(criteria, page_size=min(page_size, ADMIN_PAGE_SIZE), cursor=cursor)
         except Exception as e:
             st.error(f"Lỗi khi lấy danh sách giao dịch: {e}")
-            logging.error(f"Error fetching transactions, potential index issue: {e}")
-            return []
+            logging.error(f"Error searching SALE transactions, potential index issue: {e}")
+            return {"transactions": [], "next_cursor": None}
+
+    def _revert_sales_in_transaction(self, transaction, transaction_ids: list, current_user_id: str):
+        """
+        Xoá một nhóm giao dịch SALE trong cùng một Firestore transaction và hoàn trả tồn kho.
+        Số lượng hoàn trả được cộng dồn theo (sku, chi nhánh) trước khi ghi, vì các lượt đọc tồn kho
+        trong transaction không thấy các lượt ghi chưa commit của đơn trước trong cùng nhóm.
+        Trả về (danh sách dữ liệu giao dịch đã xoá, {transaction_id: lý do bỏ qua}).
+        """
+        # --- GIAI ĐOẠN ĐỌC ---
+        refs = {transaction_id: self.transactions_col.document(transaction_id) for transaction_id in transaction_ids}
+        snapshots = {doc.id: doc for doc in self.db.get_all(list(refs.values()), transaction=transaction)}
+
+        deleted, skipped = [], {}
+        restock = {}
+        for transaction_id in transaction_ids:
+            trans_doc = snapshots.get(transaction_id)
+            if trans_doc is None or not trans_doc.exists:
+                skipped[transaction_id] = "không tồn tại"
+                continue
+            trans_data = trans_doc.to_dict()
+            if trans_data.get('type') != 'SALE':
+                skipped[transaction_id] = f"loại '{trans_data.get('type')}' không phải SALE"
+                continue
+            branch_id = trans_data.get('branch_id')
+            for item in trans_data.get('items', []) if branch_id else []:
+                sku, quantity = item.get('sku'), item.get('quantity')
+                if sku and quantity and quantity > 0:
+                    entry = restock.setdefault((sku, branch_id), {'quantity': 0, 'order_ids': []})
+                    entry['quantity'] += quantity
+                    entry['order_ids'].append(transaction_id)
+            deleted.append((refs[transaction_id], trans_data))
+
+        # --- GIAI ĐOẠN GHI ---
+        for (sku, branch_id), entry in restock.items():
+            self.inventory_mgr.update_inventory(
+                transaction=transaction,
+                sku=sku,
+                branch_id=branch_id,
+                delta=entry['quantity'],  # Hoàn trả lại hàng
+                order_id=f"REVERT-{','.join(dict.fromkeys(entry['order_ids']))}",
+                user_id=current_user_id
+            )
+        for trans_ref, trans_data in deleted:
+            transaction.delete(trans_ref)
+            self.rollup_mgr.apply_transaction(transaction, trans_data, sign=-1)
+        return [trans_data for _, trans_data in deleted], skipped
 
     def delete_transaction_and_revert_stock(self, transaction_id: str, current_user_id: str):
         """
@@ -71,47 +125,53 @@ class AdminManager:
         Hành động được thực hiện trong một Firestore transaction để đảm bảo tính toàn vẹn.
         """
         logging.info(f"--- BẮT ĐẦU XÓA GIAO DỊCH {transaction_id} ---")
-        transaction_ref = self.db.collection('transactions').document(transaction_id)
 
         @firestore.transactional
         def _process_deletion_in_transaction(transaction):
-            logging.info(f"[{transaction_id}] (Transaction) Bắt đầu.")
-            # --- GIAI ĐOẠN ĐỌC ---
-            trans_doc = transaction_ref.get(transaction=transaction)
-            if not trans_doc.exists:
-                raise Exception(f"Giao dịch {transaction_id} không tồn tại.")
-            trans_data = trans_doc.to_dict()
-            
-            if trans_data.get('type') != 'SALE':
-                raise Exception(f"Chỉ có thể xóa các giao dịch loại 'SALE'. Giao dịch này có loại '{trans_data.get('type')}'.")
-
-            # --- GIAI ĐOẠN GHI ---
-            branch_id = trans_data.get('branch_id')
-            items = trans_data.get('items', [])
-
-            if branch_id and items:
-                logging.info(f"[{transaction_id}] (Transaction) Hoàn trả tồn kho.")
-                for item in items:
-                    sku = item.get('sku')
-                    quantity = item.get('quantity')
-                    if sku and quantity > 0:
-                        self.inventory_mgr.update_inventory(
-                            transaction=transaction,
-                            sku=sku,
-                            branch_id=branch_id,
-                            delta=quantity, # Hoàn trả lại hàng
-                            order_id=f"REVERT-{transaction_id}",
-                            user_id=current_user_id
-                        )
-            
-            logging.info(f"[{transaction_id}] (Transaction) Xóa giao dịch chính.")
-            transaction.delete(transaction_ref)
+            return self._revert_sales_in_transaction(transaction, [transaction_id], current_user_id)
 
         try:
-            _process_deletion_in_transaction(self.db.transaction())
+            deleted, skipped = _process_deletion_in_transaction(self.db.transaction())
+            if skipped:
+                raise Exception(f"Không thể xóa giao dịch {transaction_id}: {skipped[transaction_id]}.")
+            get_daily_aggregate_cache().invalidate_transaction(deleted[0])
             logging.info(f"--- HOÀN TẤT XÓA GIAO DỊCH {transaction_id} ---")
             return True, f"Đã xóa thành công giao dịch {transaction_id} và hoàn trả tồn kho."
         except Exception as e:
             tb_str = traceback.format_exc()
             logging.error(f"LỖI KHI XÓA GIAO DỊCH {transaction_id}: {e}\n{tb_str}")
             return False, f"Lỗi trong quá trình xóa: {e}"
+
+    def bulk_void_transactions(self, transaction_ids: list, current_user_id: str,
+                               batch_size: int = BULK_VOID_BATCH_SIZE, progress_callback=None):
+        """
+        Huỷ hàng loạt giao dịch SALE: chia danh sách thành các nhóm `batch_size` đơn, mỗi nhóm xử lý trong
+        một Firestore transaction riêng (lỗi ở một nhóm không ảnh hưởng các nhóm đã commit).
+        progress_callback(số_đơn_đã_xử_lý, tổng_số_đơn) được gọi sau mỗi nhóm.
+        Trả về {"success", "deleted": [...], "skipped": {id: lý do}, "failed": {id: lỗi}}.
+        """
+        transaction_ids = list(dict.fromkeys(transaction_ids))[:BULK_VOID_MAX_ORDERS]
+        result = {"deleted": [], "skipped": {}, "failed": {}}
+        total = len(transaction_ids)
+
+        @firestore.transactional
+        def _process_group_in_transaction(transaction, group):
+            return self._revert_sales_in_transaction(transaction, group, current_user_id)
+
+        for offset in range(0, total, batch_size):
+            group = transaction_ids[offset:offset + batch_size]
+            try:
+                deleted, skipped = _process_group_in_transaction(self.db.transaction(), group)
+                for trans_data in deleted:
+                    get_daily_aggregate_cache().invalidate_transaction(trans_data)
+                result["deleted"].extend(t for t in group if t not in skipped)
+                result["skipped"].update(skipped)
+            except Exception as e:
+                logging.error(f"LỖI KHI HUỶ NHÓM GIAO DỊCH {group}: {e}\n{traceback.format_exc()}")
+                result["failed"].update({transaction_id: str(e) for transaction_id in group})
+            if progress_callback:
+                progress_callback(min(offset + batch_size, total), total)
+
+        logging.info(f"Huỷ hàng loạt: {len(result['deleted'])} đã xoá, {len(result['skipped'])} bỏ qua, {len(result['failed'])} lỗi.")
+        result["success"] = not result["failed"]
+        return result
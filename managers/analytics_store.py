@@ -0,0 +1,391 @@
+import os
+import json
+import uuid
+import logging
+import shutil
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow là phụ thuộc tuỳ chọn, chỉ cần khi dùng kho phân tích cục bộ
+    pa = pc = ds = pq = None
+
+from .report_builders import line_frame_from_frame
+from .rollup_manager import UNGROUPED_KEY
+
+DEFAULT_STORE_DIR = os.path.join("data", "analytics")
+PARTITION_COLUMNS = ['branch_id', 'year', 'month']
+
+# Mốc sao chép tăng dần (high-water mark) là thời điểm ghi `recorded_at` do máy chủ gán (SERVER_TIMESTAMP), không phải
+# ngày nghiệp vụ: chứng từ kho và bút toán chi phí có thể hạch toán lùi ngày, mốc theo `timestamp`/`entry_date` sẽ bỏ sót
+# vĩnh viễn các tài liệu đó. Ngày nghiệp vụ của từng collection chỉ dùng làm khoá phân vùng.
+HWM_FIELD = 'recorded_at'
+EXPORT_SOURCES = {
+    'transactions': {'partition_field': 'created_at'},
+    'inventory_transactions': {'partition_field': 'timestamp'},
+    'cost_entries': {'partition_field': 'entry_date'},
+}
+# Mỗi lần chạy đọc lùi lại một khoảng trước mốc để không lỡ lượt ghi sát ranh giới (lệch đồng hồ, commit chậm);
+# bản ghi bị sao chép lặp được loại khi đọc (giữ bản `_exported_at` mới nhất).
+HWM_OVERLAP = timedelta(minutes=5)
+
+# Lược đồ cố định của từng dataset (không gồm cột phân vùng). Không để pyarrow tự suy kiểu: một part có cột toàn None
+# (ví dụ `customer_id` trong ngày không có khách quen) sẽ bị ghi thành kiểu `null` và không gộp được với các part khác.
+if pa is not None:
+    _TIMESTAMP = pa.timestamp('ns')
+    PARTITION_SCHEMA = pa.schema([('branch_id', pa.string()), ('year', pa.int32()), ('month', pa.int32())])
+    DATASET_SCHEMAS = {
+        'transactions': pa.schema([
+            ('id', pa.string()), ('type', pa.string()), ('status', pa.string()), ('cashier_id', pa.string()),
+            ('customer_id', pa.string()), ('created_at', _TIMESTAMP), ('total_amount', pa.float64()),
+            ('total_cogs', pa.float64()), ('sub_total', pa.float64()), ('discount_amount', pa.float64()),
+            ('promotion_id', pa.string()), ('expense_group_id', pa.string()), ('expense_classification', pa.string()),
+            ('_exported_at', _TIMESTAMP),
+        ]),
+        'transaction_lines': pa.schema([
+            ('transaction_id', pa.string()), ('line_no', pa.int64()), ('type', pa.string()), ('created_at', _TIMESTAMP),
+            ('sku', pa.string()), ('name', pa.string()), ('quantity', pa.float64()), ('original_price', pa.float64()),
+            ('final_price', pa.float64()), ('cost_price', pa.float64()), ('line_cogs', pa.float64()),
+            ('auto_discount_applied', pa.float64()), ('manual_discount_applied', pa.float64()),
+            ('_exported_at', _TIMESTAMP),
+        ]),
+        'inventory_transactions': pa.schema([
+            ('id', pa.string()), ('voucher_id', pa.string()), ('sku', pa.string()), ('user_id', pa.string()),
+            ('reason', pa.string()), ('delta', pa.float64()), ('quantity_before', pa.float64()),
+            ('quantity_after', pa.float64()), ('cost_at_transaction', pa.float64()), ('purchase_price', pa.float64()),
+            ('timestamp', _TIMESTAMP), ('_exported_at', _TIMESTAMP),
+        ]),
+        'cost_entries': pa.schema([
+            ('id', pa.string()), ('group_id', pa.string()), ('name', pa.string()), ('amount', pa.float64()),
+            ('classification', pa.string()), ('status', pa.string()), ('source_entry_id', pa.string()),
+            ('created_by', pa.string()), ('entry_date', _TIMESTAMP), ('created_at', _TIMESTAMP),
+            ('_exported_at', _TIMESTAMP),
+        ]),
+    }
+else:
+    PARTITION_SCHEMA, DATASET_SCHEMAS = None, {}
+
+def _to_naive_utc(value):
+    """Chuẩn hoá datetime (có hoặc không có múi giờ) / chuỗi ISO thành datetime không múi giờ."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+class AnalyticsStore:
+    """
+    Kho dữ liệu phân tích cục bộ dạng cột (Parquet), phân vùng theo branch_id/year/month.
+    Sao chép tăng dần các collection `transactions` (kèm các dòng hàng đã tách), `inventory_transactions`
+    và `cost_entries`, lưu mốc high-water mark theo thời điểm ghi (`recorded_at`) để mỗi lần chạy chỉ đọc các tài liệu
+    mới ghi hoặc mới sửa, kể cả tài liệu hạch toán lùi ngày.
+
+    Lưu ý: việc xoá tài liệu trên Firestore không được phản ánh khi sao chép tăng dần,
+    hãy chạy `export_all(full_refresh=True)` định kỳ để đồng bộ lại toàn bộ.
+    """
+    def __init__(self, firebase_client=None, root_dir: str = DEFAULT_STORE_DIR, page_size: int = 1000):
+        self.db = firebase_client.db if firebase_client else None
+        self.root_dir = root_dir
+        self.page_size = page_size
+        self.state_path = os.path.join(root_dir, "_state.json")
+
+    # --------------------------------------------------------------------------
+    # TRẠNG THÁI & TIỆN ÍCH
+    # --------------------------------------------------------------------------
+
+    def _require_pyarrow(self):
+        if pa is None:
+            raise ImportError("Cần cài đặt 'pyarrow' để sử dụng kho dữ liệu phân tích cục bộ.")
+
+    def _load_state(self) -> dict:
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path) as f:
+            return json.load(f)
+
+    def _save_state(self, state: dict):
+        os.makedirs(self.root_dir, exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def _dataset_path(self, name: str) -> str:
+        return os.path.join(self.root_dir, name)
+
+    def has_data(self, name: str = 'transactions') -> bool:
+        return os.path.isdir(self._dataset_path(name))
+
+    def _write_partitioned(self, name: str, df: pd.DataFrame, time_column: str):
+        """Ghi một DataFrame vào dataset, mỗi phân vùng một file part mới cho lần chạy này."""
+        if df.empty:
+            return 0
+        df = df.copy()
+        df['year'] = df[time_column].dt.year.astype('int32')
+        df['month'] = df[time_column].dt.month.astype('int32')
+        df['branch_id'] = df['branch_id'].fillna('_unknown')
+        df['_exported_at'] = pd.Timestamp.now(tz=None)
+        part_name = f"part-{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}.parquet"
+        for (branch_id, year, month), part_df in df.groupby(PARTITION_COLUMNS):
+            part_dir = os.path.join(self._dataset_path(name), f"branch_id={branch_id}", f"year={year}", f"month={month}")
+            os.makedirs(part_dir, exist_ok=True)
+            table = pa.Table.from_pandas(part_df.drop(columns=PARTITION_COLUMNS), schema=DATASET_SCHEMAS[name], preserve_index=False)
+            pq.write_table(table, os.path.join(part_dir, part_name), compression='zstd')
+        return len(df)
+
+    # --------------------------------------------------------------------------
+    # CHUYỂN ĐỔI TÀI LIỆU → DÒNG
+    # --------------------------------------------------------------------------
+
+    def _transaction_rows(self, docs: list):
+        headers, lines = [], []
+        for data in docs:
+            created_at = _to_naive_utc(data.get('created_at'))
+            expense_details = data.get('expense_details') or {}
+            headers.append({
+                'id': data.get('id'), 'type': data.get('type'), 'status': data.get('status'),
+                'branch_id': data.get('branch_id'), 'cashier_id': data.get('cashier_id'),
+                'customer_id': data.get('customer_id'), 'created_at': created_at,
+                'total_amount': float(data.get('total_amount') or 0), 'total_cogs': float(data.get('total_cogs') or 0),
+                'sub_total': float(data.get('sub_total') or 0), 'discount_amount': float(data.get('discount_amount') or 0),
+                'promotion_id': data.get('promotion_id'),
+                'expense_group_id': expense_details.get('group_id'),
+                'expense_classification': expense_details.get('classification'),
+            })
+            for line_no, item in enumerate(data.get('items') or []):
+                lines.append({
+                    'transaction_id': data.get('id'), 'line_no': line_no, 'type': data.get('type'),
+                    'branch_id': data.get('branch_id'), 'created_at': created_at,
+                    'sku': item.get('sku'), 'name': item.get('name'),
+                    'quantity': float(item.get('quantity') or 0),
+                    'original_price': float(item.get('original_price') or 0),
+                    'final_price': float(item.get('final_price') or 0),
+                    'cost_price': float(item.get('cost_price') or 0),
+                    'line_cogs': float(item.get('line_cogs') or 0),
+                    'auto_discount_applied': float(item.get('auto_discount_applied') or 0),
+                    'manual_discount_applied': float(item.get('manual_discount_applied') or 0),
+                })
+        return {
+            'transactions': (pd.DataFrame(headers), 'created_at'),
+            'transaction_lines': (pd.DataFrame(lines), 'created_at'),
+        }
+
+    def _inventory_transaction_rows(self, docs: list):
+        rows = [{
+            'id': d.get('id'), 'voucher_id': d.get('voucher_id'), 'sku': d.get('sku'),
+            'branch_id': d.get('branch_id'), 'user_id': d.get('user_id'), 'reason': d.get('reason'),
+            'delta': float(d.get('delta') or 0), 'quantity_before': float(d.get('quantity_before') or 0),
+            'quantity_after': float(d.get('quantity_after') or 0),
+            'cost_at_transaction': float(d.get('cost_at_transaction') or 0),
+            'purchase_price': None if d.get('purchase_price') is None else float(d['purchase_price']),
+            'timestamp': _to_naive_utc(d.get('timestamp')),
+        } for d in docs]
+        return {'inventory_transactions': (pd.DataFrame(rows), 'timestamp')}
+
+    def _cost_entry_rows(self, docs: list):
+        rows = [{
+            'id': d.get('id'), 'branch_id': d.get('branch_id'), 'group_id': d.get('group_id'),
+            'name': d.get('name'), 'amount': float(d.get('amount') or 0),
+            'classification': d.get('classification'), 'status': d.get('status'),
+            'source_entry_id': d.get('source_entry_id'), 'created_by': d.get('created_by'),
+            'entry_date': _to_naive_utc(d.get('entry_date')), 'created_at': _to_naive_utc(d.get('created_at')),
+        } for d in docs]
+        return {'cost_entries': (pd.DataFrame(rows), 'entry_date')}
+
+    # --------------------------------------------------------------------------
+    # XUẤT DỮ LIỆU TĂNG DẦN
+    # --------------------------------------------------------------------------
+
+    def _stream_since(self, collection_name: str, hwm_value):
+        """
+        Đọc theo trang (cursor) các tài liệu có `recorded_at` >= mốc, theo thứ tự tăng dần.
+        Khi chưa có mốc: quét toàn bộ theo id tài liệu, để lấy cả tài liệu cũ ghi trước khi có `recorded_at`.
+        """
+        query = self.db.collection(collection_name)
+        if hwm_value is None:
+            query = query.order_by('__name__')
+        else:
+            query = query.where(HWM_FIELD, '>=', hwm_value).order_by(HWM_FIELD)
+        query = query.limit(self.page_size)
+        last_doc = None
+        while True:
+            page_query = query.start_after(last_doc) if last_doc else query
+            docs = list(page_query.stream())
+            if not docs:
+                break
+            yield docs
+            last_doc = docs[-1]
+
+    def _stored_hwm(self, collection_name: str, state: dict):
+        """Mốc đã lưu (datetime có múi giờ), hoặc None khi chưa có / là mốc kiểu cũ theo ngày nghiệp vụ (chuỗi ISO)."""
+        stored = state.get(collection_name)
+        if isinstance(stored, dict) and stored.get('field') == HWM_FIELD and stored.get('value'):
+            return datetime.fromisoformat(stored['value'])
+        return None
+
+    def _save_hwm(self, collection_name: str, state: dict, value: datetime):
+        state[collection_name] = {'field': HWM_FIELD, 'value': value.isoformat()}
+        self._save_state(state)
+
+    def export_collection(self, collection_name: str, state: dict) -> int:
+        stored_hwm = self._stored_hwm(collection_name, state)
+        hwm_value = stored_hwm - HWM_OVERLAP if stored_hwm is not None else None
+        # Lượt quét toàn bộ không theo thứ tự `recorded_at`: mốc sau lượt này là thời điểm bắt đầu quét.
+        pass_started = datetime.now(timezone.utc)
+
+        to_rows = {
+            'transactions': self._transaction_rows,
+            'inventory_transactions': self._inventory_transaction_rows,
+            'cost_entries': self._cost_entry_rows,
+        }[collection_name]
+
+        exported = 0
+        for page in self._stream_since(collection_name, hwm_value):
+            docs = [{'id': doc.id, **doc.to_dict()} for doc in page]
+            for name, (df, time_column) in to_rows(docs).items():
+                if not df.empty:
+                    df[time_column] = pd.to_datetime(df[time_column])
+                    df = df.dropna(subset=[time_column])
+                    count = self._write_partitioned(name, df, time_column)
+                    if name == collection_name:
+                        exported += count
+            last_recorded = docs[-1].get(HWM_FIELD)
+            if hwm_value is not None and isinstance(last_recorded, datetime):
+                self._save_hwm(collection_name, state, last_recorded)
+        if hwm_value is None:
+            self._save_hwm(collection_name, state, pass_started)
+        return exported
+
+    def export_all(self, full_refresh: bool = False) -> dict:
+        """Sao chép tăng dần tất cả các collection nguồn. Trả về số tài liệu đã sao chép theo collection."""
+        self._require_pyarrow()
+        if self.db is None:
+            raise ValueError("Cần Firestore client để xuất dữ liệu.")
+        if full_refresh and os.path.isdir(self.root_dir):
+            shutil.rmtree(self.root_dir)
+        state = self._load_state()
+        results = {}
+        for collection_name in EXPORT_SOURCES:
+            try:
+                results[collection_name] = self.export_collection(collection_name, state)
+            except Exception as e:
+                logging.error(f"Lỗi khi xuất dữ liệu '{collection_name}' sang kho phân tích: {e}")
+                results[collection_name] = f"Lỗi: {e}"
+        return results
+
+    # --------------------------------------------------------------------------
+    # ĐỌC DỮ LIỆU VỚI PREDICATE PUSHDOWN
+    # --------------------------------------------------------------------------
+
+    def _partition_filter(self, start_date: datetime, end_date: datetime, branch_ids: list = None):
+        month_filter = None
+        year, month = start_date.year, start_date.month
+        while (year, month) <= (end_date.year, end_date.month):
+            term = (ds.field('year') == year) & (ds.field('month') == month)
+            month_filter = term if month_filter is None else (month_filter | term)
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        if branch_ids:
+            month_filter = month_filter & ds.field('branch_id').isin(branch_ids)
+        return month_filter
+
+    def _scan(self, name: str, time_column: str, start_date: datetime, end_date: datetime,
+              branch_ids: list = None, columns: list = None):
+        """Bảng Arrow của một dataset trong khoảng thời gian (chỉ quét các phân vùng liên quan), hoặc None nếu chưa có dữ liệu."""
+        self._require_pyarrow()
+        path = self._dataset_path(name)
+        if not os.path.isdir(path):
+            return None
+        start_date, end_date = _to_naive_utc(start_date), _to_naive_utc(end_date)
+        schema = pa.unify_schemas([DATASET_SCHEMAS[name], PARTITION_SCHEMA])
+        dataset = ds.dataset(path, schema=schema, format='parquet', partitioning=ds.partitioning(PARTITION_SCHEMA, flavor='hive'))
+        row_filter = self._partition_filter(start_date, end_date, branch_ids) \
+            & (ds.field(time_column) >= pa.scalar(start_date, type=pa.timestamp('us'))) \
+            & (ds.field(time_column) <= pa.scalar(end_date, type=pa.timestamp('us')))
+        return dataset.to_table(columns=columns, filter=row_filter)
+
+    def read(self, name: str, time_column: str, start_date: datetime, end_date: datetime,
+             branch_ids: list = None, columns: list = None, dedupe_keys: list = None) -> pd.DataFrame:
+        """
+        Đọc một dataset trong khoảng thời gian; chỉ quét các phân vùng (chi nhánh, năm, tháng) liên quan.
+        Các bản ghi bị sao chép lặp (do mốc >=) được loại theo dedupe_keys, giữ bản mới nhất.
+        """
+        read_columns = None
+        if columns:
+            read_columns = list(dict.fromkeys(columns + (dedupe_keys or []) + ['_exported_at', 'branch_id', time_column]))
+        table = self._scan(name, time_column, start_date, end_date, branch_ids, read_columns)
+        if table is None:
+            return pd.DataFrame(columns=columns or [])
+        df = table.to_pandas()
+        if dedupe_keys and not df.empty:
+            df = df.sort_values('_exported_at').drop_duplicates(subset=dedupe_keys, keep='last')
+        return df
+
+    def daily_rollups(self, start_date: datetime, end_date: datetime, branch_ids: list = None) -> list:
+        """Tổng hợp (chi nhánh, ngày) từ dữ liệu cục bộ, cùng định dạng với tài liệu trong 'daily_sales_rollups'."""
+        sales = self.read('transactions', 'created_at', start_date, end_date, branch_ids,
+                          columns=['type', 'total_amount', 'total_cogs'], dedupe_keys=['id'])
+        sales = sales[sales['type'] == 'SALE'].copy() if not sales.empty else sales
+        costs = self.read('cost_entries', 'entry_date', start_date, end_date, branch_ids,
+                          columns=['amount', 'group_id', 'classification', 'status'], dedupe_keys=['id'])
+        costs = costs[costs['status'] == 'ACTIVE'].copy() if not costs.empty else costs
+
+        rollups = {}
+        if not sales.empty:
+            sales['date'] = sales['created_at'].dt.strftime('%Y-%m-%d')
+            grouped = sales.groupby(['branch_id', 'date'], observed=True).agg(
+                order_count=('total_amount', 'size'), total_revenue=('total_amount', 'sum'), total_cogs=('total_cogs', 'sum'))
+            for (branch_id, day), row in grouped.iterrows():
+                rollups[(branch_id, day)] = {'branch_id': branch_id, 'date': day, 'order_count': int(row['order_count']),
+                                             'total_revenue': float(row['total_revenue']), 'total_cogs': float(row['total_cogs'])}
+        if not costs.empty:
+            costs['date'] = costs['entry_date'].dt.strftime('%Y-%m-%d')
+            costs['amount'] = costs['amount'].abs()
+            costs['group_id'] = costs['group_id'].fillna(UNGROUPED_KEY)
+            costs['classification'] = costs['classification'].fillna(UNGROUPED_KEY)
+            for (branch_id, day), day_costs in costs.groupby(['branch_id', 'date'], observed=True):
+                rollup = rollups.setdefault((branch_id, day), {'branch_id': branch_id, 'date': day})
+                rollup['expense_count'] = len(day_costs)
+                rollup['total_operating_expenses'] = float(day_costs['amount'].sum())
+                rollup['expenses_by_group'] = day_costs.groupby('group_id')['amount'].sum().to_dict()
+                rollup['expenses_by_classification'] = day_costs.groupby('classification')['amount'].sum().to_dict()
+        return list(rollups.values())
+
+    @staticmethod
+    def _latest_export(table, key: str):
+        """
+        Giữ các dòng của lần sao chép mới nhất cho mỗi giá trị `key` (ví dụ mọi dòng hàng của một đơn được
+        ghi cùng một part, cùng `_exported_at`). Bỏ qua phép nối khi không có khoá nào bị sao chép lặp.
+        """
+        exports = table.group_by(key).aggregate([('_exported_at', 'min'), ('_exported_at', 'max')])
+        if pc.all(pc.equal(exports['_exported_at_min'], exports['_exported_at_max'])).as_py() is not False:
+            return table
+        joined = table.join(exports.drop_columns(['_exported_at_min']), key)
+        return joined.filter(pc.equal(joined['_exported_at'], joined['_exported_at_max'])).drop_columns(['_exported_at_max'])
+
+    def sku_lines(self, start_date: datetime, end_date: datetime, branch_ids: list = None) -> pd.DataFrame:
+        """
+        Line frame (một dòng cho mỗi chi nhánh × SKU trong khoảng) cho các báo cáo theo sản phẩm. Lọc, loại bản sao
+        và cộng dồn đều chạy trên bảng Arrow; chỉ bảng kết quả nhỏ được chuyển sang pandas.
+        """
+        table = self._scan('transaction_lines', 'created_at', start_date, end_date, branch_ids,
+                           columns=['transaction_id', 'type', 'sku', 'name', 'quantity', 'final_price', 'line_cogs',
+                                    '_exported_at', 'branch_id'])
+        if table is None or table.num_rows == 0:
+            return line_frame_from_frame(pd.DataFrame())
+        table = table.filter(pc.and_(pc.equal(table['type'], 'SALE'), pc.is_valid(table['sku'])))
+        table = self._latest_export(table, 'transaction_id')
+        table = table.append_column('revenue', pc.multiply(table['final_price'], table['quantity']))
+        grouped = table.group_by(['branch_id', 'sku']).aggregate(
+            [('name', 'max'), ('quantity', 'sum'), ('revenue', 'sum'), ('line_cogs', 'sum')])
+        return line_frame_from_frame(grouped.to_pandas().rename(columns={
+            'name_max': 'name', 'quantity_sum': 'quantity_sold', 'revenue_sum': 'revenue', 'line_cogs_sum': 'cogs'}))
+
+    def summary(self) -> dict:
+        """Mốc high-water mark hiện tại của từng collection."""
+        return self._load_state()
@@ -8,6 +8,8 @@ import streamlit as st
 import pyrebase
 from streamlit_cookies_manager import EncryptedCookieManager
 import requests
+from google.api_core.exceptions import NotFound
+from managers.session_cache import get_session_cache, DEFAULT_LAST_SEEN_INTERVAL_MINUTES
 
 # Role hierarchy definition (lowest to highest)
 ROLES = ['staff', 'supervisor', 'manager', 'admin']
@@ -28,6 +30,8 @@ class AuthManager:
         self.users_col = self.db.collection('users')
         self.sessions_col = self.db.collection('user_device_sessions')
         self.settings_mgr = settings_mgr
+        self.session_cache = get_session_cache()
+        self.last_seen_interval = timedelta(minutes=float(st.secrets.get("session_last_seen_minutes", DEFAULT_LAST_SEEN_INTERVAL_MINUTES)))
 
         self.cookies = EncryptedCookieManager(
             password=st.secrets.get("cookie_secret_key", "a_default_secret_key_that_is_not_safe"),
@@ -47,6 +51,53 @@ class AuthManager:
     def _hash_token(self, token):
         return hashlib.sha256(token.encode('utf-8')).hexdigest()
 
+    def _load_session(self, token_hash):
+        """
+        Đọc tài liệu phiên theo khoá token hash (một lượt get trực tiếp).
+        Phiên tạo trước khi đổi sang khoá token hash được tìm theo trường `token_hash` và chuyển sang khoá mới.
+        """
+        snapshot = self.sessions_col.document(token_hash).get()
+        if snapshot.exists:
+            return snapshot.to_dict()
+        legacy_docs = list(self.sessions_col.where("token_hash", "==", token_hash).limit(1).stream())
+        if not legacy_docs:
+            return None
+        session_data = legacy_docs[0].to_dict()
+        batch = self.db.batch()
+        batch.set(self.sessions_col.document(token_hash), session_data)
+        batch.delete(legacy_docs[0].reference)
+        batch.commit()
+        return session_data
+
+    def _load_user(self, uid):
+        """Hồ sơ người dùng qua bộ đệm trong tiến trình (TTL ngắn); None nếu không tồn tại."""
+        user_data = self.session_cache.users.get(uid)
+        if user_data is None:
+            user_doc = self.users_col.document(uid).get()
+            if not user_doc.exists:
+                return None
+            user_data = user_doc.to_dict()
+            self.session_cache.users.put(uid, user_data)
+        return dict(user_data)
+
+    @staticmethod
+    def _session_profile(user_data: dict) -> dict:
+        """Bản sao hồ sơ người dùng lưu trên tài liệu phiên (trạng thái, vai trò, chi nhánh...) để đăng nhập lại chỉ đọc phiên."""
+        return {k: v for k, v in user_data.items() if k not in ('uid', 'password_hash')}
+
+    def _refresh_session_profiles(self, uid: str):
+        """Cập nhật bản sao hồ sơ trên các phiên còn hiệu lực của người dùng sau khi hồ sơ thay đổi."""
+        self.session_cache.invalidate_user(uid)
+        user_doc = self.users_col.document(uid).get()
+        if not user_doc.exists:
+            return
+        profile = self._session_profile(user_doc.to_dict())
+        batch = self.db.batch()
+        for doc in self.sessions_col.where("user_id", "==", uid).stream():
+            if not doc.to_dict().get('revoked', False):
+                batch.update(doc.reference, {'user': profile})
+        batch.commit()
+
     def check_cookie_and_re_auth(self):
         if 'user' in st.session_state and st.session_state.user is not None:
             return True
@@ -57,37 +108,47 @@ class AuthManager:
 
         token_hash = self._hash_token(session_token)
         try:
-            session_query = self.sessions_col.where("token_hash", "==", token_hash).limit(1).stream()
-            session_docs = list(session_query)
-
-            if not session_docs:
-                self.logout()
-                return False
-
-            session_doc = session_docs[0]
-            session_data = session_doc.to_dict()
-
-            expires_at = session_data.get('expires_at')
-            
-            if session_data.get('revoked', False) or datetime.now(timezone.utc) > expires_at:
+            session_data = self.session_cache.sessions.get(token_hash)
+            cold = session_data is None
+            if cold:
+                session_data = self._load_session(token_hash)
+                if not session_data:
+                    # Không có tài liệu phiên nào (kể cả khoá cũ): không cần ghi thu hồi.
+                    self.logout(session_exists=False)
+                    return False
+
+            now = datetime.now(timezone.utc)
+            if session_data.get('revoked', False) or now > session_data.get('expires_at'):
+                self.session_cache.sessions.invalidate(token_hash)
                 self.logout()
                 return False
+            if cold:
+                # Chỉ đưa vào bộ đệm sau khi đọc từ Firestore: lượt trúng bộ đệm không gia hạn TTL,
+                # nên phiên bị thu hồi ở tiến trình khác hết hiệu lực chậm nhất sau `ttl` giây.
+                self.session_cache.sessions.put(token_hash, session_data)
 
             uid = session_data.get('user_id')
-            user_doc = self.users_col.document(uid).get()
-            if not user_doc.exists:
-                self.logout()
-                return False
-
-            user_data = user_doc.to_dict()
-            if not user_data.get('active', False):
+            session_update = {}
+            # Phiên mang sẵn bản sao hồ sơ nên không phải đọc thêm tài liệu người dùng;
+            # phiên tạo trước khi có bản sao đọc hồ sơ một lần rồi được bổ sung bản sao.
+            user_data = dict(session_data['user']) if session_data.get('user') else None
+            if user_data is None:
+                user_data = self._load_user(uid)
+                if user_data:
+                    session_update['user'] = session_data['user'] = self._session_profile(user_data)
+            if not user_data or not user_data.get('active', False):
                 self.logout()
                 return False
 
             user_data['uid'] = uid
             st.session_state['user'] = user_data
 
-            self.sessions_col.document(session_doc.id).update({'last_seen': datetime.now(timezone.utc)})
+            # Chỉ ghi `last_seen` tối đa một lần mỗi last_seen_interval cho mỗi phiên.
+            last_seen = session_data.get('last_seen')
+            if not last_seen or now - last_seen >= self.last_seen_interval:
+                session_update['last_seen'] = session_data['last_seen'] = now
+            if session_update:
+                self.sessions_col.document(token_hash).update(session_update)
             return True
         except Exception:
             self.logout()
@@ -112,7 +173,7 @@ class AuthManager:
                 st.session_state['user'] = user_data
 
                 if remember_me:
-                    self._create_session(uid)
+                    self._create_session(uid, user_data)
 
                 return ('SUCCESS', user_data)
             else:
@@ -165,7 +226,7 @@ class AuthManager:
         except Exception as e:
             return ('FAILED', f"Đã xảy ra lỗi không mong muốn: {e}")
 
-    def _create_session(self, user_id):
+    def _create_session(self, user_id, user_data: dict):
         session_token = secrets.token_hex(32)
         token_hash = self._hash_token(session_token)
         
@@ -183,19 +244,26 @@ class AuthManager:
             'last_seen': now,
             'expires_at': expires_at,
             'revoked': False,
-            'user_agent': user_agent
+            'user_agent': user_agent,
+            'user': self._session_profile(user_data)
         }
-        self.sessions_col.add(session_data)
+        self.sessions_col.document(token_hash).set(session_data)
         self.cookies['session_token'] = session_token
         self.cookies.save()
 
-    def logout(self):
+    def logout(self, session_exists: bool = True):
+        """session_exists=False khi đã biết không có tài liệu phiên (vừa tra không thấy): bỏ qua lượt ghi thu hồi."""
         session_token = self.cookies.get('session_token')
         if session_token:
             token_hash = self._hash_token(session_token)
-            session_query = self.sessions_col.where("token_hash", "==", token_hash).limit(1).stream()
-            for doc in session_query:
-                self.sessions_col.document(doc.id).update({'revoked': True})
+            self.session_cache.sessions.invalidate(token_hash)
+        if session_token and session_exists:
+            try:
+                self.sessions_col.document(token_hash).update({'revoked': True})
+            except NotFound:
+                # Phiên cũ (khoá ngẫu nhiên) chưa được chuyển sang khoá token hash.
+                for doc in self.sessions_col.where("token_hash", "==", token_hash).limit(1).stream():
+                    doc.reference.update({'revoked': True})
         
         if 'user' in st.session_state:
             del st.session_state['user']
@@ -306,6 +374,7 @@ class AuthManager:
         self.users_col.document(uid).update(data)
         
         self.list_users.clear()
+        self._refresh_session_profiles(uid)
         
         return True
 
@@ -346,6 +415,7 @@ class AuthManager:
         self.list_users.clear()
         self.has_users.clear()
 
+        self.session_cache.invalidate_user(uid)
         sessions_query = self.sessions_col.where("user_id", "==", uid).stream()
         for doc in sessions_query:
             self.sessions_col.document(doc.id).update({'revoked': True})
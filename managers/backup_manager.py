@@ -0,0 +1,310 @@
+import os
+import json
+import gzip
+import base64
+import hashlib
+import logging
+import shutil
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, wait
+from google.cloud.firestore_v1 import GeoPoint
+from google.cloud.firestore_v1.base_document import BaseDocumentReference
+from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions, SendMode
+
+from .bulk_delete import DEFAULT_INITIAL_OPS_PER_SECOND, DEFAULT_MAX_OPS_PER_SECOND, MAX_WRITE_ATTEMPTS, RETRYABLE_CODES
+
+DEFAULT_BACKUP_DIR = os.path.join("data", "backups")
+BACKUP_PAGE_SIZE = 1000
+DEFAULT_BACKUP_WORKERS = 6
+# Collection có từ ngần này tài liệu trở lên được chia phân vùng (get_partitions) để nhiều luồng cùng đọc.
+PARTITION_MIN_DOCUMENTS = 20000
+MANIFEST_FILE = "manifest.json"
+SNAPSHOT_SUFFIX = ".jsonl.gz"
+
+def encode_value(value):
+    """Chuyển giá trị Firestore sang dạng JSON được; các kiểu đặc biệt được gắn nhãn `__type__` để khôi phục đúng kiểu."""
+    if isinstance(value, datetime):
+        return {'__type__': 'datetime', 'value': value.isoformat()}
+    if isinstance(value, BaseDocumentReference):
+        return {'__type__': 'ref', 'value': value.path}
+    if isinstance(value, GeoPoint):
+        return {'__type__': 'geo', 'value': [value.latitude, value.longitude]}
+    if isinstance(value, bytes):
+        return {'__type__': 'bytes', 'value': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, dict):
+        return {key: encode_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode_value(item) for item in value]
+    return value
+
+def snapshot_read_time() -> datetime:
+    """
+    Thời điểm đọc chung cho cả bản sao lưu, làm tròn xuống phút: Firestore chấp nhận `read_time` trong vòng một giờ
+    qua, hoặc (khi bật PITR) mốc tròn phút trong 7 ngày qua.
+    """
+    return datetime.now(timezone.utc).replace(second=0, microsecond=0)
+
+def decode_value(value, db):
+    if isinstance(value, dict):
+        value_type = value.get('__type__')
+        if value_type == 'datetime':
+            return datetime.fromisoformat(value['value'])
+        if value_type == 'ref':
+            return db.document(value['value'])
+        if value_type == 'geo':
+            return GeoPoint(*value['value'])
+        if value_type == 'bytes':
+            return base64.b64decode(value['value'])
+        return {key: decode_value(item, db) for key, item in value.items()}
+    if isinstance(value, list):
+        return [decode_value(item, db) for item in value]
+    return value
+
+class BackupManager:
+    """
+    Sao lưu / khôi phục toàn bộ cơ sở dữ liệu ra thư mục cục bộ.
+    Mỗi bản sao lưu là một thư mục `data/backups/<thời điểm>/` gồm một tệp JSONL nén gzip cho mỗi collection
+    (mỗi dòng một tài liệu `{"id", "data"}`) và `manifest.json` ghi số tài liệu + SHA-256 của từng tệp.
+    Mọi lượt đọc dùng chung một `read_time` nên bản sao lưu là ảnh chụp nhất quán tại một thời điểm (ghi trong manifest).
+    Các collection được đọc song song; collection lớn được chia phân vùng theo khoảng mã tài liệu (get_partitions)
+    để nhiều luồng cùng đọc một collection, mỗi phân vùng theo trang (cursor) ghi ra một tệp phần rồi được nối lại.
+    Bản sao lưu kéo dài quá một giờ cần bật PITR trên Firestore. Khôi phục bằng BulkWriter.
+    """
+    def __init__(self, firebase_client, backup_dir: str = DEFAULT_BACKUP_DIR,
+                 page_size: int = BACKUP_PAGE_SIZE, max_workers: int = DEFAULT_BACKUP_WORKERS):
+        self.db = firebase_client.db
+        self.backup_dir = backup_dir
+        self.page_size = page_size
+        self.max_workers = max_workers
+
+    def list_collections(self) -> list:
+        return sorted(coll.id for coll in self.db.collections())
+
+    def list_backups(self) -> list:
+        """Các bản sao lưu hiện có (mới nhất trước), kèm manifest."""
+        if not os.path.isdir(self.backup_dir):
+            return []
+        backups = []
+        for name in sorted(os.listdir(self.backup_dir), reverse=True):
+            manifest_path = os.path.join(self.backup_dir, name, MANIFEST_FILE)
+            if os.path.exists(manifest_path):
+                with open(manifest_path, encoding='utf-8') as f:
+                    backups.append({'name': name, **json.load(f)})
+        return backups
+
+    # --------------------------------------------------------------------------
+    # SAO LƯU
+    # --------------------------------------------------------------------------
+
+    def _partition_queries(self, collection: str, read_time: datetime) -> list:
+        """Các truy vấn (theo thứ tự mã tài liệu) phủ kín collection: một truy vấn, hoặc một truy vấn mỗi phân vùng nếu collection lớn."""
+        whole = self.db.collection(collection).order_by('__name__')
+        count = int(self.db.collection(collection).count().get(read_time=read_time)[0][0].value)
+        if count < PARTITION_MIN_DOCUMENTS:
+            return [whole]
+        partition_count = min(self.max_workers, -(-count // PARTITION_MIN_DOCUMENTS))
+        partitions = list(self.db.collection_group(collection).get_partitions(partition_count, read_time=read_time))
+        return [partition.query() for partition in partitions] or [whole]
+
+    def _dump_part(self, collection: str, query, path: str, read_time: datetime, progress: dict, lock: threading.Lock) -> int:
+        """Ghi các tài liệu của một truy vấn (một phân vùng) ra tệp phần gzip, đọc theo trang tại `read_time`."""
+        count = 0
+        page_query = query.limit(self.page_size)
+        with gzip.open(path, 'wb', compresslevel=6) as f:
+            last_doc = None
+            while True:
+                docs = list((page_query.start_after(last_doc) if last_doc else page_query).stream(read_time=read_time))
+                if not docs:
+                    break
+                # Truy vấn phân vùng là collection group: bỏ các subcollection trùng tên, chỉ giữ tài liệu gốc.
+                root_docs = [doc for doc in docs if doc.reference.parent.parent is None]
+                f.write(b"".join(
+                    json.dumps({'id': doc.id, 'data': encode_value(doc.to_dict())}, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b"\n"
+                    for doc in root_docs
+                ))
+                count += len(root_docs)
+                with lock:
+                    progress[collection] += len(root_docs)
+                last_doc = docs[-1]
+                if len(docs) < self.page_size:
+                    break
+        return count
+
+    def _assemble_collection(self, collection: str, folder: str, part_paths: list) -> dict:
+        """Nối các tệp phần (theo thứ tự phân vùng; gzip nhiều member vẫn là một tệp hợp lệ), rồi đếm và tính SHA-256."""
+        path = os.path.join(folder, f"{collection}{SNAPSHOT_SUFFIX}")
+        with open(path, 'wb') as out:
+            for part_path in part_paths:
+                with open(part_path, 'rb') as part:
+                    shutil.copyfileobj(part, out)
+                os.remove(part_path)
+        digest, count = hashlib.sha256(), 0
+        for line in self._iter_snapshot(path):
+            digest.update(line)
+            count += 1
+        return {'documents': count, 'sha256': digest.hexdigest(), 'file': os.path.basename(path)}
+
+    def create_backup(self, collections: list = None, progress_callback=None) -> dict:
+        """
+        Sao lưu các collection (mặc định: mọi collection gốc) song song, tại cùng một `read_time`.
+        progress_callback({collection: số tài liệu đã ghi}) được gọi trên luồng của người gọi.
+        Trả về {"success", "name", "read_time", "collections": {collection: {"documents", "sha256", "file"}}}.
+        """
+        collections = collections or self.list_collections()
+        name = datetime.now().strftime("%Y%m%d_%H%M%S")
+        folder = os.path.join(self.backup_dir, name)
+        os.makedirs(folder, exist_ok=True)
+        started_at = datetime.now()
+        read_time = snapshot_read_time()
+
+        progress, lock = {collection: 0 for collection in collections}, threading.Lock()
+        results, errors, parts = {}, {}, {}
+        for collection in collections:
+            try:
+                queries = self._partition_queries(collection, read_time)
+            except Exception as e:
+                errors[collection] = str(e)
+                logging.error(f"Lỗi khi chia phân vùng {collection}: {e}")
+                continue
+            parts[collection] = [(query, os.path.join(folder, f"{collection}.part{index:03d}{SNAPSHOT_SUFFIX}"))
+                                 for index, query in enumerate(queries)]
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="backup") as pool:
+            futures = {pool.submit(self._dump_part, collection, query, path, read_time, progress, lock): collection
+                       for collection, collection_parts in parts.items() for query, path in collection_parts}
+            self._wait_with_progress(futures, progress, lock, progress_callback)
+            for future, collection in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.setdefault(collection, str(e))
+                    logging.error(f"Lỗi khi sao lưu {collection}: {e}")
+
+        for collection, collection_parts in parts.items():
+            part_paths = [path for _, path in collection_parts]
+            if collection in errors:
+                for path in part_paths:
+                    if os.path.exists(path):
+                        os.remove(path)
+                continue
+            results[collection] = self._assemble_collection(collection, folder, part_paths)
+
+        manifest = {
+            'created_at': started_at.isoformat(), 'finished_at': datetime.now().isoformat(),
+            'read_time': read_time.isoformat(), 'collections': results, 'errors': errors,
+        }
+        with open(os.path.join(folder, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        total = sum(r['documents'] for r in results.values())
+        logging.info(f"Đã sao lưu {total} tài liệu từ {len(results)} collection vào {folder} (ảnh chụp lúc {read_time.isoformat()}).")
+        return {"success": not errors, "name": name, **manifest}
+
+    @staticmethod
+    def _wait_with_progress(futures, progress, lock, progress_callback, poll_interval: float = 0.5):
+        pending = set(futures)
+        while pending:
+            _, pending = wait(pending, timeout=poll_interval)
+            if progress_callback:
+                with lock:
+                    current = dict(progress)
+                progress_callback(current)
+
+    # --------------------------------------------------------------------------
+    # KIỂM TRA & KHÔI PHỤC
+    # --------------------------------------------------------------------------
+
+    def _iter_snapshot(self, path: str):
+        with gzip.open(path, 'rb') as f:
+            for line in f:
+                yield line
+
+    def verify_backup(self, name: str) -> dict:
+        """Đọc lại từng tệp và so số dòng + SHA-256 với manifest. Trả về {collection: None nếu khớp, hoặc mô tả lỗi}."""
+        folder = os.path.join(self.backup_dir, name)
+        with open(os.path.join(folder, MANIFEST_FILE), encoding='utf-8') as f:
+            manifest = json.load(f)
+        report = {}
+        for collection, expected in manifest['collections'].items():
+            digest, count = hashlib.sha256(), 0
+            try:
+                for line in self._iter_snapshot(os.path.join(folder, expected['file'])):
+                    digest.update(line)
+                    count += 1
+            except Exception as e:
+                report[collection] = f"không đọc được tệp: {e}"
+                continue
+            if count != expected['documents']:
+                report[collection] = f"số tài liệu {count} ≠ {expected['documents']}"
+            elif digest.hexdigest() != expected['sha256']:
+                report[collection] = "sai checksum"
+            else:
+                report[collection] = None
+        return report
+
+    def _restore_collection(self, folder: str, collection: str, spec: dict, progress: dict, lock: threading.Lock) -> dict:
+        writer = self.db.bulk_writer(options=BulkWriterOptions(
+            initial_ops_per_second=DEFAULT_INITIAL_OPS_PER_SECOND,
+            max_ops_per_second=DEFAULT_MAX_OPS_PER_SECOND,
+            mode=SendMode.parallel,
+        ))
+        failed = []
+
+        def on_error(failure, bulk_writer) -> bool:
+            if failure.code in RETRYABLE_CODES and failure.attempts < MAX_WRITE_ATTEMPTS:
+                return True
+            failed.append(failure.operation.reference.id)
+            logging.error(f"Không khôi phục được {failure.operation.reference.path}: {failure.message}")
+            return False
+
+        writer.on_write_error(on_error)
+        coll_ref = self.db.collection(collection)
+        written = 0
+        try:
+            for line in self._iter_snapshot(os.path.join(folder, spec['file'])):
+                record = json.loads(line)
+                writer.set(coll_ref.document(record['id']), decode_value(record['data'], self.db))
+                written += 1
+                if written % self.page_size == 0:
+                    with lock:
+                        progress[collection] = written
+        finally:
+            writer.close()
+        with lock:
+            progress[collection] = written
+        count = coll_ref.count().get()[0][0].value
+        return {'written': written - len(failed), 'failed': len(failed), 'count_after': int(count)}
+
+    def restore_backup(self, name: str, collections: list = None, progress_callback=None) -> dict:
+        """
+        Khôi phục bản sao lưu (ghi đè tài liệu cùng id, không xoá tài liệu phát sinh sau thời điểm sao lưu).
+        Checksum được kiểm tra trước khi ghi; collection nào sai checksum sẽ bị bỏ qua.
+        Sau khi ghi, số tài liệu trên Firestore được đếm lại để so với manifest.
+        """
+        folder = os.path.join(self.backup_dir, name)
+        with open(os.path.join(folder, MANIFEST_FILE), encoding='utf-8') as f:
+            manifest = json.load(f)
+        verification = self.verify_backup(name)
+        targets = [c for c in (collections or manifest['collections']) if c in manifest['collections']]
+        invalid = {c: verification[c] for c in targets if verification.get(c)}
+        targets = [c for c in targets if c not in invalid]
+
+        progress, lock = {collection: 0 for collection in targets}, threading.Lock()
+        results, errors = {}, dict(invalid)
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="restore") as pool:
+            futures = {pool.submit(self._restore_collection, folder, c, manifest['collections'][c], progress, lock): c for c in targets}
+            self._wait_with_progress(futures, progress, lock, progress_callback)
+            for future, collection in futures.items():
+                try:
+                    results[collection] = future.result()
+                except Exception as e:
+                    errors[collection] = str(e)
+                    logging.error(f"Lỗi khi khôi phục {collection}: {e}")
+
+        for collection, result in results.items():
+            if result['failed']:
+                errors[collection] = f"{result['failed']} tài liệu ghi lỗi"
+            elif result['count_after'] < manifest['collections'][collection]['documents']:
+                errors[collection] = f"sau khôi phục chỉ có {result['count_after']} tài liệu"
+        logging.info(f"Khôi phục bản sao lưu {name}: {len(results)} collection, {len(errors)} lỗi.")
+        return {"success": not errors, "collections": results, "errors": errors}
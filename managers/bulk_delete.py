@@ -0,0 +1,143 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions, SendMode
+
+from .projections import references_only
+
+DELETE_PAGE_SIZE = 500
+# BulkWriter tự tăng tốc độ từ mức ban đầu lên mức tối đa (quy tắc 500/50/5 của Firestore).
+DEFAULT_INITIAL_OPS_PER_SECOND = 500
+DEFAULT_MAX_OPS_PER_SECOND = 5000
+DEFAULT_PARALLEL_COLLECTIONS = 3
+MAX_WRITE_ATTEMPTS = 5
+# Mã lỗi gRPC nên thử lại: ABORTED (tranh chấp), UNAVAILABLE, DEADLINE_EXCEEDED, RESOURCE_EXHAUSTED.
+RETRYABLE_CODES = {10, 14, 4, 8}
+
+class DeletionProgress:
+    """Tiến độ xoá của một collection; được các luồng ghi cập nhật và luồng giao diện đọc."""
+    def __init__(self, collection: str, total=None):
+        self.collection = collection
+        self.total = total
+        self.queued = 0
+        self.deleted = 0
+        self.failed = 0
+        self.retried = 0
+        self.started_at = time.monotonic()
+        self.finished = False
+        self.error = None
+        self._lock = threading.Lock()
+
+    def add(self, **deltas):
+        with self._lock:
+            for name, value in deltas.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            elapsed = time.monotonic() - self.started_at
+            return {
+                'collection': self.collection, 'total': self.total, 'queued': self.queued,
+                'deleted': self.deleted, 'failed': self.failed, 'retried': self.retried,
+                'elapsed': elapsed, 'docs_per_second': self.deleted / elapsed if elapsed > 0 else 0.0,
+                'finished': self.finished, 'error': self.error,
+            }
+
+class BulkDeleteEngine:
+    """
+    Xoá toàn bộ tài liệu của các collection bằng BulkWriter của Firestore: đọc tham chiếu theo trang
+    (cursor, không kèm trường dữ liệu) và đẩy lệnh xoá vào BulkWriter, vốn gửi các lô song song,
+    tự tăng tốc độ dần (ramp-up) và thử lại khi gặp tranh chấp. Nhiều collection được xoá đồng thời.
+    """
+    def __init__(self, firebase_client, page_size: int = DELETE_PAGE_SIZE,
+                 initial_ops_per_second: int = DEFAULT_INITIAL_OPS_PER_SECOND,
+                 max_ops_per_second: int = DEFAULT_MAX_OPS_PER_SECOND,
+                 parallel_collections: int = DEFAULT_PARALLEL_COLLECTIONS):
+        self.db = firebase_client.db
+        self.page_size = page_size
+        self.initial_ops_per_second = initial_ops_per_second
+        self.max_ops_per_second = max(max_ops_per_second, initial_ops_per_second)
+        self.parallel_collections = parallel_collections
+
+    def count(self, collection: str):
+        """Đếm số tài liệu bằng truy vấn tổng hợp phía máy chủ (chạy thử, không xoá gì); None nếu không đếm được."""
+        try:
+            result = self.db.collection(collection).count().get()
+            return int(result[0][0].value)
+        except Exception as e:
+            logging.warning(f"Không đếm được số tài liệu của {collection}: {e}")
+            return None
+
+    def _bulk_writer(self, progress: DeletionProgress):
+        writer = self.db.bulk_writer(options=BulkWriterOptions(
+            initial_ops_per_second=self.initial_ops_per_second,
+            max_ops_per_second=self.max_ops_per_second,
+            mode=SendMode.parallel,
+        ))
+
+        def on_result(reference, result, bulk_writer):
+            progress.add(deleted=1)
+
+        def on_error(failure, bulk_writer) -> bool:
+            if failure.code in RETRYABLE_CODES and failure.attempts < MAX_WRITE_ATTEMPTS:
+                progress.add(retried=1)
+                return True
+            progress.add(failed=1)
+            logging.error(f"Không xoá được {failure.operation.reference.path}: {failure.message}")
+            return False
+
+        writer.on_write_result(on_result)
+        writer.on_write_error(on_error)
+        return writer
+
+    def delete_collection(self, collection: str, progress: DeletionProgress = None) -> DeletionProgress:
+        progress = progress or DeletionProgress(collection)
+        query = references_only(self.db.collection(collection).order_by('__name__').limit(self.page_size))
+        writer = self._bulk_writer(progress)
+        try:
+            last_doc = None
+            while True:
+                docs = list((query.start_after(last_doc) if last_doc else query).stream())
+                if not docs:
+                    break
+                for doc in docs:
+                    writer.delete(doc.reference)
+                progress.add(queued=len(docs))
+                last_doc = docs[-1]
+                if len(docs) < self.page_size:
+                    break
+        except Exception as e:
+            progress.error = str(e)
+            raise
+        finally:
+            writer.close()  # chờ các lệnh xoá đã xếp hàng hoàn tất
+            progress.finished = True
+        logging.info(f"Đã xoá {progress.deleted} tài liệu từ {collection} ({progress.failed} lỗi, {progress.retried} lần thử lại).")
+        return progress
+
+    def delete_collections(self, collections: list, dry_run: bool = False,
+                           progress_callback=None, poll_interval: float = 0.5) -> dict:
+        """
+        Xoá các collection song song (tối đa `parallel_collections` cùng lúc).
+        dry_run=True chỉ đếm số tài liệu sẽ bị xoá. progress_callback(danh sách snapshot tiến độ) được gọi
+        định kỳ trên luồng của người gọi, nên có thể cập nhật giao diện Streamlit trực tiếp.
+        Trả về {collection: snapshot tiến độ}.
+        """
+        progresses = {name: DeletionProgress(name, self.count(name)) for name in collections}
+        if dry_run:
+            for progress in progresses.values():
+                progress.finished = True
+            return {name: progress.snapshot() for name, progress in progresses.items()}
+
+        with ThreadPoolExecutor(max_workers=self.parallel_collections, thread_name_prefix="bulk-delete") as pool:
+            futures = [pool.submit(self.delete_collection, name, progresses[name]) for name in collections]
+            pending = set(futures)
+            while pending:
+                _, pending = wait(pending, timeout=poll_interval)
+                if progress_callback:
+                    progress_callback([progress.snapshot() for progress in progresses.values()])
+        for future in futures:
+            if future.exception():
+                logging.error(f"Lỗi khi xoá dữ liệu: {future.exception()}")
+        return {name: progress.snapshot() for name, progress in progresses.items()}
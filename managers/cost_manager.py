@@ -5,8 +5,12 @@ import logging
 import streamlit as st
 from google.cloud import firestore
 from dateutil.relativedelta import relativedelta
-from managers.image_handler import ImageHandler
+from managers.image_handler import get_image_handler
 from managers.category_manager import CategoryManager
+from managers.rollup_manager import RollupManager
+from managers.report_cache import get_daily_aggregate_cache
+from managers.projections import project
+from managers.query_executor import get_query_executor, day_bounds
 
 def hash_cost_manager(manager):
     return "CostManager"
@@ -14,12 +18,14 @@ def hash_cost_manager(manager):
 class CostManager:
     def __init__(self, firebase_client):
         self.db = firebase_client.db
+        self.executor = get_query_executor()
         self.entry_col = self.db.collection('cost_entries')
         self.transactions_col = self.db.collection('transactions') # Thêm collection mới
         self.allocation_rules_col = self.db.collection('cost_allocation_rules')
-        self._image_handler = None
+        self._firebase_client = firebase_client
         self.receipt_image_folder_id = st.secrets.get("drive_receipt_folder_id") or st.secrets.get("drive_folder_id")
         self.category_manager = CategoryManager(firebase_client) # Sử dụng CategoryManager
+        self.rollup_mgr = RollupManager(firebase_client)
 
     # --- Cost Group Methods (using CategoryManager) ---
     def get_all_cost_groups(self):
@@ -40,14 +46,7 @@ class CostManager:
 
     @property
     def image_handler(self):
-        if self._image_handler is None and "drive_oauth" in st.secrets:
-            try:
-                creds_info = dict(st.secrets["drive_oauth"])
-                if creds_info.get('refresh_token'):
-                    self._image_handler = ImageHandler(credentials_info=creds_info)
-            except Exception as e:
-                logging.error(f"Failed to initialize ImageHandler for costs: {e}")
-        return self._image_handler
+        return get_image_handler(self._firebase_client)
 
     def create_cost_entry(self, **kwargs):
         attachment_file = kwargs.pop('attachment_file', None)
@@ -66,23 +65,28 @@ class CostManager:
         try:
             batch = self.db.batch()
             now_iso = datetime.now().isoformat()
+            written_transactions = []
 
+            # Mọi tài liệu ghi kèm `recorded_at` (thời điểm ghi do máy chủ gán) để kho phân tích sao chép tăng dần,
+            # kể cả bút toán hạch toán lùi ngày (`entry_date`/`created_at` của transaction là ngày nghiệp vụ).
             if not kwargs.get('is_amortized') or kwargs.get('amortize_months', 0) <= 1:
                 entry_id = base_id
                 entry_data = {**kwargs, 'id': entry_id, 'created_at': now_iso, 'status': 'ACTIVE', 'source_entry_id': None}
                 entry_ref = self.entry_col.document(entry_id)
-                batch.set(entry_ref, entry_data)
+                batch.set(entry_ref, {**entry_data, 'recorded_at': firestore.SERVER_TIMESTAMP})
 
                 # Tạo một transaction tương ứng
                 trans_ref = self.transactions_col.document(entry_id)
                 trans_data = self._map_cost_to_transaction(entry_data)
-                batch.set(trans_ref, trans_data)
+                batch.set(trans_ref, {**trans_data, 'recorded_at': firestore.SERVER_TIMESTAMP})
+                self.rollup_mgr.apply_transaction(batch, trans_data)
+                written_transactions.append(trans_data)
 
             else: # Xử lý chi phí trả trước
                 source_entry_id = base_id
                 source_ref = self.entry_col.document(source_entry_id)
                 source_entry_data = {**kwargs, 'name': f"[TRẢ TRƯỚC] {kwargs['name']}", 'created_at': now_iso, 'status': 'AMORTIZED_SOURCE', 'id': source_entry_id}
-                batch.set(source_ref, source_entry_data)
+                batch.set(source_ref, {**source_entry_data, 'recorded_at': firestore.SERVER_TIMESTAMP})
                 # Không tạo transaction cho bút toán gốc của chi phí trả trước
 
                 monthly_amount = round(kwargs['amount'] / kwargs['amortize_months'], 2)
@@ -98,15 +102,19 @@ class CostManager:
                         'attachment_id': None, 'is_amortized': False, 'amortize_months': 0,
                         'created_at': now_iso, 'status': 'ACTIVE', 'source_entry_id': source_entry_id
                     }
-                    batch.set(child_ref, child_data)
+                    batch.set(child_ref, {**child_data, 'recorded_at': firestore.SERVER_TIMESTAMP})
                     
                     # Tạo transaction cho từng bút toán con hàng tháng
                     child_trans_ref = self.transactions_col.document(child_id)
                     child_trans_data = self._map_cost_to_transaction(child_data)
-                    batch.set(child_trans_ref, child_trans_data)
+                    batch.set(child_trans_ref, {**child_trans_data, 'recorded_at': firestore.SERVER_TIMESTAMP})
+                    self.rollup_mgr.apply_transaction(batch, child_trans_data)
+                    written_transactions.append(child_trans_data)
             
             batch.commit()
             self.query_cost_entries.clear()
+            for trans_data in written_transactions:
+                get_daily_aggregate_cache().invalidate_transaction(trans_data)
             return True, base_id
         except Exception as e:
             logging.error(f"Error creating cost entry: {e}")
@@ -126,13 +134,18 @@ class CostManager:
             # Xóa bút toán chi phí
             batch.delete(entry_ref)
             
-            # Xóa transaction tương ứng
+            # Xóa transaction tương ứng và trừ lại dữ liệu tổng hợp
             trans_ref = self.transactions_col.document(entry_id)
+            trans_doc = trans_ref.get()
             batch.delete(trans_ref)
+            if trans_doc.exists:
+                self.rollup_mgr.apply_transaction(batch, trans_doc.to_dict(), sign=-1)
 
             batch.commit()
             self.query_cost_entries.clear()
             self.get_cost_entry.clear()
+            if trans_doc.exists:
+                get_daily_aggregate_cache().invalidate_transaction(trans_doc.to_dict())
             return True, f"Đã xóa thành công bút toán {entry_id}."
         except Exception as e:
             logging.error(f"Error deleting cost entry {entry_id}: {e}")
@@ -194,23 +207,35 @@ class CostManager:
         doc = self.entry_col.document(entry_id).get()
         return doc.to_dict() if doc.exists else None
 
-    def query_cost_entries(self, filters=None):
+    def query_cost_entries(self, filters=None, full: bool = False):
         if filters is None: filters = {}
-        query = self.entry_col
-        if 'branch_ids' in filters and filters['branch_ids']:
-            query = query.where('branch_id', 'in', filters['branch_ids'])
-        if 'status' in filters:
-            query = query.where('status', '==', filters['status'])
-        if filters.get('source_entry_id_is_null'):
-            query = query.where('source_entry_id', '==', None)
-        if 'start_date' in filters:
-            query = query.where('entry_date', '>=', filters['start_date'])
-        if 'end_date' in filters:
-            query = query.where('entry_date', '<=', filters['end_date'])
-        try:
+        # `entry_date` là chuỗi ngày ('YYYY-MM-DD', bút toán phân bổ có thêm 'T00:00:00'): chia lát theo ngày, không theo giờ.
+        start = datetime.fromisoformat(filters['start_date']).date() if 'start_date' in filters else None
+        end = datetime.fromisoformat(filters['end_date']).date() if 'end_date' in filters else None
+
+        def build_query(branch_chunk, slice_start, slice_end):
+            query = self.entry_col
+            if branch_chunk:
+                query = query.where('branch_id', 'in', branch_chunk)
+            if 'status' in filters:
+                query = query.where('status', '==', filters['status'])
+            if filters.get('source_entry_id_is_null'):
+                query = query.where('source_entry_id', '==', None)
+            # Chỉ một đầu mút được truyền: khoảng mở phía còn lại, không chia lát thời gian.
+            lower, upper = day_bounds(slice_start or start, slice_end or end)
+            if lower is not None:
+                query = query.where('entry_date', '>=', lower)
+            if upper is not None:
+                query = query.where('entry_date', '<', upper)
             query = query.order_by('entry_date', direction=firestore.Query.DESCENDING)
-            docs = query.stream()
-            return [doc.to_dict() for doc in docs]
+            return project(query, 'cost_entries.list', full=full)
+
+        try:
+            sliced = start is not None and end is not None
+            return self.executor.run(
+                build_query, filters.get('branch_ids'), start if sliced else None, end if sliced else None,
+                descending=True, sort_key=lambda entry: entry.get('entry_date', ''), mapper=lambda doc: doc.to_dict()
+            )
         except Exception as e:
             logging.error(f"Error querying cost entries: {e}")
             return []
@@ -0,0 +1,195 @@
+import os
+import csv
+import gzip
+import logging
+import tempfile
+from datetime import datetime, time
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # openpyxl là phụ thuộc tuỳ chọn, chỉ cần khi xuất định dạng XLSX
+    Workbook = None
+
+EXPORT_FORMATS = {
+    'csv': {'suffix': '.csv', 'mime': 'text/csv'},
+    'csv.gz': {'suffix': '.csv.gz', 'mime': 'application/gzip'},
+    'xlsx': {'suffix': '.xlsx', 'mime': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'},
+}
+
+# Mỗi dòng xuất ra là một dòng hàng của giao dịch (giao dịch không có dòng hàng, ví dụ chi phí, vẫn có một dòng).
+TRANSACTION_EXPORT_COLUMNS = [
+    'transaction_id', 'created_at', 'type', 'status', 'branch_id', 'cashier_id', 'customer_id', 'payment_method',
+    'sub_total', 'discount_amount', 'total_amount', 'total_cogs',
+    'line_no', 'sku', 'name', 'quantity', 'original_price', 'final_price', 'line_revenue', 'line_cogs',
+]
+
+XLSX_MAX_ROWS_PER_SHEET = 1_048_575  # giới hạn của Excel, trừ dòng tiêu đề
+EXPORT_FILE_PREFIX = "nkpos_export_"
+# Tệp xuất của phiên đã đóng (hoặc tiến trình bị dừng) không ai xoá: dọn các tệp cũ hơn ngưỡng này mỗi lần xuất.
+EXPORT_FILE_MAX_AGE_HOURS = 6
+
+def _cell(value):
+    """Chuẩn hoá giá trị để ghi ra CSV/XLSX (Timestamp Firestore có múi giờ -> chuỗi ISO)."""
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ', timespec='seconds')
+    return value
+
+class _CsvSink:
+    def __init__(self, path: str, compress: bool):
+        # Có BOM ở cả CSV thường và CSV nén: Excel mới nhận đúng tiếng Việt khi mở tệp đã giải nén.
+        self._file = gzip.open(path, 'wt', newline='', encoding='utf-8-sig') if compress else open(path, 'w', newline='', encoding='utf-8-sig')
+        self._writer = csv.writer(self._file)
+
+    def write(self, row: list):
+        self._writer.writerow(row)
+
+    def close(self):
+        self._file.close()
+
+class _XlsxSink:
+    """Ghi XLSX ở chế độ write-only của openpyxl: các dòng được đẩy ra đĩa ngay, bộ nhớ không tăng theo số dòng."""
+    def __init__(self, path: str, header: list):
+        if Workbook is None:
+            raise ImportError("Cần cài đặt 'openpyxl' để xuất định dạng XLSX.")
+        self.path = path
+        self.header = header
+        self._workbook = Workbook(write_only=True)
+        self._sheet = None
+        self._rows_in_sheet = XLSX_MAX_ROWS_PER_SHEET
+
+    def write(self, row: list):
+        if self._rows_in_sheet >= XLSX_MAX_ROWS_PER_SHEET:
+            self._sheet = self._workbook.create_sheet(title=f"Giao dịch {len(self._workbook.worksheets) + 1}")
+            self._sheet.append(self.header)
+            self._rows_in_sheet = 0
+        self._sheet.append(row)
+        self._rows_in_sheet += 1
+
+    def close(self):
+        self._workbook.save(self.path)
+
+class ExportManager:
+    """
+    Xuất giao dịch theo khoảng ngày ra tệp tạm (CSV, CSV nén gzip hoặc XLSX) theo kiểu streaming:
+    đọc Firestore theo trang bằng cursor, tách từng dòng hàng và ghi ngay ra đĩa,
+    nên bộ nhớ dùng gần như không đổi dù xuất hàng triệu dòng.
+    """
+    def __init__(self, firebase_client, page_size: int = 500, export_dir: str = None):
+        self.db = firebase_client.db
+        self.transactions_col = self.db.collection('transactions')
+        self.page_size = page_size
+        self.export_dir = export_dir or tempfile.gettempdir()
+
+    def cleanup_stale_exports(self, max_age_hours: float = EXPORT_FILE_MAX_AGE_HOURS) -> int:
+        """Xoá các tệp xuất bị bỏ lại (quá `max_age_hours`) trong thư mục xuất. Trả về số tệp đã xoá."""
+        cutoff = datetime.now().timestamp() - max_age_hours * 3600
+        removed = 0
+        try:
+            file_names = os.listdir(self.export_dir)
+        except OSError:
+            return 0
+        for file_name in file_names:
+            path = os.path.join(self.export_dir, file_name)
+            try:
+                if file_name.startswith(EXPORT_FILE_PREFIX) and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError as e:
+                logging.warning(f"Không xoá được tệp xuất cũ {path}: {e}")
+        return removed
+
+    def _range_query(self, start_date, end_date, branch_id: str = None):
+        start_datetime = datetime.combine(start_date, time.min) if not isinstance(start_date, datetime) else start_date
+        end_datetime = datetime.combine(end_date, time.max) if not isinstance(end_date, datetime) else end_date
+        query = self.transactions_col.where('created_at', '>=', start_datetime).where('created_at', '<=', end_datetime)
+        if branch_id:
+            query = query.where('branch_id', '==', branch_id)
+        return query
+
+    def count_transactions(self, start_date, end_date, branch_id: str = None):
+        """Đếm số giao dịch bằng truy vấn tổng hợp phía máy chủ; trả về None nếu không đếm được."""
+        try:
+            result = self._range_query(start_date, end_date, branch_id).count().get()
+            return int(result[0][0].value)
+        except Exception as e:
+            logging.warning(f"Không đếm được số giao dịch cần xuất: {e}")
+            return None
+
+    def iter_transaction_pages(self, start_date, end_date, branch_id: str = None):
+        """Sinh ra từng trang tài liệu giao dịch (theo created_at tăng dần), tiếp tục bằng cursor start_after."""
+        query = self._range_query(start_date, end_date, branch_id).order_by('created_at').limit(self.page_size)
+        last_doc = None
+        while True:
+            page_query = query.start_after(last_doc) if last_doc else query
+            docs = list(page_query.stream())
+            if not docs:
+                break
+            yield docs
+            last_doc = docs[-1]
+            if len(docs) < self.page_size:
+                break
+
+    @staticmethod
+    def flatten_transaction(doc_id: str, trans_data: dict):
+        """Tách một giao dịch thành các dòng theo TRANSACTION_EXPORT_COLUMNS, mỗi dòng hàng một dòng."""
+        header = [
+            trans_data.get('id', doc_id), _cell(trans_data.get('created_at')), trans_data.get('type'), trans_data.get('status'),
+            trans_data.get('branch_id'), trans_data.get('cashier_id'), trans_data.get('customer_id'), trans_data.get('payment_method'),
+            trans_data.get('sub_total'), trans_data.get('discount_amount'), trans_data.get('total_amount'), trans_data.get('total_cogs'),
+        ]
+        items = trans_data.get('items') or []
+        if not items:
+            yield header + [None] * 8
+            return
+        for line_no, item in enumerate(items, start=1):
+            quantity = item.get('quantity', 0)
+            final_price = item.get('final_price', 0)
+            yield header + [
+                line_no, item.get('sku'), item.get('name'), quantity, item.get('original_price'), final_price,
+                final_price * quantity, item.get('line_cogs'),
+            ]
+
+    def export_transactions(self, start_date, end_date, branch_id: str = None, fmt: str = 'csv', progress_callback=None):
+        """
+        Xuất giao dịch ra tệp tạm. progress_callback(số_giao_dịch_đã_xử_lý, tổng_số_hoặc_None) được gọi sau mỗi trang.
+        Trả về {"success", "path", "file_name", "mime", "rows", "transactions"}; người gọi chịu trách nhiệm xoá tệp.
+        """
+        if fmt not in EXPORT_FORMATS:
+            return {"success": False, "message": f"Định dạng không hỗ trợ: {fmt}"}
+        spec = EXPORT_FORMATS[fmt]
+        file_name = f"giao_dich_{start_date:%Y%m%d}_{end_date:%Y%m%d}{spec['suffix']}"
+        self.cleanup_stale_exports()
+        fd, path = tempfile.mkstemp(prefix=EXPORT_FILE_PREFIX, suffix=spec['suffix'], dir=self.export_dir)
+        os.close(fd)
+
+        transactions_done, rows_written, completed = 0, 0, False
+        try:
+            total = self.count_transactions(start_date, end_date, branch_id) if progress_callback else None
+            sink = _XlsxSink(path, TRANSACTION_EXPORT_COLUMNS) if fmt == 'xlsx' else _CsvSink(path, compress=fmt == 'csv.gz')
+            try:
+                if fmt != 'xlsx':
+                    sink.write(TRANSACTION_EXPORT_COLUMNS)
+                for docs in self.iter_transaction_pages(start_date, end_date, branch_id):
+                    for doc in docs:
+                        for row in self.flatten_transaction(doc.id, doc.to_dict()):
+                            sink.write(row)
+                            rows_written += 1
+                    transactions_done += len(docs)
+                    if progress_callback:
+                        progress_callback(transactions_done, total)
+            finally:
+                sink.close()
+            completed = True
+        except Exception as e:
+            logging.error(f"Lỗi khi xuất giao dịch: {e}")
+            return {"success": False, "message": str(e)}
+        finally:
+            # Xoá tệp dở dang với mọi lỗi, kể cả khi lượt chạy bị Streamlit ngắt giữa chừng (rerun/stop).
+            if not completed and os.path.exists(path):
+                os.remove(path)
+
+        logging.info(f"Đã xuất {transactions_done} giao dịch ({rows_written} dòng) ra {path}.")
+        return {
+            "success": True, "path": path, "file_name": file_name, "mime": spec['mime'],
+            "rows": rows_written, "transactions": transactions_done,
+        }
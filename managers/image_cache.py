@@ -0,0 +1,204 @@
+import os
+import re
+import mmap
+import logging
+import threading
+from collections import OrderedDict
+import streamlit as st
+
+DEFAULT_IMAGE_CACHE_DIR = os.path.join("data", "image_cache")
+DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+DEFAULT_DISK_BYTES = 1024 * 1024 * 1024
+_SAFE_KEY = re.compile(r"[^A-Za-z0-9_.-]")
+
+class MemoryLRU:
+    """LRU trong bộ nhớ giới hạn theo tổng số byte (không theo số phần tử)."""
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+            return data
+
+    def put(self, key: str, data: bytes) -> int:
+        """Thêm một mục, trả về số mục bị loại ra để nhường chỗ."""
+        if len(data) > self.max_bytes:
+            return 0
+        evicted = 0
+        with self._lock:
+            if key in self._items:
+                self.size -= len(self._items.pop(key))
+            self._items[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, old = self._items.popitem(last=False)
+                self.size -= len(old)
+                evicted += 1
+        return evicted
+
+    def discard(self, key: str):
+        with self._lock:
+            data = self._items.pop(key, None)
+            if data is not None:
+                self.size -= len(data)
+
+    def __len__(self):
+        return len(self._items)
+
+class DiskImageStore:
+    """
+    Kho ảnh trên đĩa, mỗi khoá một tệp (chia thư mục con theo 2 ký tự đầu), đọc bằng mmap.
+    Ghi nguyên tử qua tệp tạm + os.replace; vượt `max_bytes` thì xoá các tệp ít được dùng gần đây nhất.
+    """
+    def __init__(self, root_dir: str, max_bytes: int):
+        self.root_dir = root_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.size = self._scan_size()
+
+    def _path(self, key: str) -> str:
+        safe_key = _SAFE_KEY.sub("_", key)
+        return os.path.join(self.root_dir, safe_key[:2], f"{safe_key}.bin")
+
+    def _files(self):
+        if not os.path.isdir(self.root_dir):
+            return
+        for sub_dir, _, file_names in os.walk(self.root_dir):
+            for file_name in file_names:
+                if file_name.endswith('.bin'):
+                    yield os.path.join(sub_dir, file_name)
+
+    def _scan_size(self) -> int:
+        return sum(os.path.getsize(path) for path in self._files())
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return None
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    data = mapped[:]
+            os.utime(path)  # đánh dấu vừa dùng để việc dọn dẹp ưu tiên giữ lại
+            return data
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logging.warning(f"Không đọc được ảnh trong bộ đệm đĩa {path}: {e}")
+            return None
+
+    def put(self, key: str, data: bytes) -> int:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            self.size += len(data) - previous
+            return self._evict_if_needed() if self.size > self.max_bytes else 0
+
+    def discard(self, key: str):
+        path = self._path(key)
+        with self._lock:
+            if os.path.exists(path):
+                self.size -= os.path.getsize(path)
+                os.remove(path)
+
+    def _evict_if_needed(self) -> int:
+        # Dọn xuống 90% dung lượng để không phải quét thư mục sau mỗi lần ghi.
+        target = int(self.max_bytes * 0.9)
+        entries = sorted(((os.stat(path), path) for path in self._files()), key=lambda entry: entry[0].st_mtime)
+        evicted = 0
+        for stat, path in entries:
+            if self.size <= target:
+                break
+            try:
+                os.remove(path)
+                self.size -= stat.st_size
+                evicted += 1
+            except OSError:
+                pass
+        return evicted
+
+class ImageCache:
+    """
+    Bộ đệm ảnh hai tầng theo Drive file id: LRU trong bộ nhớ (giới hạn theo byte) phía trước kho mmap trên đĩa.
+    Chỉ giữ một bản byte gốc của ảnh; dữ liệu trên đĩa còn nguyên sau khi khởi động lại.
+    """
+    def __init__(self, root_dir: str = DEFAULT_IMAGE_CACHE_DIR, memory_bytes: int = DEFAULT_MEMORY_BYTES,
+                 disk_bytes: int = DEFAULT_DISK_BYTES):
+        self.memory = MemoryLRU(memory_bytes)
+        self.disk = DiskImageStore(root_dir, disk_bytes)
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'memory_evictions': 0, 'disk_evictions': 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, **deltas):
+        with self._stats_lock:
+            for name, value in deltas.items():
+                self._stats[name] += value
+
+    def get(self, key: str, loader=None):
+        """
+        Trả về byte ảnh của `key`; nếu không có ở cả hai tầng thì gọi loader() (nếu có) và lưu kết quả.
+        Kết quả None của loader không được lưu, lần sau sẽ thử tải lại.
+        """
+        data = self.memory.get(key)
+        if data is not None:
+            self._count(memory_hits=1)
+            return data
+        data = self.disk.get(key)
+        if data is not None:
+            self._count(disk_hits=1, memory_evictions=self.memory.put(key, data))
+            return data
+        self._count(misses=1)
+        if loader is None:
+            return None
+        data = loader()
+        if data:
+            self.put(key, data)
+        return data
+
+    def put(self, key: str, data: bytes):
+        data = bytes(data)
+        memory_evictions = self.memory.put(key, data)
+        try:
+            disk_evictions = self.disk.put(key, data)
+        except OSError as e:
+            logging.warning(f"Không ghi được ảnh {key} vào bộ đệm đĩa: {e}")
+            disk_evictions = 0
+        self._count(memory_evictions=memory_evictions, disk_evictions=disk_evictions)
+
+    def contains(self, key: str) -> bool:
+        return self.memory.get(key) is not None or os.path.exists(self.disk._path(key))
+
+    def invalidate(self, key: str):
+        self.memory.discard(key)
+        self.disk.discard(key)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        return {
+            **stats,
+            'hit_rate': (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0,
+            'memory_items': len(self.memory), 'memory_bytes': self.memory.size, 'memory_max_bytes': self.memory.max_bytes,
+            'disk_bytes': self.disk.size, 'disk_max_bytes': self.disk.max_bytes,
+        }
+
+@st.cache_resource
+def get_image_cache() -> ImageCache:
+    """Một bộ đệm ảnh dùng chung cho toàn tiến trình; dung lượng cấu hình qua secrets (MB)."""
+    return ImageCache(
+        root_dir=st.secrets.get("image_cache_dir", DEFAULT_IMAGE_CACHE_DIR),
+        memory_bytes=int(st.secrets.get("image_cache_memory_mb", DEFAULT_MEMORY_BYTES // (1024 * 1024))) * 1024 * 1024,
+        disk_bytes=int(st.secrets.get("image_cache_disk_mb", DEFAULT_DISK_BYTES // (1024 * 1024))) * 1024 * 1024,
+    )
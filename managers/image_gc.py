@@ -0,0 +1,168 @@
+import time
+import logging
+from datetime import datetime, timedelta, timezone
+import streamlit as st
+from googleapiclient.errors import HttpError
+
+from .image_cache import get_image_cache
+from .image_index import IMAGE_INDEX_COLLECTION
+from .image_server import VARIANTS, variant_cache_key
+from .projections import project
+
+LIST_PAGE_SIZE = 1000
+DELETE_BATCH_SIZE = 100  # giới hạn số lệnh trong một batch HTTP của Drive
+MAX_DELETE_ATTEMPTS = 4
+RETRY_BASE_DELAY = 2  # giây; lần thử thứ n chờ RETRY_BASE_DELAY * 2^(n-1)
+RETRYABLE_STATUSES = {403, 429, 500, 502, 503}  # 403 của Drive là vượt hạn mức (rate limit)
+# Ảnh vừa tải lên có thể chưa kịp ghi vào tài liệu (hàng đợi upload, tạo sản phẩm dở dang): không xoá ảnh mới.
+DEFAULT_MIN_AGE_HOURS = 24
+IMAGE_REFERENCES = (('products', 'products.image_ref', 'image_id'),
+                    ('cost_entries', 'cost_entries.attachment_ref', 'attachment_id'))
+
+class DriveImageGC:
+    """
+    Dọn ảnh mồ côi trên Drive: liệt kê các thư mục ảnh (files().list phân trang), gom mọi `image_id`/`attachment_id`
+    còn được `products` và `cost_entries` tham chiếu (truy vấn projection, chỉ đọc một trường), rồi xoá phần chênh lệch
+    bằng batch HTTP của Drive (100 lệnh mỗi request), thử lại các lệnh bị giới hạn tốc độ.
+    Mục chỉ mục nội dung ảnh và bộ đệm của tệp đã xoá cũng được dọn theo.
+    """
+    def __init__(self, firebase_client):
+        self.db = firebase_client.db
+        self.index_col = self.db.collection(IMAGE_INDEX_COLLECTION)
+
+    @staticmethod
+    def folder_ids() -> list:
+        """Các thư mục ảnh đang cấu hình (sản phẩm, chứng từ), bỏ trùng."""
+        folders = [st.secrets.get("drive_product_folder_id") or st.secrets.get("drive_folder_id"),
+                   st.secrets.get("drive_receipt_folder_id") or st.secrets.get("drive_folder_id")]
+        return list(dict.fromkeys(f for f in folders if f))
+
+    def list_drive_files(self, drive_service, folder_id: str):
+        """Duyệt mọi tệp (chưa vào thùng rác) trong một thư mục Drive, mỗi trang LIST_PAGE_SIZE tệp."""
+        page_token = None
+        while True:
+            response = drive_service.files().list(
+                q=f"'{folder_id}' in parents and trashed = false",
+                fields="nextPageToken, files(id, name, size, createdTime)",
+                pageSize=LIST_PAGE_SIZE, pageToken=page_token,
+            ).execute()
+            yield from response.get('files', [])
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return
+
+    def referenced_ids(self) -> set:
+        referenced = set()
+        for collection, projection, field in IMAGE_REFERENCES:
+            for doc in project(self.db.collection(collection), projection).stream():
+                file_id = (doc.to_dict() or {}).get(field)
+                if file_id:
+                    referenced.add(file_id)
+        return referenced
+
+    def find_orphans(self, drive_service, min_age_hours: float = DEFAULT_MIN_AGE_HOURS, progress_callback=None) -> dict:
+        """Trả về {"scanned", "referenced", "skipped_recent", "orphans": [tệp Drive]} mà không xoá gì."""
+        referenced = self.referenced_ids()
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=min_age_hours)
+        scanned, skipped_recent, orphans = 0, 0, []
+        for folder_id in self.folder_ids():
+            for drive_file in self.list_drive_files(drive_service, folder_id):
+                scanned += 1
+                if progress_callback and scanned % LIST_PAGE_SIZE == 0:
+                    progress_callback(scanned)
+                if drive_file['id'] in referenced:
+                    continue
+                created = datetime.fromisoformat(drive_file['createdTime'].replace('Z', '+00:00'))
+                if created > cutoff:
+                    skipped_recent += 1
+                    continue
+                orphans.append(drive_file)
+        return {"scanned": scanned, "referenced": len(referenced), "skipped_recent": skipped_recent, "orphans": orphans}
+
+    def _delete_batch(self, drive_service, file_ids: list) -> tuple:
+        """Xoá một nhóm ≤ DELETE_BATCH_SIZE tệp trong một request. Trả về (đã xoá, {file_id: lỗi có thể thử lại}, {file_id: lỗi})."""
+        deleted, retryable, failed = [], {}, {}
+
+        def _on_response(request_id, _, exception):
+            if exception is None:
+                deleted.append(request_id)
+            elif isinstance(exception, HttpError) and exception.resp.status == 404:
+                deleted.append(request_id)  # đã bị xoá từ trước
+            elif isinstance(exception, HttpError) and exception.resp.status in RETRYABLE_STATUSES:
+                retryable[request_id] = str(exception)
+            else:
+                failed[request_id] = str(exception)
+
+        batch = drive_service.new_batch_http_request(callback=_on_response)
+        for file_id in file_ids:
+            batch.add(drive_service.files().delete(fileId=file_id), request_id=file_id)
+        batch.execute()
+        return deleted, retryable, failed
+
+    def delete_files(self, drive_service, file_ids: list, progress_callback=None) -> dict:
+        deleted, failed = [], {}
+        for start in range(0, len(file_ids), DELETE_BATCH_SIZE):
+            pending = file_ids[start:start + DELETE_BATCH_SIZE]
+            for attempt in range(1, MAX_DELETE_ATTEMPTS + 1):
+                done, retryable, errors = self._delete_batch(drive_service, pending)
+                deleted.extend(done)
+                failed.update(errors)
+                pending = list(retryable)
+                if not pending:
+                    break
+                if attempt == MAX_DELETE_ATTEMPTS:
+                    failed.update(retryable)
+                else:
+                    time.sleep(RETRY_BASE_DELAY * 2 ** (attempt - 1))
+            if progress_callback:
+                progress_callback(min(start + DELETE_BATCH_SIZE, len(file_ids)), len(file_ids))
+        self._forget(deleted)
+        return {"deleted": deleted, "failed": failed}
+
+    def _forget(self, file_ids: list):
+        """Gỡ các tệp đã xoá khỏi chỉ mục nội dung ảnh và bộ đệm ảnh."""
+        deleted = set(file_ids)
+        if not deleted:
+            return
+        batch, pending = self.db.batch(), 0
+        for doc in self.index_col.select(['file_id']).stream():
+            if (doc.to_dict() or {}).get('file_id') in deleted:
+                batch.delete(doc.reference)
+                pending += 1
+                if pending == 500:
+                    batch.commit()
+                    batch, pending = self.db.batch(), 0
+        if pending:
+            batch.commit()
+        cache = get_image_cache()
+        for file_id in deleted:
+            for variant in VARIANTS:
+                cache.invalidate(variant_cache_key(file_id, variant))
+
+    def run(self, image_handler, dry_run: bool = True, min_age_hours: float = DEFAULT_MIN_AGE_HOURS,
+            progress_callback=None) -> dict:
+        """
+        Tìm (và nếu không phải dry_run thì xoá) ảnh mồ côi. progress_callback(phase, done, total) với phase là
+        'scan' (total = None) hoặc 'delete'. Trả về {"success", "scanned", "referenced", "skipped_recent",
+        "orphans", "orphan_bytes", "deleted", "failed"}.
+        """
+        if not image_handler or not image_handler.drive_service:
+            return {"success": False, "message": "Dịch vụ Google Drive chưa được khởi tạo."}
+        if not self.folder_ids():
+            return {"success": False, "message": "Chưa cấu hình thư mục ảnh trên Drive."}
+        drive_service = image_handler.drive_service
+        started = time.monotonic()
+        try:
+            scan_progress = (lambda scanned: progress_callback('scan', scanned, None)) if progress_callback else None
+            result = self.find_orphans(drive_service, min_age_hours, scan_progress)
+            orphans = result['orphans']
+            result.update(success=True, orphan_bytes=sum(int(f.get('size') or 0) for f in orphans), deleted=[], failed={})
+            if not dry_run and orphans:
+                delete_progress = (lambda done, total: progress_callback('delete', done, total)) if progress_callback else None
+                result.update(self.delete_files(drive_service, [f['id'] for f in orphans], delete_progress))
+        except HttpError as e:
+            logging.error(f"Lỗi Drive khi dọn ảnh mồ côi: {e}")
+            return {"success": False, "message": str(e)}
+        logging.info(f"Dọn ảnh mồ côi{' (thử)' if dry_run else ''}: quét {result['scanned']:,} tệp, {len(result['orphans']):,} mồ côi, "
+                     f"xoá {len(result['deleted']):,}, lỗi {len(result['failed']):,} trong {time.monotonic() - started:.1f}s.")
+        return result
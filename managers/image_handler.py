@@ -1,25 +1,58 @@
 
 import streamlit as st
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
+from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload, build_http
 import io
-from PIL import Image
+import queue
 import logging
 from datetime import datetime
+import threading
+import google_auth_httplib2
+from managers.image_cache import get_image_cache
+from managers.image_index import ImageIndex, content_hash
+from managers.image_pipeline import optimize_image
+from managers.image_prefetcher import get_image_prefetcher
+from managers.image_server import VARIANTS, start_image_server, variant_cache_key
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def hash_image_handler(handler):
-    """A hash function for st.cache_data to handle the ImageHandler instance."""
-    return "ImageHandler_Singleton"
+DEFAULT_DRIVE_HTTP_POOL_SIZE = 8
+
+class AuthorizedHttpPool:
+    """
+    A bounded pool of authorized httplib2 connections that stands in for the `http` object of the Drive service.
+    httplib2 is not thread-safe, so each HTTP call checks a connection out for its duration and returns it;
+    at most `size` connections ever exist, however many threads (Streamlit reruns, prefetch workers,
+    image server handlers) call Drive.
+    """
+    def __init__(self, credentials, size: int = DEFAULT_DRIVE_HTTP_POOL_SIZE):
+        self.credentials = credentials  # read by googleapiclient to refresh tokens for batch requests
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def request(self, *args, **kwargs):
+        with self._slots:
+            try:
+                http = self._idle.get_nowait()
+            except queue.Empty:
+                http = google_auth_httplib2.AuthorizedHttp(self.credentials, http=build_http())
+            try:
+                return http.request(*args, **kwargs)
+            finally:
+                self._idle.put(http)
 
 class ImageHandler:
-    """Manages image operations with Google Drive, including uploading and private loading."""
-    def __init__(self, credentials_info):
+    """
+    Manages image operations with Google Drive, including uploading and private loading.
+    With an `image_index` (ImageIndex), uploads are deduplicated by content hash and Drive files are reference-counted.
+    """
+    def __init__(self, credentials_info, image_index=None):
+        self.image_index = image_index
         self.drive_service = self._initialize_drive_service(credentials_info)
 
     def _initialize_drive_service(self, credentials_info):
@@ -33,30 +66,50 @@ class ImageHandler:
                 client_secret=credentials_info['client_secret'],
                 scopes=credentials_info.get('scopes', ['https://www.googleapis.com/auth/drive.file'])
             )
-            return build('drive', 'v3', credentials=creds)
+            # Build from the discovery document bundled with google-api-python-client (no network round-trip);
+            # every request borrows a connection from a bounded pool (see AuthorizedHttpPool).
+            http = AuthorizedHttpPool(creds, size=int(st.secrets.get("drive_http_pool_size", DEFAULT_DRIVE_HTTP_POOL_SIZE)))
+            discovery_doc = get_static_doc('drive', 'v3')
+            if discovery_doc:
+                return build_from_document(discovery_doc, http=http)
+            return build('drive', 'v3', http=http, cache_discovery=False)
         except Exception as e:
             logger.error(f"Failed to initialize Google Drive service: {e}")
             st.error(f"Lỗi cấu hình Google Drive: {e}")
             return None
 
-    @st.cache_data(show_spinner=False, hash_funcs={object: hash_image_handler})
-    def load_drive_image(_self, file_id: str) -> bytes | None:
+    def load_drive_image(self, file_id: str) -> bytes | None:
         """
         Loads a private image from Google Drive using its file_id.
         The image data is returned as bytes, suitable for st.image().
-        This method is cached to prevent redundant downloads.
+        Served from the shared two-tier image cache (memory LRU + disk), downloading only on a miss.
         """
-        if not _self.drive_service or not file_id:
+        if not self.drive_service or not file_id:
             logger.warning("Drive service not initialized or file_id is missing for loading.")
             return None
+        return get_image_prefetcher().fetch(file_id, lambda: self.download_drive_file(file_id))
+
+    def image_src(self, file_id: str, variant: str = 'card'):
+        """
+        What to pass to st.image(): a browser-cacheable URL on the local image server for the given size variant
+        ('thumb', 'card' or 'full'), or the image bytes when the server is not running. None if there is no image.
+        """
+        if not self.drive_service or not file_id:
+            return None
+        server = start_image_server(self)
+        if server:
+            return server.url(file_id, variant)
+        return self.load_drive_image(file_id)
+
+    def download_drive_file(self, file_id: str) -> bytes | None:
+        """Downloads a file's bytes from Drive, bypassing the cache. Safe to call from worker threads."""
         try:
-            request = _self.drive_service.files().get_media(fileId=file_id)
+            request = self.drive_service.files().get_media(fileId=file_id)
             fh = io.BytesIO()
             downloader = MediaIoBaseDownload(fh, request)
             done = False
             while not done:
                 status, done = downloader.next_chunk()
-            fh.seek(0)
             return fh.getvalue()
         except HttpError as error:
             logger.error(f"Error loading image {file_id}: {error}")
@@ -65,46 +118,59 @@ class ImageHandler:
     def upload_image(self, image_file, folder_id: str, base_filename: str) -> str | None:
         """
         Optimizes, and uploads an image to a specified Google Drive folder.
-        Returns the file_id of the newly created file.
+        Returns the file_id of the newly created file, or of an existing file with identical content
+        (each call adds one reference; release it with delete_image_by_id).
         """
         if not self.drive_service:
             st.error("Dịch vụ Google Drive chưa được khởi tạo.")
             return None
 
-        # 1. Generate a unique filename
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        unique_filename = f"{base_filename}_{timestamp}.jpg"
-
-        # 2. Optimize the image
+        # 1. Optimize the image (format configurable via secrets `image_output_format`: JPEG, WEBP or AVIF)
         try:
-            optimized_bytes = self._optimize_image(image_file, max_width=1024, quality=80)
+            optimized_bytes, mimetype, extension = self._optimize_image(image_file, max_width=1024, quality=80)
         except Exception as e:
             st.error(f"Lỗi khi tối ưu hóa ảnh: {e}")
             return None
+
+        # 2. Reuse an already uploaded file with the same optimized content
+        digest = content_hash(optimized_bytes.getvalue())
+        if self.image_index:
+            try:
+                existing_id = self.image_index.acquire(digest)
+                if existing_id:
+                    logger.info(f"Reusing Drive file {existing_id} for identical image '{base_filename}'.")
+                    return existing_id
+            except Exception as e:
+                logger.error(f"Image index lookup failed, uploading without deduplication: {e}")
+
+        # 3. Generate a unique filename
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        unique_filename = f"{base_filename}_{timestamp}.{extension}"
         
-        # 3. Upload the optimized image and get file_id
-        return self._upload_to_drive(folder_id, unique_filename, optimized_bytes)
-
-    def _optimize_image(self, image_file, max_width: int, quality: int) -> io.BytesIO:
-        """Resizes and compresses an image, returning it as a BytesIO object."""
-        with Image.open(image_file) as img:
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            if img.width > max_width:
-                ratio = max_width / float(img.width)
-                height = int(float(img.height) * ratio)
-                img = img.resize((max_width, height), Image.LANCZOS)
-            
-            img_byte_arr = io.BytesIO()
-            img.save(img_byte_arr, format='JPEG', quality=quality, optimize=True)
-            img_byte_arr.seek(0)
-            return img_byte_arr
+        # 4. Upload the optimized image and get file_id
+        file_id = self._upload_to_drive(folder_id, unique_filename, optimized_bytes, mimetype)
+        if file_id and self.image_index:
+            try:
+                registered_id = self.image_index.register(digest, file_id, optimized_bytes.getbuffer().nbytes, mimetype)
+            except Exception as e:
+                logger.error(f"Failed to index uploaded file {file_id}: {e}")
+                return file_id
+            if registered_id != file_id:
+                # The same content was uploaded concurrently; keep the indexed copy.
+                self._delete_drive_file(file_id)
+                return registered_id
+        return file_id
+
+    def _optimize_image(self, image_file, max_width: int, quality: int):
+        """Resizes and compresses an image. Returns (BytesIO, mimetype, file extension)."""
+        return optimize_image(image_file, max_width=max_width, quality=quality,
+                              output_format=st.secrets.get("image_output_format", "JPEG"))
 
-    def _upload_to_drive(self, folder_id: str, filename: str, image_bytes: io.BytesIO) -> str | None:
+    def _upload_to_drive(self, folder_id: str, filename: str, image_bytes: io.BytesIO, mimetype: str = 'image/jpeg') -> str | None:
         """A private method to handle the file creation in Google Drive."""
         try:
             file_metadata = {'name': filename, 'parents': [folder_id]}
-            media = MediaIoBaseUpload(image_bytes, mimetype='image/jpeg', resumable=True)
+            media = MediaIoBaseUpload(image_bytes, mimetype=mimetype, resumable=True)
             
             created_file = self.drive_service.files().create(
                 body=file_metadata, 
@@ -125,10 +191,23 @@ class ImageHandler:
             return None
 
     def delete_image_by_id(self, file_id: str):
-        """Deletes a file from Google Drive using its file_id."""
+        """
+        Releases one reference to a Drive file and deletes it once nothing references it
+        (immediately when no image index is configured).
+        """
         if not self.drive_service or not file_id:
             logger.warning("Drive service not initialized or file_id is missing. Cannot delete.")
             return
+        if self.image_index and not self.image_index.release(file_id):
+            logger.info(f"File ID '{file_id}' is still referenced; kept on Drive.")
+            return
+        self._delete_drive_file(file_id)
+
+    def _delete_drive_file(self, file_id: str):
+        """Deletes a file from Google Drive using its file_id."""
+        cache = get_image_cache()
+        for variant in VARIANTS:
+            cache.invalidate(variant_cache_key(file_id, variant))
         try:
             self.drive_service.files().delete(fileId=file_id).execute()
             logger.info(f"Deleted file with ID '{file_id}' from Drive.")
@@ -138,3 +217,19 @@ class ImageHandler:
             else:
                 logger.error(f"Error deleting file ID '{file_id}': {e}")
 
+@st.cache_resource
+def get_image_handler(_firebase_client) -> ImageHandler | None:
+    """
+    The process-wide ImageHandler (one Drive client and connection pool shared by every manager and session).
+    Returns None when Drive OAuth credentials are not configured.
+    """
+    if "drive_oauth" not in st.secrets:
+        return None
+    try:
+        creds_info = dict(st.secrets["drive_oauth"])
+        if not creds_info.get('refresh_token'):
+            return None
+        return ImageHandler(credentials_info=creds_info, image_index=ImageIndex(_firebase_client))
+    except Exception as e:
+        logger.error(f"Failed to initialize ImageHandler: {e}")
+        return None
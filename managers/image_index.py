@@ -0,0 +1,74 @@
+import hashlib
+import logging
+from google.cloud import firestore
+
+IMAGE_INDEX_COLLECTION = 'image_hashes'
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+class ImageIndex:
+    """
+    Chỉ mục nội dung ảnh trên Drive: mỗi tài liệu `image_hashes/{sha256}` giữ `file_id` của tệp đã tải lên
+    và `ref_count` = số tài liệu (sản phẩm, bút toán chi phí...) đang dùng tệp đó.
+    Ảnh trùng nội dung (sau khi tối ưu) dùng lại tệp cũ thay vì tải lên lần nữa; tệp chỉ bị xoá khỏi Drive
+    khi không còn tham chiếu nào. Mọi thay đổi `ref_count` chạy trong giao dịch Firestore.
+    """
+    def __init__(self, firebase_client):
+        self.db = firebase_client.db
+        self.collection = self.db.collection(IMAGE_INDEX_COLLECTION)
+
+    def acquire(self, digest: str) -> str | None:
+        """Nếu đã có tệp cùng nội dung: tăng ref_count và trả về file_id của nó; nếu chưa thì trả về None."""
+        @firestore.transactional
+        def _acquire(transaction):
+            snapshot = self.collection.document(digest).get(transaction=transaction)
+            if not snapshot.exists:
+                return None
+            transaction.update(snapshot.reference, {'ref_count': firestore.Increment(1), 'updated_at': firestore.SERVER_TIMESTAMP})
+            return snapshot.to_dict().get('file_id')
+        return _acquire(self.db.transaction())
+
+    def register(self, digest: str, file_id: str, size: int, mimetype: str) -> str:
+        """
+        Ghi tệp vừa tải lên vào chỉ mục với ref_count = 1. Nếu trong lúc tải có luồng khác đã đăng ký cùng nội dung,
+        tham chiếu được cộng vào tệp đã có và file_id đó được trả về (người gọi xoá tệp thừa của mình).
+        """
+        @firestore.transactional
+        def _register(transaction):
+            ref = self.collection.document(digest)
+            snapshot = ref.get(transaction=transaction)
+            if snapshot.exists:
+                transaction.update(ref, {'ref_count': firestore.Increment(1), 'updated_at': firestore.SERVER_TIMESTAMP})
+                return snapshot.to_dict().get('file_id')
+            transaction.set(ref, {
+                'file_id': file_id, 'ref_count': 1, 'size': size, 'mimetype': mimetype,
+                'created_at': firestore.SERVER_TIMESTAMP, 'updated_at': firestore.SERVER_TIMESTAMP,
+            })
+            return file_id
+        return _register(self.db.transaction())
+
+    def release(self, file_id: str) -> bool:
+        """
+        Bỏ một tham chiếu tới `file_id`. Trả về True nếu tệp không còn được dùng và có thể xoá khỏi Drive
+        (kể cả tệp cũ chưa có trong chỉ mục).
+        """
+        query = self.collection.where('file_id', '==', file_id).limit(1)
+
+        @firestore.transactional
+        def _release(transaction):
+            snapshots = list(transaction.get(query))
+            if not snapshots:
+                return True
+            snapshot = snapshots[0]
+            if (snapshot.to_dict().get('ref_count') or 0) <= 1:
+                transaction.delete(snapshot.reference)
+                return True
+            transaction.update(snapshot.reference, {'ref_count': firestore.Increment(-1), 'updated_at': firestore.SERVER_TIMESTAMP})
+            return False
+        try:
+            return _release(self.db.transaction())
+        except Exception as e:
+            # Không chắc tệp còn được dùng hay không: giữ lại tệp (rác có thể dọn sau) thay vì làm hỏng ảnh đang dùng.
+            logging.error(f"Lỗi khi giảm tham chiếu ảnh {file_id}: {e}")
+            return False
@@ -0,0 +1,82 @@
+import io
+from PIL import Image, features
+
+# Định dạng đầu ra: (tên định dạng của Pillow, mime, đuôi tệp, tham số lưu bổ sung).
+# AVIF dùng thang chất lượng riêng: q55 cho chất lượng nhìn tương đương JPEG q80.
+OUTPUT_FORMATS = {
+    'JPEG': ('JPEG', 'image/jpeg', 'jpg', {'optimize': True}),
+    'WEBP': ('WEBP', 'image/webp', 'webp', {'method': 2}),
+    'AVIF': ('AVIF', 'image/avif', 'avif', {'quality': 55, 'speed': 10}),
+}
+DEFAULT_MAX_WIDTH = 1024
+DEFAULT_QUALITY = 80
+# Thu nhỏ theo hai bước: Image.reduce() (gộp khối, rất nhanh) tới ~2 lần kích thước đích,
+# rồi mới lọc BICUBIC ở bước cuối. Chất lượng gần với LANCZOS trên ảnh chụp, nhanh hơn nhiều.
+RESAMPLE = Image.Resampling.BICUBIC
+REDUCING_GAP = 2.0
+# Phép biến đổi tương ứng với từng giá trị EXIF Orientation (giống ImageOps.exif_transpose).
+_ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT, 3: Image.Transpose.ROTATE_180, 4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE, 6: Image.Transpose.ROTATE_270, 7: Image.Transpose.TRANSVERSE, 8: Image.Transpose.ROTATE_90,
+}
+# Các hướng làm đổi chiều rộng/cao khi hiển thị.
+_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+def _format_supported(fmt: str) -> bool:
+    return fmt == 'JPEG' or bool(features.check(fmt.lower()))
+
+def resolve_output_format(fmt: str) -> str:
+    """Định dạng đầu ra thực tế: lùi về WEBP rồi JPEG nếu bản Pillow đang dùng không hỗ trợ định dạng yêu cầu."""
+    fmt = (fmt or 'JPEG').upper()
+    for candidate in (fmt, 'WEBP', 'JPEG'):
+        if candidate in OUTPUT_FORMATS and _format_supported(candidate):
+            return candidate
+    return 'JPEG'
+
+def optimize_image(image_file, max_width: int = DEFAULT_MAX_WIDTH, quality: int = DEFAULT_QUALITY,
+                   output_format: str = 'JPEG'):
+    """
+    Thu nhỏ ảnh về chiều rộng hiển thị ≤ max_width và nén lại. Trả về (BytesIO, mime, đuôi tệp).
+      - JPEG được giải mã ở chế độ draft (DCT scaling 1/2, 1/4, 1/8) nên ảnh 12MP không bao giờ được giải mã đủ kích thước.
+      - Hướng xoay EXIF được áp dụng sau khi thu nhỏ, trên ảnh đã nhỏ (không sao chép thêm bản lớn).
+      - Có thể xuất WEBP/AVIF (nhỏ hơn nhiều so với JPEG ở cùng chất lượng).
+    """
+    fmt = resolve_output_format(output_format)
+    pil_format, mime, extension, save_options = OUTPUT_FORMATS[fmt]
+
+    with Image.open(image_file) as img:
+        orientation = img.getexif().get(0x0112, 1)
+        transposed = orientation in _TRANSPOSED_ORIENTATIONS
+        # Kích thước theo chiều hiển thị (sau khi xoay) quyết định tỉ lệ thu nhỏ.
+        display_width, display_height = (img.height, img.width) if transposed else img.size
+        scale = min(1.0, max_width / float(display_width))
+        target_display = (max(1, round(display_width * scale)), max(1, round(display_height * scale)))
+        target = (target_display[1], target_display[0]) if transposed else target_display
+
+        if img.format == 'JPEG':
+            img.draft('RGB', target)  # chỉ giải mã ở tỉ lệ nhỏ nhất vẫn ≥ kích thước đích
+        if img.mode not in ('RGB', 'RGBA') or (img.mode == 'RGBA' and fmt == 'JPEG'):
+            img = img.convert('RGB')
+        if img.size != target:
+            img = img.resize(target, RESAMPLE, reducing_gap=REDUCING_GAP)
+        if orientation in _ORIENTATION_TRANSPOSE:
+            img = img.transpose(_ORIENTATION_TRANSPOSE[orientation])
+
+        output = io.BytesIO()
+        img.save(output, format=pil_format, **{'quality': quality, **save_options})
+        output.seek(0)
+        return output, mime, extension
+
+def sniff_mimetype(data: bytes) -> str:
+    """Nhận dạng kiểu ảnh từ vài byte đầu (ảnh trong bộ đệm không kèm metadata)."""
+    if data[:3] == b'\xff\xd8\xff':
+        return 'image/jpeg'
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'image/png'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[4:12] in (b'ftypavif', b'ftypavis'):
+        return 'image/avif'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    return 'application/octet-stream'
@@ -0,0 +1,126 @@
+import time
+import logging
+import threading
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor, wait
+import pandas as pd
+import streamlit as st
+
+from .image_cache import ImageCache, get_image_cache
+from .rollup_manager import RollupManager
+
+DEFAULT_PREFETCH_WORKERS = 8
+FAILED_RETRY_SECONDS = 300  # ảnh tải lỗi không được thử lại (và không ai phải chờ nó) trong khoảng này
+BEST_SELLER_DAYS = 30
+BEST_SELLERS_PER_BRANCH = 24
+
+class ImagePrefetcher:
+    """
+    Tải trước song song các ảnh sắp hiển thị vào bộ đệm ảnh dùng chung, trên một thread pool có giới hạn.
+    Mỗi file id chỉ có tối đa một lượt tải đang chạy: yêu cầu trùng (từ trang khác, phiên khác hoặc lượt
+    hiển thị tuần tự) chờ chung kết quả của lượt tải đó thay vì tải lại. Ảnh tải lỗi được ghi nhớ
+    FAILED_RETRY_SECONDS giây để các lần rerun không tải lại và chờ lại ảnh đó.
+    """
+    def __init__(self, cache: ImageCache, max_workers: int = DEFAULT_PREFETCH_WORKERS):
+        self.cache = cache
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-prefetch")
+        self._in_flight = {}
+        self._failed = {}  # file_id -> thời điểm (monotonic) tải lỗi gần nhất
+        self._lock = threading.Lock()
+
+    def recently_failed(self, file_id: str) -> bool:
+        with self._lock:
+            failed_at = self._failed.get(file_id)
+            if failed_at is None:
+                return False
+            if time.monotonic() - failed_at >= FAILED_RETRY_SECONDS:
+                del self._failed[file_id]
+                return False
+            return True
+
+    def _load(self, file_id: str, loader):
+        data = None
+        try:
+            data = self.cache.get(file_id, loader)
+            return data
+        finally:
+            with self._lock:
+                self._in_flight.pop(file_id, None)
+                if data is None:
+                    self._failed[file_id] = time.monotonic()
+
+    def submit(self, file_id: str, loader):
+        """
+        Xếp lịch tải một ảnh; trả về Future (dùng chung nếu ảnh đang được tải) hoặc None nếu ảnh đã có
+        trong bộ đệm hoặc vừa tải lỗi.
+        """
+        if not file_id or self.cache.contains(file_id) or self.recently_failed(file_id):
+            return None
+        with self._lock:
+            future = self._in_flight.get(file_id)
+            if future is None:
+                future = self._pool.submit(self._load, file_id, loader)
+                self._in_flight[file_id] = future
+            return future
+
+    def fetch(self, file_id: str, loader):
+        """Lấy một ảnh: trả ngay nếu có trong bộ đệm, nếu không thì tải (hoặc chờ lượt tải đang chạy); None nếu vừa tải lỗi."""
+        if self.recently_failed(file_id):
+            return None
+        future = self.submit(file_id, loader)
+        if future is not None:
+            return future.result()
+        return self.cache.get(file_id, loader)
+
+    def prefetch(self, image_handler, image_ids, timeout: float = 0) -> int:
+        """
+        Xếp lịch tải song song các ảnh trong `image_ids` chưa có trong bộ đệm. Mặc định không chờ (trang vẫn hiển
+        thị ngay, các ảnh đang tải được lấy chung qua fetch); `timeout` > 0 chờ tối đa ngần ấy giây, None chờ đến hết.
+        Trả về số ảnh đã được xếp lịch tải.
+        """
+        if image_handler is None:
+            return 0
+        futures = [
+            future for file_id in dict.fromkeys(i for i in image_ids if i)
+            if (future := self.submit(file_id, lambda file_id=file_id: image_handler.download_drive_file(file_id))) is not None
+        ]
+        if futures and timeout != 0:
+            _, not_done = wait(futures, timeout=timeout)
+            if not_done:
+                logging.warning(f"Tải trước ảnh: {len(not_done)}/{len(futures)} ảnh chưa xong sau {timeout}s.")
+        return len(futures)
+
+@st.cache_resource
+def get_image_prefetcher() -> ImagePrefetcher:
+    return ImagePrefetcher(get_image_cache(), max_workers=int(st.secrets.get("image_prefetch_workers", DEFAULT_PREFETCH_WORKERS)))
+
+def best_seller_image_ids(firebase_client, days: int = BEST_SELLER_DAYS, per_branch: int = BEST_SELLERS_PER_BRANCH) -> list:
+    """Ảnh của các sản phẩm bán chạy nhất (theo số lượng) của từng chi nhánh trong `days` ngày gần nhất."""
+    end_day = date.today()
+    sku_rollups = RollupManager(firebase_client).get_sku_rollups(end_day - timedelta(days=days), end_day)
+    if not sku_rollups:
+        return []
+    sales = pd.DataFrame(sku_rollups).groupby(['branch_id', 'sku'], as_index=False)['quantity_sold'].sum()
+    top_skus = sales.sort_values('quantity_sold', ascending=False).groupby('branch_id').head(per_branch)['sku'].unique()
+
+    db = firebase_client.db
+    refs = [db.collection('products').document(sku) for sku in top_skus]
+    products = (doc.to_dict() or {} for doc in db.get_all(refs, field_paths=['image_id']) if doc.exists)
+    return [product['image_id'] for product in products if product.get('image_id')]
+
+@st.cache_resource
+def start_best_seller_warmup(_firebase_client, _image_handler):
+    """Khởi động (một lần cho mỗi tiến trình) luồng nền tải trước ảnh sản phẩm bán chạy của mỗi chi nhánh."""
+    prefetcher = get_image_prefetcher()
+
+    def _warm():
+        try:
+            image_ids = best_seller_image_ids(_firebase_client)
+            count = prefetcher.prefetch(_image_handler, image_ids, timeout=None)
+            logging.info(f"Đã làm nóng bộ đệm ảnh với {count} ảnh sản phẩm bán chạy.")
+        except Exception as e:
+            logging.warning(f"Không làm nóng được bộ đệm ảnh: {e}")
+
+    thread = threading.Thread(target=_warm, name="image-warmup", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,142 @@
+import io
+import re
+import hmac
+import hashlib
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import streamlit as st
+
+from .image_cache import ImageCache, get_image_cache
+from .image_pipeline import optimize_image, sniff_mimetype
+from .image_prefetcher import ImagePrefetcher, get_image_prefetcher
+
+DEFAULT_IMAGE_SERVER_HOST = "127.0.0.1"
+DEFAULT_IMAGE_SERVER_PORT = 8765
+# Chiều rộng tối đa của từng cỡ ảnh; None = ảnh gốc đã tải lên.
+VARIANTS = {'thumb': 160, 'card': 480, 'full': None}
+# Một file id trên Drive không bao giờ đổi nội dung (ảnh mới = file mới), nên trình duyệt được giữ ảnh vô thời hạn.
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+_PATH = re.compile(r"^/images/(?P<variant>[a-z]+)/(?P<file_id>[A-Za-z0-9_-]+)$")
+
+def variant_cache_key(file_id: str, variant: str) -> str:
+    """Khoá của một cỡ ảnh đã thu nhỏ trong bộ đệm ảnh (ảnh gốc dùng chính file id)."""
+    return file_id if VARIANTS.get(variant) is None else f"{file_id}__{variant}"
+
+class ImageServer:
+    """
+    Máy chủ HTTP nhỏ chạy nền (ThreadingHTTPServer) phục vụ ảnh Drive tại `/images/{variant}/{file_id}?s=chữ_ký`,
+    để trang chỉ chứa URL thay vì byte ảnh. Phản hồi kèm Cache-Control dài hạn và ETag theo (file id, cỡ ảnh),
+    nên trình duyệt giữ ảnh qua các lần rerun và các phiên; yêu cầu kèm If-None-Match được trả 304 ngay.
+    URL được ký HMAC để máy chủ chỉ phục vụ ảnh mà ứng dụng đã tự đưa ra trang.
+    """
+    def __init__(self, image_handler, signing_key: bytes, cache: ImageCache, prefetcher: ImagePrefetcher,
+                 public_url: str, output_format: str = 'JPEG'):
+        self.image_handler = image_handler
+        self.signing_key = signing_key
+        self.cache = cache
+        self.prefetcher = prefetcher
+        self.public_url = public_url.rstrip('/')
+        self.output_format = output_format
+        self._httpd = None
+
+    def _signature(self, file_id: str, variant: str) -> str:
+        return hmac.new(self.signing_key, f"{variant}/{file_id}".encode(), hashlib.sha256).hexdigest()[:20]
+
+    def url(self, file_id: str, variant: str = 'card') -> str:
+        if variant not in VARIANTS:
+            raise ValueError(f"Cỡ ảnh không hợp lệ: {variant}")
+        return f"{self.public_url}/images/{variant}/{file_id}?s={self._signature(file_id, variant)}"
+
+    def load(self, file_id: str, variant: str) -> bytes | None:
+        """Byte ảnh của một cỡ: ảnh gốc qua bộ tải trước (dùng chung lượt tải đang chạy), cỡ nhỏ được tạo một lần rồi lưu đệm."""
+        original = self.prefetcher.fetch(file_id, lambda: self.image_handler.download_drive_file(file_id))
+        max_width = VARIANTS[variant]
+        if not original or max_width is None:
+            return original
+
+        def _resize():
+            output, _, _ = optimize_image(io.BytesIO(original), max_width=max_width, output_format=self.output_format)
+            return output.getvalue()
+        return self.cache.get(variant_cache_key(file_id, variant), _resize)
+
+    def _make_handler(self):
+        server = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                match = _PATH.match(parts.path)
+                if not match or match['variant'] not in VARIANTS:
+                    self.send_error(404)
+                    return
+                file_id, variant = match['file_id'], match['variant']
+                signature = parse_qs(parts.query).get('s', [''])[0]
+                if not hmac.compare_digest(signature, server._signature(file_id, variant)):
+                    self.send_error(403)
+                    return
+                etag = f'"{file_id}-{variant}"'
+                if etag in (self.headers.get('If-None-Match') or ''):
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Cache-Control', CACHE_CONTROL)
+                    self.end_headers()
+                    return
+                try:
+                    data = server.load(file_id, variant)
+                except Exception as e:
+                    logging.error(f"Lỗi khi phục vụ ảnh {file_id} ({variant}): {e}")
+                    data = None
+                if not data:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', sniff_mimetype(data))
+                self.send_header('Content-Length', str(len(data)))
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', CACHE_CONTROL)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                logging.debug(f"image-server: {format % args}")
+
+        return _Handler
+
+    def start(self, host: str, port: int):
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        threading.Thread(target=self._httpd.serve_forever, name="image-server", daemon=True).start()
+        logging.info(f"Máy chủ ảnh đang chạy tại {host}:{port} (URL công khai: {self.public_url}).")
+
+@st.cache_resource
+def start_image_server(_image_handler) -> ImageServer | None:
+    """
+    Khởi động (một lần cho mỗi tiến trình) máy chủ ảnh. Chỉ bật khi secrets có `image_server_url`: địa chỉ mà
+    trình duyệt của mọi máy (máy tính bảng, máy POS ở chi nhánh) dùng để tới máy chủ, ví dụ một đường dẫn trên
+    reverse proxy cùng tên miền với ứng dụng. Không đoán địa chỉ này: `localhost` chỉ đúng với trình duyệt chạy trên
+    chính máy chủ. Cấu hình thêm: `image_server_host`/`image_server_port` (địa chỉ lắng nghe; đặt host `0.0.0.0`
+    nếu trình duyệt truy cập thẳng cổng này) và `image_server_secret` (khoá ký URL; mặc định suy ra từ
+    client_secret của Drive để URL không đổi sau khi khởi động lại).
+    Trả về None nếu chưa cấu hình hoặc không mở được cổng; khi đó trang dùng byte ảnh như trước.
+    """
+    public_url = st.secrets.get("image_server_url")
+    if _image_handler is None or not public_url:
+        return None
+    host = st.secrets.get("image_server_host", DEFAULT_IMAGE_SERVER_HOST)
+    port = int(st.secrets.get("image_server_port", DEFAULT_IMAGE_SERVER_PORT))
+    secret = st.secrets.get("image_server_secret") or dict(st.secrets.get("drive_oauth", {})).get("client_secret", "")
+    server = ImageServer(
+        _image_handler,
+        signing_key=hashlib.sha256(f"image-server:{secret}".encode()).digest(),
+        cache=get_image_cache(), prefetcher=get_image_prefetcher(),
+        public_url=public_url,
+        output_format=st.secrets.get("image_output_format", "JPEG"),
+    )
+    try:
+        server.start(host, port)
+    except OSError as e:
+        logging.warning(f"Không mở được máy chủ ảnh tại {host}:{port}, dùng byte ảnh trực tiếp: {e}")
+        return None
+    return server
@@ -0,0 +1,223 @@
+import io
+import os
+import json
+import uuid
+import queue
+import logging
+import threading
+from datetime import datetime
+import streamlit as st
+from google.cloud import firestore
+
+DEFAULT_UPLOAD_DIR = os.path.join("data", "image_uploads")
+MAX_UPLOAD_ATTEMPTS = 4
+RETRY_BASE_DELAY = 5  # giây; lần thử thứ n chờ RETRY_BASE_DELAY * 2^(n-1)
+
+IMAGE_STATUS_PENDING = 'PENDING'
+IMAGE_STATUS_READY = 'READY'
+IMAGE_STATUS_FAILED = 'FAILED'
+
+# Kết quả của một lần cập nhật có điều kiện vào tài liệu
+PATCH_APPLIED = 'applied'
+PATCH_STALE = 'stale'      # tài liệu đã gắn công việc khác (ảnh mới hơn) hoặc ảnh đã bị gỡ
+PATCH_MISSING = 'missing'  # tài liệu đã bị xoá
+
+def _is_current_job(doc_data: dict, job_id: str) -> bool:
+    # Tài liệu chưa có trường `image_job_id` (công việc xếp trước khi có trường này) vẫn nhận kết quả.
+    return doc_data.get('image_job_id', job_id) == job_id
+
+class ImageUploadQueue:
+    """
+    Hàng đợi tải ảnh lên Drive chạy nền, tách việc tối ưu ảnh + upload khỏi thao tác lưu sản phẩm.
+    Tài liệu được lưu ngay với `image_status: PENDING` và `image_job_id`; khi upload xong, luồng nền cập nhật
+    `image_id` (và xoá ảnh cũ nếu có), hoặc đánh dấu `FAILED` sau MAX_UPLOAD_ATTEMPTS lần thử. Kết quả chỉ được
+    ghi (trong một Firestore transaction) khi tài liệu vẫn gắn đúng `image_job_id` của công việc, nên công việc
+    cũ hoàn tất muộn không ghi đè ảnh mới hơn.
+    Byte ảnh và thông tin công việc được ghi ra đĩa, nên công việc còn dở được chạy lại sau khi khởi động lại
+    và ảnh lỗi có thể được thử lại từ giao diện.
+    """
+    def __init__(self, firebase_client, root_dir: str = DEFAULT_UPLOAD_DIR):
+        self.db = firebase_client.db
+        self.root_dir = root_dir
+        self.image_handler = None
+        self._queue = queue.Queue()
+        self._callbacks = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        os.makedirs(self.root_dir, exist_ok=True)
+
+    def _job_path(self, job_id: str) -> str:
+        return os.path.join(self.root_dir, f"{job_id}.json")
+
+    def _data_path(self, job_id: str) -> str:
+        return os.path.join(self.root_dir, f"{job_id}.bin")
+
+    def _save_job(self, job: dict):
+        tmp_path = f"{self._job_path(job['job_id'])}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp_path, self._job_path(job['job_id']))
+
+    def _load_jobs(self) -> list:
+        jobs = []
+        for file_name in os.listdir(self.root_dir):
+            if file_name.endswith('.json'):
+                try:
+                    with open(os.path.join(self.root_dir, file_name), encoding='utf-8') as f:
+                        jobs.append(json.load(f))
+                except (OSError, ValueError) as e:
+                    logging.warning(f"Bỏ qua công việc upload hỏng {file_name}: {e}")
+        return jobs
+
+    def _remove_job(self, job_id: str):
+        for path in (self._job_path(job_id), self._data_path(job_id)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def start(self, image_handler):
+        """Gắn ImageHandler và khởi động luồng nền (một lần); các công việc PENDING còn trên đĩa được xếp lại."""
+        with self._lock:
+            self.image_handler = image_handler
+            if self._thread and self._thread.is_alive():
+                return
+            for job in self._load_jobs():
+                if job['status'] == IMAGE_STATUS_PENDING:
+                    self._queue.put(job['job_id'])
+            self._thread = threading.Thread(target=self._loop, name="image-upload", daemon=True)
+            self._thread.start()
+
+    @staticmethod
+    def new_job_id() -> str:
+        return uuid.uuid4().hex
+
+    def enqueue(self, collection: str, doc_id: str, image_file, folder_id: str, base_filename: str,
+                replaces: str = None, on_complete=None, job_id: str = None) -> str:
+        """
+        Xếp một ảnh cần tải lên cho tài liệu `collection/doc_id`. `replaces` là image_id cũ sẽ bị xoá khi ảnh mới
+        tải xong. on_complete(doc_id) được gọi trên luồng nền sau khi tài liệu được cập nhật (ví dụ: xoá cache).
+        Người gọi lấy `job_id` từ new_job_id() và tự ghi `image_status: PENDING`, `image_job_id: job_id` vào
+        tài liệu cùng lúc với các thay đổi khác, trước khi gọi hàm này.
+        """
+        job_id = job_id or self.new_job_id()
+        with open(self._data_path(job_id), 'wb') as f:
+            f.write(image_file.getvalue() if hasattr(image_file, 'getvalue') else image_file.read())
+        self._save_job({
+            'job_id': job_id, 'collection': collection, 'doc_id': doc_id, 'folder_id': folder_id,
+            'base_filename': base_filename, 'replaces': replaces, 'status': IMAGE_STATUS_PENDING,
+            'attempts': 0, 'last_error': None, 'created_at': datetime.now().isoformat(),
+        })
+        if on_complete:
+            self._callbacks[job_id] = on_complete
+        self._queue.put(job_id)
+        return job_id
+
+    def retry(self, doc_id: str, on_complete=None) -> bool:
+        """Thử lại các công việc FAILED của một tài liệu. Trả về False nếu không có công việc nào để thử lại."""
+        jobs = []
+        for job in self._load_jobs():
+            if job['doc_id'] != doc_id or job['status'] != IMAGE_STATUS_FAILED:
+                continue
+            if self._patch_if_current(job, {'image_status': IMAGE_STATUS_PENDING, 'image_error': None}) != PATCH_APPLIED:
+                self._remove_job(job['job_id'])  # đã có ảnh mới hơn hoặc tài liệu đã bị xoá
+                continue
+            jobs.append(job)
+        for job in jobs:
+            job.update(status=IMAGE_STATUS_PENDING, attempts=0, last_error=None)
+            self._save_job(job)
+            if on_complete:
+                self._callbacks[job['job_id']] = on_complete
+            self._queue.put(job['job_id'])
+        return bool(jobs)
+
+    def discard(self, doc_id: str):
+        """Huỷ mọi công việc của một tài liệu (ví dụ: khi sản phẩm bị xoá hoặc ảnh bị gỡ)."""
+        for job in self._load_jobs():
+            if job['doc_id'] == doc_id:
+                self._remove_job(job['job_id'])
+
+    def pending_count(self) -> int:
+        return sum(1 for job in self._load_jobs() if job['status'] == IMAGE_STATUS_PENDING)
+
+    def _patch_if_current(self, job: dict, patch: dict) -> str:
+        """Cập nhật tài liệu của công việc trong một transaction, chỉ khi tài liệu vẫn gắn `image_job_id` của công việc."""
+        doc_ref = self.db.collection(job['collection']).document(job['doc_id'])
+
+        @firestore.transactional
+        def _apply(transaction):
+            snapshot = doc_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return PATCH_MISSING
+            if not _is_current_job(snapshot.to_dict() or {}, job['job_id']):
+                return PATCH_STALE
+            transaction.update(doc_ref, patch)
+            return PATCH_APPLIED
+
+        return _apply(self.db.transaction())
+
+    def _loop(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._process(job_id)
+            except Exception as e:
+                logging.error(f"Lỗi không mong đợi khi xử lý upload {job_id}: {e}")
+
+    def _process(self, job_id: str):
+        if not os.path.exists(self._job_path(job_id)):
+            return  # đã bị huỷ
+        with open(self._job_path(job_id), encoding='utf-8') as f:
+            job = json.load(f)
+        if job['status'] != IMAGE_STATUS_PENDING:
+            return
+        with open(self._data_path(job_id), 'rb') as f:
+            image_bytes = f.read()
+
+        file_id, error = None, None
+        try:
+            file_id = self.image_handler.upload_image(io.BytesIO(image_bytes), job['folder_id'], base_filename=job['base_filename'])
+            if not file_id:
+                error = "Drive không trả về file id."
+        except Exception as e:
+            error = str(e)
+
+        if file_id:
+            if not os.path.exists(self._job_path(job_id)):
+                self.image_handler.delete_image_by_id(file_id)  # công việc bị huỷ trong lúc đang upload
+                return
+            outcome = self._patch_if_current(job, {'image_id': file_id, 'image_status': IMAGE_STATUS_READY, 'image_error': None})
+            if outcome != PATCH_APPLIED:
+                reason = "đã bị xoá" if outcome == PATCH_MISSING else "đã có ảnh mới hơn"
+                logging.warning(f"{job['collection']}/{job['doc_id']} {reason}, gỡ ảnh vừa tải lên {file_id}.")
+                self.image_handler.delete_image_by_id(file_id)
+                self._remove_job(job_id)
+                return
+            if job.get('replaces'):
+                self.image_handler.delete_image_by_id(job['replaces'])
+            self._remove_job(job_id)
+            logging.info(f"Đã tải ảnh {file_id} cho {job['collection']}/{job['doc_id']}.")
+            callback = self._callbacks.pop(job_id, None)
+            if callback:
+                callback(job['doc_id'])
+            return
+
+        job['attempts'] += 1
+        job['last_error'] = error
+        logging.warning(f"Upload ảnh cho {job['doc_id']} thất bại (lần {job['attempts']}): {error}")
+        if job['attempts'] >= MAX_UPLOAD_ATTEMPTS:
+            job['status'] = IMAGE_STATUS_FAILED
+            self._save_job(job)
+            if self._patch_if_current(job, {'image_status': IMAGE_STATUS_FAILED, 'image_error': error}) != PATCH_APPLIED:
+                self._remove_job(job_id)
+            callback = self._callbacks.pop(job_id, None)
+            if callback:
+                callback(job['doc_id'])
+            return
+
+        self._save_job(job)
+        delay = RETRY_BASE_DELAY * 2 ** (job['attempts'] - 1)
+        threading.Timer(delay, self._queue.put, args=(job_id,)).start()
+
+@st.cache_resource
+def get_image_upload_queue(_firebase_client) -> ImageUploadQueue:
+    """Một hàng đợi upload ảnh cho toàn tiến trình."""
+    return ImageUploadQueue(_firebase_client, st.secrets.get("image_upload_dir", DEFAULT_UPLOAD_DIR))
@@ -0,0 +1,194 @@
+import logging
+from datetime import datetime, timezone
+import pandas as pd
+
+from .branch_manager import BranchManager
+from .projections import project
+from .query_executor import get_query_executor
+
+# Phiếu đối soát được tạo qua InventoryManager.create_adjustment(reason=RECONCILE_REASON), nên các bút toán của nó
+# mang lý do `ADJUSTMENT_RECONCILE` và là mốc mới của sổ kho: phát lại bắt đầu từ phiếu gần nhất.
+RECONCILE_REASON = 'reconcile'
+RECONCILE_LEDGER_REASON = f"ADJUSTMENT_{RECONCILE_REASON.upper()}"
+COST_TOLERANCE = 0.5  # chênh lệch giá vốn bình quân (đồng) được bỏ qua do làm tròn
+_MIN_TIME = datetime.min.replace(tzinfo=timezone.utc)
+
+DISCREPANCY_COLUMNS = [
+    'branch_id', 'sku', 'stock_quantity', 'ledger_quantity', 'quantity_diff',
+    'average_cost', 'ledger_average_cost', 'cost_diff', 'ledger_entries', 'issue',
+]
+
+def _number(value):
+    try:
+        return None if value is None else float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _as_utc(value):
+    """Timestamp Firestore hoặc chuỗi ISO -> datetime có múi giờ (giờ không múi giờ coi là UTC), hoặc None."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+def ledger_order(data: dict, doc_id: str) -> tuple:
+    """
+    Thứ tự của một bút toán trong sổ kho: theo thời điểm ghi (`recorded_at` do máy chủ gán), không theo ngày nghiệp vụ
+    `timestamp` vốn có thể lùi ngày; bút toán cũ chưa có `recorded_at` dùng tạm `timestamp`.
+    """
+    timestamp = _as_utc(data.get('timestamp'))
+    return (_as_utc(data.get('recorded_at')) or timestamp or _MIN_TIME, timestamp or _MIN_TIME, doc_id)
+
+class InventoryIntegrityChecker:
+    """
+    Đối soát `inventory` với sổ kho `inventory_transactions`.
+    Sổ kho được phát lại theo kiểu streaming, mỗi chi nhánh một luồng đọc song song (chỉ lấy các trường cần phát lại),
+    gộp dần vào trạng thái theo (chi nhánh, sku) nên bộ nhớ không tăng theo số bút toán:
+      - Lượt 1 (chỉ các bút toán đối soát): phiếu đối soát gần nhất của mỗi mặt hàng.
+      - Lượt 2: số lượng theo sổ = `quantity_after` của phiếu đó + tổng `delta` ghi sau nó;
+        giá vốn bình quân theo sổ = `cost_at_transaction` của bút toán ghi sau cùng.
+    Thứ tự giữa các bút toán chỉ dùng để so sánh (ledger_order), nên không cần đọc sổ theo thứ tự.
+    Kết quả được so với tồn kho và giá vốn hiện tại để lập báo cáo chênh lệch.
+    """
+    def __init__(self, firebase_client, inventory_mgr):
+        self.db = firebase_client.db
+        self.inventory_mgr = inventory_mgr
+        self.branch_mgr = BranchManager(firebase_client)
+        self.executor = get_query_executor()
+        self.inventory_col = self.db.collection('inventory')
+        self.ledger_col = self.db.collection('inventory_transactions')
+
+    def _by_branch(self, collection, projection: str, branch_ids: list) -> list:
+        def build_query(branch_chunk, *_):
+            return project(collection.where('branch_id', 'in', branch_chunk), projection)
+        return self.executor.run(build_query, branch_ids, mapper=lambda doc: {**doc.to_dict(), '_doc_id': doc.id}, branch_chunk_size=1)
+
+    def _fold_ledger(self, branch_ids: list, fold_fn, reason: str = None) -> dict:
+        """Gộp sổ kho của các chi nhánh (song song, mỗi chi nhánh một luồng) vào một dict theo (chi nhánh, sku)."""
+        def build_query(branch_chunk, *_):
+            query = self.ledger_col.where('branch_id', 'in', branch_chunk)
+            if reason:
+                query = query.where('reason', '==', reason)
+            return project(query, 'inventory_transactions.replay')
+        merged = {}
+        for state in self.executor.fold(build_query, branch_ids, fold_fn, dict, branch_chunk_size=1):
+            merged.update(state)  # mỗi chi nhánh một trạng thái riêng, các khoá không trùng nhau
+        return merged
+
+    @staticmethod
+    def _ledger_key(data: dict) -> tuple:
+        return data.get('branch_id'), str(data.get('sku')).upper()
+
+    @classmethod
+    def _fold_checkpoint(cls, checkpoints: dict, doc):
+        data = doc.to_dict()
+        key, order = cls._ledger_key(data), ledger_order(data, doc.id)
+        if key not in checkpoints or order > checkpoints[key]:
+            checkpoints[key] = order
+
+    @classmethod
+    def _fold_entry(cls, checkpoints: dict):
+        def fold(state: dict, doc):
+            data = doc.to_dict()
+            key, order = cls._ledger_key(data), ledger_order(data, doc.id)
+            # [số lượng theo sổ, số bút toán, thứ tự của giá vốn đã lấy, giá vốn]
+            entry = state.setdefault(key, [0.0, 0, None, None])
+            entry[1] += 1
+            checkpoint = checkpoints.get(key)
+            if checkpoint is None or order > checkpoint:
+                entry[0] += _number(data.get('delta')) or 0.0
+            elif order == checkpoint:
+                entry[0] += _number(data.get('quantity_after')) or 0.0
+            cost = _number(data.get('cost_at_transaction'))
+            if cost is not None and (entry[2] is None or order > entry[2]):
+                entry[2], entry[3] = order, cost
+        return fold
+
+    def replay_ledger(self, branch_ids: list) -> pd.DataFrame:
+        """Phát lại sổ kho thành số lượng và giá vốn kỳ vọng cho từng (chi nhánh, sku)."""
+        checkpoints = self._fold_ledger(branch_ids, self._fold_checkpoint, reason=RECONCILE_LEDGER_REASON)
+        replayed = self._fold_ledger(branch_ids, self._fold_entry(checkpoints))
+        return pd.DataFrame(
+            [(branch_id, sku, quantity, cost, entries) for (branch_id, sku), (quantity, entries, _, cost) in replayed.items()],
+            columns=['branch_id', 'sku', 'ledger_quantity', 'ledger_average_cost', 'ledger_entries'],
+        ).astype({'ledger_quantity': 'float64', 'ledger_average_cost': 'float64'})
+
+    @staticmethod
+    def _inventory_frame(rows: list) -> pd.DataFrame:
+        inventory = pd.DataFrame(rows, columns=['sku', 'branch_id', 'stock_quantity', 'average_cost', '_doc_id'])
+        # Mã tài liệu tồn kho là "{SKU}_{branch_id}"; dùng nó làm khoá vì một số tài liệu cũ thiếu trường `sku`.
+        inventory['sku'] = [
+            doc_id[:-len(branch_id) - 1] if branch_id and doc_id.endswith(f"_{branch_id}") else str(sku).upper()
+            for doc_id, branch_id, sku in zip(inventory['_doc_id'], inventory['branch_id'], inventory['sku'])
+        ]
+        inventory['stock_quantity'] = pd.to_numeric(inventory['stock_quantity'], errors='coerce').fillna(0)
+        inventory['average_cost'] = pd.to_numeric(inventory['average_cost'], errors='coerce').fillna(0)
+        return inventory[['branch_id', 'sku', 'stock_quantity', 'average_cost']]
+
+    def run_check(self, branch_ids: list = None) -> dict:
+        """
+        Đối soát các chi nhánh (mặc định: mọi chi nhánh đang hoạt động).
+        Trả về {"success", "checked_at", "checked_items", "discrepancies": DataFrame theo DISCREPANCY_COLUMNS}.
+        """
+        branch_ids = branch_ids or [b['id'] for b in self.branch_mgr.list_branches(active_only=True)]
+        if not branch_ids:
+            return {"success": False, "message": "Không có chi nhánh nào để đối soát."}
+        started = datetime.now()
+        try:
+            expected = self.replay_ledger(branch_ids)
+            inventory_rows = self._by_branch(self.inventory_col, 'inventory.valuation', branch_ids)
+        except Exception as e:
+            logging.error(f"Lỗi khi đọc dữ liệu đối soát tồn kho: {e}")
+            return {"success": False, "message": str(e)}
+        ledger_entries = int(expected['ledger_entries'].sum())
+        report = self._inventory_frame(inventory_rows).merge(expected, on=['branch_id', 'sku'], how='outer')
+        report['ledger_entries'] = report['ledger_entries'].fillna(0).astype(int)
+        report['quantity_diff'] = report['stock_quantity'].fillna(0) - report['ledger_quantity'].fillna(0)
+        report['cost_diff'] = report['average_cost'] - report['ledger_average_cost']
+
+        report['issue'] = None
+        report.loc[report['cost_diff'].abs() > COST_TOLERANCE, 'issue'] = 'average_cost'
+        report.loc[report['quantity_diff'] != 0, 'issue'] = 'quantity'
+        report.loc[report['stock_quantity'].isna() & (report['quantity_diff'] != 0), 'issue'] = 'missing_inventory'
+        report.loc[report['ledger_quantity'].isna() & (report['quantity_diff'] != 0), 'issue'] = 'missing_ledger'
+
+        discrepancies = report[report['issue'].notna()][DISCREPANCY_COLUMNS].sort_values(['branch_id', 'sku']).reset_index(drop=True)
+        elapsed = (datetime.now() - started).total_seconds()
+        logging.info(f"Đối soát tồn kho {len(branch_ids)} chi nhánh: {ledger_entries} bút toán, {len(report)} mặt hàng, "
+                     f"{len(discrepancies)} chênh lệch trong {elapsed:.1f}s.")
+        return {"success": True, "checked_at": started, "checked_items": len(report), "ledger_entries": ledger_entries,
+                "discrepancies": discrepancies}
+
+    def create_corrections(self, discrepancies: pd.DataFrame, user_id: str) -> dict:
+        """
+        Tạo phiếu điều chỉnh đối soát (InventoryManager.create_adjustment, lý do RECONCILE_REASON) đưa tồn kho về
+        số lượng theo sổ kho, mỗi chi nhánh một phiếu. Mỗi mặt hàng kèm `expected_quantity` là tồn kho lúc đối soát:
+        mặt hàng có tồn kho đã thay đổi kể từ đó (bán, nhập, chuyển kho...) bị bỏ qua để kiểm tra lại, cũng như mặt hàng
+        có số lượng theo sổ âm. Chênh lệch chỉ về giá vốn không được điều chỉnh tự động.
+        Phiếu tạo ra trở thành mốc phát lại cho các lần đối soát sau.
+        Trả về {branch_id: {"voucher_id": mã phiếu hoặc None, "skipped": {sku: lý do}, "error": thông báo lỗi hoặc None}}.
+        """
+        quantity_issues = discrepancies[discrepancies['quantity_diff'] != 0]
+        results = {}
+        for branch_id, rows in quantity_issues.groupby('branch_id'):
+            items, skipped = [], {}
+            for sku, stock, ledger in zip(rows['sku'], rows['stock_quantity'], rows['ledger_quantity']):
+                stock, ledger = float(0 if pd.isna(stock) else stock), float(0 if pd.isna(ledger) else ledger)
+                if ledger < 0:
+                    skipped[sku] = f"Số lượng theo sổ kho âm ({ledger:g}), cần kiểm tra thủ công."
+                else:
+                    items.append({'sku': sku, 'actual_quantity': ledger, 'expected_quantity': stock})
+            try:
+                voucher_id = self.inventory_mgr.create_adjustment(
+                    branch_id, user_id, items, RECONCILE_REASON, f"Đối soát tồn kho tự động ({len(items)} mặt hàng)",
+                    datetime.now(), skipped=skipped
+                ) if items else None
+                results[branch_id] = {"voucher_id": voucher_id, "skipped": skipped, "error": None}
+            except Exception as e:
+                logging.error(f"Lỗi khi tạo phiếu đối soát cho chi nhánh {branch_id}: {e}")
+                results[branch_id] = {"voucher_id": None, "skipped": skipped, "error": str(e)}
+        return results
@@ -5,8 +5,7 @@ import streamlit as st
 from google.cloud import firestore
 from datetime import datetime, time
 
-@firestore.transactional
-def _create_voucher_and_transactions_transactional(transaction, db, voucher_ref, voucher_data, items):
+def _write_voucher_and_transactions(transaction, db, voucher_ref, voucher_data, items):
     """
     Hàm giao dịch cốt lõi để tạo chứng từ và các bản ghi giao dịch tồn kho liên quan.
     Đảm bảo tất cả các hoạt động được thực hiện một cách nguyên tử.
@@ -64,11 +63,15 @@ def _create_voucher_and_transactions_transactional(transaction, db, voucher_ref,
             'quantity_before': current_quantity, 'quantity_after': new_quantity,
             'cost_at_transaction': new_avg_cost, 'purchase_price': purchase_price,
             'notes': voucher_data.get('notes', ''), 'timestamp': voucher_data['created_at'],
+            # `timestamp` là ngày nghiệp vụ (có thể lùi ngày); `recorded_at` là thời điểm ghi thực tế dùng để sắp thứ tự sổ kho.
+            'recorded_at': firestore.SERVER_TIMESTAMP,
         })
         processed_transaction_ids.append(trans_id)
 
     transaction.set(voucher_ref, {**voucher_data, 'transaction_ids': processed_transaction_ids})
 
+_create_voucher_and_transactions_transactional = firestore.transactional(_write_voucher_and_transactions)
+
 class InventoryManager:
     def __init__(self, firebase_client):
         self.db = firebase_client.db
@@ -109,7 +112,11 @@ class InventoryManager:
         }
 
         voucher_ref = self.vouchers_col.document(voucher_id)
-        _create_voucher_and_transactions_transactional(transaction, self.db, voucher_ref, voucher_data, items)
+        if transaction.in_progress:
+            # Đang ở trong một giao dịch của người gọi: ghi vào chính giao dịch đó thay vì mở (và commit) giao dịch lồng.
+            _write_voucher_and_transactions(transaction, self.db, voucher_ref, voucher_data, items)
+        else:
+            _create_voucher_and_transactions_transactional(transaction, self.db, voucher_ref, voucher_data, items)
         return voucher_id
 
     def create_goods_receipt(self, branch_id, user_id, items, supplier, notes, receipt_date):
@@ -132,12 +139,18 @@ class InventoryManager:
         self._clear_caches()
         return voucher_id
 
-    def create_adjustment(self, branch_id, user_id, items, reason, notes, adjustment_date):
+    def create_adjustment(self, branch_id, user_id, items, reason, notes, adjustment_date, skipped: dict = None):
+        """
+        Phiếu điều chỉnh đưa tồn kho về `actual_quantity` của từng mặt hàng; lượng điều chỉnh được tính trong giao dịch.
+        Mặt hàng có thêm `expected_quantity` chỉ được điều chỉnh khi tồn kho hiện tại vẫn bằng giá trị đó (ví dụ: đối soát
+        tự động, tránh ghi đè các lượt bán/nhập xảy ra sau lúc đối soát); nếu không, mặt hàng bị bỏ qua và lý do được ghi
+        vào `skipped` ({sku: lý do}) khi người gọi truyền dict này.
+        """
         if not items: raise ValueError("Phiếu điều chỉnh phải có ít nhất một sản phẩm.")
 
         @firestore.transactional
         def _transactional_adjustment(transaction):
-            items_with_delta = []
+            items_with_delta, attempt_skipped = [], {}
             for item in items:
                 inv_doc_ref = self.inventory_col.document(f"{item['sku'].upper()}_{branch_id}")
                 inv_snapshot = inv_doc_ref.get(transaction=transaction)
@@ -145,6 +158,11 @@ class InventoryManager:
                 current_quantity = 0
                 if inv_snapshot.exists:
                     current_quantity = inv_snapshot.to_dict().get('stock_quantity', 0)
+
+                expected_quantity = item.get('expected_quantity')
+                if expected_quantity is not None and current_quantity != expected_quantity:
+                    attempt_skipped[item['sku']] = f"Tồn kho đã thay đổi ({expected_quantity:g} → {current_quantity:g}), cần kiểm tra lại."
+                    continue
                 
                 delta = item['actual_quantity'] - current_quantity
                 
@@ -157,8 +175,10 @@ class InventoryManager:
                     })
             
             if not items_with_delta:
-                return None
+                return None, attempt_skipped
 
+            # `transaction` đã được mở bởi chính hàm này: execute_voucher_creation_in_transaction ghi thẳng vào nó
+            # (không bọc thêm một lớp @firestore.transactional, vốn báo lỗi với giao dịch đang chạy).
             voucher_id = self.execute_voucher_creation_in_transaction(
                 transaction,
                 f'ADJUSTMENT_{reason.upper()}',
@@ -169,9 +189,11 @@ class InventoryManager:
                 notes,
                 reason=reason
             )
-            return voucher_id
+            return voucher_id, attempt_skipped
 
-        voucher_id = _transactional_adjustment(self.db.transaction())
+        voucher_id, attempt_skipped = _transactional_adjustment(self.db.transaction())
+        if skipped is not None:
+            skipped.update(attempt_skipped)
 
         if voucher_id:
             self._clear_caches()
@@ -233,7 +255,7 @@ class InventoryManager:
             'id': trans_id, 'voucher_id': order_id, 'sku': sku, 'branch_id': branch_id, 'user_id': user_id,
             'reason': 'SALE', 'delta': delta, 'quantity_before': current_quantity, 'quantity_after': new_quantity,
             'cost_at_transaction': average_cost, 'purchase_price': None, 'notes': f'Bán hàng theo đơn hàng {order_id}',
-            'timestamp': transaction_timestamp,
+            'timestamp': transaction_timestamp, 'recorded_at': firestore.SERVER_TIMESTAMP,
         })
         return average_cost
 
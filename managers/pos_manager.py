@@ -6,6 +6,8 @@ import uuid
 from .cost_manager import CostManager
 from .price_manager import PriceManager
 from .promotion_manager import PromotionManager # Ensure promotion manager is imported if not already
+from .rollup_manager import RollupManager
+from .report_cache import get_daily_aggregate_cache
 
 class POSManager:
     def __init__(self, firebase_client, inventory_mgr, customer_mgr, promotion_mgr: PromotionManager, cost_mgr: CostManager, price_mgr: PriceManager):
@@ -15,6 +17,7 @@ class POSManager:
         self.promotion_mgr = promotion_mgr
         self.cost_mgr = cost_mgr
         self.price_mgr = price_mgr
+        self.rollup_mgr = RollupManager(firebase_client)
 
     # --------------------------------------------------------------------------
     # HÀM QUẢN LÝ GIỎ HÀNG
@@ -167,13 +170,16 @@ class POSManager:
                     )
                 
                 transaction_ref = self.db.collection('transactions').document(order_id)
-                transaction.set(transaction_ref, transaction_data)
+                # `recorded_at` là thời điểm ghi thực tế (máy chủ gán), dùng làm mốc sao chép tăng dần; `created_at` là ngày nghiệp vụ.
+                transaction.set(transaction_ref, {**transaction_data, 'recorded_at': firestore.SERVER_TIMESTAMP})
+                self.rollup_mgr.apply_transaction(transaction, transaction_data)
 
             # Execute the transaction
             _process_order_and_cogs(self.db.transaction())
             # Clear cache AFTER transaction is successful
             self.inventory_mgr._clear_caches()
             self.promotion_mgr.get_active_price_program.clear()
+            get_daily_aggregate_cache().invalidate(branch_id, creation_timestamp)
             return True, order_id
         except Exception as e:
             return False, str(e)
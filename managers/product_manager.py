@@ -3,9 +3,11 @@ import uuid
 import logging
 import streamlit as st
 from google.cloud import firestore
-from managers.image_handler import ImageHandler
+from managers.image_handler import get_image_handler
+from managers.image_upload_queue import get_image_upload_queue, IMAGE_STATUS_PENDING
 from managers.price_manager import PriceManager
 from managers.category_manager import CategoryManager
+from managers.projections import project
 
 def hash_product_manager(manager):
     # This simple hash function tells Streamlit that the ProductManager object is static
@@ -16,20 +18,19 @@ class ProductManager:
         self.db = firebase_client.db
         self.price_mgr = price_mgr
         self.products_collection = self.db.collection('products')
+        self._firebase_client = firebase_client
         self._image_handler = None  # Private attribute for lazy loading
         self.product_image_folder_id = st.secrets.get("drive_product_folder_id") or st.secrets.get("drive_folder_id")
         self.category_manager = CategoryManager(firebase_client)
+        self.upload_queue = get_image_upload_queue(firebase_client)
 
     @property
     def image_handler(self):
-        """Lazy loads the ImageHandler to avoid recursion and unnecessary initializations."""
-        if self._image_handler is None and "drive_oauth" in st.secrets:
-            try:
-                creds_info = dict(st.secrets["drive_oauth"])
-                if creds_info.get('refresh_token'):
-                    self._image_handler = ImageHandler(credentials_info=creds_info)
-            except Exception as e:
-                logging.error(f"Failed to initialize ImageHandler for products: {e}")
+        """Lazily attaches the process-wide ImageHandler (shared Drive client) and starts the upload queue on it."""
+        if self._image_handler is None:
+            self._image_handler = get_image_handler(self._firebase_client)
+            if self._image_handler:
+                self.upload_queue.start(self._image_handler)
         return self._image_handler
 
     # --- Generic Category/Brand/Unit Methods (using CategoryManager) ---
@@ -53,18 +54,19 @@ class ProductManager:
                 'created_at': firestore.SERVER_TIMESTAMP,
                 'updated_at': firestore.SERVER_TIMESTAMP
             }
+            upload_image = bool(image_file and self.image_handler and self.product_image_folder_id)
+            job_id = self.upload_queue.new_job_id() if upload_image else None
+            if upload_image:
+                new_product_data['image_status'] = IMAGE_STATUS_PENDING
+                new_product_data['image_job_id'] = job_id
             self.products_collection.document(sku).set(new_product_data)
 
-            if image_file and self.image_handler and self.product_image_folder_id:
-                new_image_id = self.image_handler.upload_image(
-                    image_file, self.product_image_folder_id, base_filename=sku
-                )
-                if new_image_id:
-                    self.products_collection.document(sku).update({'image_id': new_image_id})
+            if upload_image:
+                # Ảnh được tối ưu và tải lên Drive ở luồng nền; tài liệu được cập nhật image_id khi xong.
+                self.upload_queue.enqueue('products', sku, image_file, self.product_image_folder_id,
+                                          base_filename=sku, on_complete=self._clear_product_caches, job_id=job_id)
             
-            # Clear relevant caches
-            self.get_all_products.clear()
-            self.get_listed_products_for_branch.clear() # Clear branch product list cache
+            self._clear_product_caches()
             return True, f"Tạo sản phẩm '{product_data['name']}' (SKU: {sku}) thành công!"
 
         except Exception as e:
@@ -82,28 +84,34 @@ class ProductManager:
                 return False, "Sản phẩm không tồn tại."
 
             current_image_id = product_doc.to_dict().get('image_id')
-            new_image_id = current_image_id
 
-            if (delete_image_flag or image_file) and current_image_id and self.image_handler:
-                self.image_handler.delete_image_by_id(current_image_id)
-                new_image_id = None
+            if delete_image_flag or image_file:
+                self.upload_queue.discard(product_id)  # ảnh đang chờ tải trước đó không còn cần nữa
+                # Công việc cũ đang upload dở sẽ thấy image_job_id đã đổi và không ghi đè tài liệu.
+                updates['image_status'] = None
+                updates['image_job_id'] = None
 
+            job_id = None
             if image_file and self.image_handler and self.product_image_folder_id:
-                uploaded_id = self.image_handler.upload_image(
-                    image_file, self.product_image_folder_id, base_filename=product_id
-                )
-                if uploaded_id:
-                    new_image_id = uploaded_id
-            
-            updates['image_id'] = new_image_id
+                # Giữ ảnh hiện tại cho đến khi ảnh mới tải xong; ảnh cũ bị xoá ở luồng nền sau đó.
+                job_id = self.upload_queue.new_job_id()
+                updates['image_status'] = IMAGE_STATUS_PENDING
+                updates['image_job_id'] = job_id
+
+            if delete_image_flag and current_image_id and self.image_handler:
+                self.image_handler.delete_image_by_id(current_image_id)
+                updates['image_id'] = None
+
             updates['updated_at'] = firestore.SERVER_TIMESTAMP
             
             product_ref.update(updates)
 
-            # Clear all relevant caches
-            self.get_all_products.clear()
-            self.get_product_by_id.clear()
-            self.get_listed_products_for_branch.clear()
+            if job_id:
+                self.upload_queue.enqueue('products', product_id, image_file, self.product_image_folder_id,
+                                          base_filename=product_id, replaces=None if delete_image_flag else current_image_id,
+                                          on_complete=self._clear_product_caches, job_id=job_id)
+
+            self._clear_product_caches()
 
             return True, f"Sản phẩm {product_id} đã được cập nhật thành công."
 
@@ -118,24 +126,40 @@ class ProductManager:
             
             if product_doc and product_doc.get('image_id') and self.image_handler:
                 self.image_handler.delete_image_by_id(product_doc['image_id'])
+            self.upload_queue.discard(product_id)
             
             product_ref.delete()
 
-            # Clear all relevant caches
-            self.get_all_products.clear()
-            self.get_product_by_id.clear()
-            self.get_listed_products_for_branch.clear()
+            self._clear_product_caches()
             return True, f"Sản phẩm {product_id} đã được xóa vĩnh viễn."
         except Exception as e:
             logging.error(f"Error deleting product {product_id}: {e}")
             return False, f"Lỗi khi xóa sản phẩm: {e}"
 
+    def retry_image_upload(self, product_id):
+        """Xếp lại ảnh tải lên bị lỗi của một sản phẩm."""
+        if not self.image_handler:
+            return False, "Dịch vụ Google Drive chưa được cấu hình."
+        if not self.upload_queue.retry(product_id, on_complete=self._clear_product_caches):
+            return False, "Không còn ảnh nào chờ thử lại cho sản phẩm này, vui lòng tải ảnh lên lại."
+        self._clear_product_caches()
+        return True, "Đã xếp lại ảnh để tải lên."
+
+    def _clear_product_caches(self, *_):
+        self.get_all_products.clear()
+        self.get_product_by_id.clear()
+        self.get_listed_products_for_branch.clear()
+
     # --- Data Retrieval Methods ---
     @st.cache_data(ttl=600)
-    def get_all_products(_self, active_only: bool = True):
+    def get_all_products(_self, active_only: bool = True, full: bool = False):
+        """
+        Danh sách sản phẩm. Mặc định chỉ lấy các trường tham chiếu (SKU, tên, danh mục, giá vốn);
+        truyền `full=True` khi cần đủ tài liệu (trang danh mục, màn hình bán hàng).
+        """
         try:
             query = _self.products_collection.order_by("created_at", direction=firestore.Query.DESCENDING)
-            docs = query.stream()
+            docs = project(query, 'products.reference', full=full).stream()
             all_products = [{"id": doc.id, **doc.to_dict()} for doc in docs]
             if active_only:
                 return [p for p in all_products if p.get('active', False)]
@@ -160,7 +184,7 @@ class ProductManager:
             st.error("Lỗi: Price Manager không được khởi tạo.")
             return []
         try:
-            all_products = _self.get_all_products(active_only=True)
+            all_products = _self.get_all_products(active_only=True, full=True)
             branch_prices = _self.price_mgr.get_active_prices_for_branch(branch_id)
             branch_price_map = {p['sku']: p for p in branch_prices}
             
@@ -0,0 +1,50 @@
+"""
+Khai báo các trường (projection) mà từng truy vấn danh sách/báo cáo thực sự cần.
+Truy vấn được áp dụng `select()` để Firestore chỉ trả về các trường này, tránh tải các mảng lớn
+như `items` của giao dịch khi màn hình không dùng tới. Muốn lấy đủ tài liệu thì truyền `full=True`.
+"""
+
+# Chỉ lấy tham chiếu tài liệu (không kèm trường nào) - dùng cho các vòng xoá.
+REFERENCE_ONLY = []
+
+PROJECTIONS = {
+    # Danh sách lịch sử giao dịch: dòng hàng được tải riêng khi mở xem chi tiết.
+    'transactions.summary': ['type', 'status', 'created_at', 'branch_id', 'cashier_id', 'customer_id',
+                             'payment_method', 'total_amount', 'discount_amount'],
+    # Danh mục sản phẩm dạng tham chiếu (chọn sản phẩm, tra tên, giá vốn).
+    'products.reference': ['sku', 'name', 'category_id', 'cogs', 'active', 'created_at'],
+    'products.category': ['category_id'],
+    'products.name': ['name'],
+    'categories.name': ['category_name'],
+    'inventory.valuation': ['sku', 'branch_id', 'stock_quantity', 'average_cost'],
+    # Đối soát tồn kho: phát lại sổ kho, không cần ghi chú, người dùng...
+    'inventory_transactions.replay': ['sku', 'branch_id', 'reason', 'delta', 'quantity_after', 'cost_at_transaction', 'timestamp', 'recorded_at'],
+    'stock_transfers.list': ['id', 'source_branch_id', 'destination_branch_id', 'created_at', 'status', 'notes',
+                             'items', 'dispatch_info', 'receipt_info', 'cancellation_info'],
+    # Dọn ảnh mồ côi trên Drive: chỉ cần biết tệp nào còn được tham chiếu.
+    'products.image_ref': ['image_id'],
+    'cost_entries.attachment_ref': ['attachment_id'],
+    'cost_entries.list': ['id', 'name', 'group_id', 'branch_id', 'amount', 'entry_date', 'status', 'attachment_id'],
+    'daily_sales_rollups.report': ['branch_id', 'date', 'order_count', 'total_revenue', 'total_cogs',
+                                   'expense_count', 'total_operating_expenses',
+                                   'expenses_by_group', 'expenses_by_classification'],
+    'daily_sku_rollups.report': ['branch_id', 'date', 'sku', 'name', 'quantity_sold', 'revenue', 'cogs'],
+    # Dựng lại tổng hợp: cần `items` nhưng bỏ qua các trường thông tin khách hàng, thanh toán...
+    'transactions.rollup_source': ['type', 'branch_id', 'created_at', 'total_amount', 'total_cogs',
+                                   'items', 'expense_details'],
+}
+
+def fields_for(name: str) -> list:
+    if name not in PROJECTIONS:
+        raise KeyError(f"Chưa khai báo projection: {name}")
+    return list(PROJECTIONS[name])
+
+def project(query, name: str, full: bool = False):
+    """Áp dụng projection đã khai báo cho truy vấn; `full=True` giữ nguyên truy vấn để lấy toàn bộ tài liệu."""
+    if full:
+        return query
+    return query.select(fields_for(name))
+
+def references_only(query):
+    """Truy vấn chỉ trả về tham chiếu tài liệu, dùng khi chỉ cần `doc.reference` hoặc `doc.id`."""
+    return query.select(REFERENCE_ONLY)
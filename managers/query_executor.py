@@ -0,0 +1,116 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import streamlit as st
+
+# Firestore giới hạn số giá trị của toán tử 'in'; chia nhỏ danh sách chi nhánh để luôn nằm dưới giới hạn.
+BRANCH_CHUNK_SIZE = 10
+DEFAULT_TIME_SLICE = timedelta(days=31)
+DEFAULT_MAX_WORKERS = 8
+
+def chunk_branches(branch_ids: list, chunk_size: int = BRANCH_CHUNK_SIZE) -> list:
+    """Chia danh sách chi nhánh thành các nhóm ≤ chunk_size. Không lọc chi nhánh -> một nhóm `None`."""
+    if not branch_ids:
+        return [None]
+    unique_ids = list(dict.fromkeys(branch_ids))
+    return [unique_ids[i:i + chunk_size] for i in range(0, len(unique_ids), chunk_size)]
+
+def split_time_range(start, end, slice_size: timedelta = DEFAULT_TIME_SLICE) -> list:
+    """
+    Chia [start, end] thành các đoạn liên tiếp, không chồng lấn và đều bao gồm hai đầu mút,
+    nên có thể giữ nguyên điều kiện '>=' / '<=' của truy vấn gốc cho từng đoạn.
+    Hỗ trợ datetime (đoạn kế tiếp bắt đầu sau 1 micro giây) và date (sau 1 ngày).
+    """
+    if start is None or end is None:
+        return [(start, end)]
+    step = timedelta(microseconds=1) if isinstance(start, datetime) else timedelta(days=1)
+    slices = []
+    slice_start = start
+    while slice_start <= end:
+        slice_end = min(slice_start + slice_size - step, end)
+        slices.append((slice_start, slice_end))
+        slice_start = slice_end + step
+    return slices
+
+def day_bounds(start_day, end_day) -> tuple:
+    """
+    Cận nửa mở [start_day, end_day + 1 ngày) dạng chuỗi ISO cho một lát ngày (từ split_time_range trên `date`).
+    Dùng cho trường ngày lưu dạng chuỗi ('YYYY-MM-DD' hoặc 'YYYY-MM-DDT...'): truy vấn `>= start` và `< next_start`
+    giữ trọn mọi giá trị trong ngày cuối, và hai lát liền nhau không bỏ sót hay trùng ngày nào.
+    Đầu mút None giữ nguyên None (khoảng mở phía đó).
+    """
+    return (start_day.isoformat() if start_day is not None else None,
+            (end_day + timedelta(days=1)).isoformat() if end_day is not None else None)
+
+def _to_dict_with_id(doc) -> dict:
+    return {**doc.to_dict(), 'id': doc.id}
+
+class QueryExecutor:
+    """
+    Thực thi một truy vấn Firestore theo kiểu fan-out: chia theo nhóm chi nhánh và theo lát thời gian,
+    chạy các lát song song trên một thread pool có giới hạn rồi trả kết quả về theo đúng thứ tự lát.
+    Tổng thời gian xấp xỉ thời gian của lát chậm nhất thay vì tổng thời gian đọc tuần tự qua một cursor.
+    """
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS):
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fanout-query")
+
+    def _run_slice(self, build_query, branch_chunk, slice_start, slice_end, mapper):
+        query = build_query(branch_chunk, slice_start, slice_end)
+        return [mapper(doc) for doc in query.stream()]
+
+    def stream(self, build_query, branch_ids: list = None, start=None, end=None,
+               slice_size: timedelta = DEFAULT_TIME_SLICE, descending: bool = False,
+               sort_key=None, mapper=_to_dict_with_id, branch_chunk_size: int = BRANCH_CHUNK_SIZE):
+        """
+        Sinh ra danh sách kết quả của từng lát thời gian theo thứ tự (tăng dần, hoặc giảm dần nếu `descending`).
+        build_query(branch_chunk, slice_start, slice_end) trả về truy vấn cho một lát; branch_chunk là danh sách
+        chi nhánh (≤ BRANCH_CHUNK_SIZE) hoặc None khi không lọc chi nhánh.
+        Kết quả của các nhóm chi nhánh trong cùng một lát được gộp và sắp xếp lại theo `sort_key` nếu có.
+        `branch_chunk_size=1` cho mỗi chi nhánh một truy vấn riêng, chạy song song.
+        """
+        time_slices = split_time_range(start, end, slice_size)
+        if descending:
+            time_slices.reverse()
+        branch_chunks = chunk_branches(branch_ids, branch_chunk_size)
+
+        futures = [
+            [self._pool.submit(self._run_slice, build_query, chunk, slice_start, slice_end, mapper) for chunk in branch_chunks]
+            for slice_start, slice_end in time_slices
+        ]
+        logging.debug(f"Fan-out truy vấn: {len(time_slices)} lát thời gian × {len(branch_chunks)} nhóm chi nhánh.")
+
+        try:
+            for slice_futures in futures:
+                rows = [row for future in slice_futures for row in future.result()]
+                if sort_key is not None and len(slice_futures) > 1:
+                    rows.sort(key=sort_key, reverse=descending)
+                yield rows
+        finally:
+            # Người gọi dừng sớm hoặc có lỗi: huỷ các lát chưa chạy.
+            for slice_futures in futures:
+                for future in slice_futures:
+                    future.cancel()
+
+    def run(self, build_query, branch_ids: list = None, start=None, end=None, **kwargs) -> list:
+        """Như `stream` nhưng gộp toàn bộ kết quả thành một danh sách."""
+        return [row for rows in self.stream(build_query, branch_ids, start, end, **kwargs) for row in rows]
+
+    def fold(self, build_query, branch_ids: list, fold_fn, initial_fn, branch_chunk_size: int = BRANCH_CHUNK_SIZE) -> list:
+        """
+        Như `run` nhưng không giữ lại tài liệu: mỗi nhóm chi nhánh đọc luồng tài liệu của mình (song song) và gộp dần
+        vào một trạng thái riêng: state = initial_fn(), rồi fold_fn(state, doc) cho từng tài liệu.
+        Bộ nhớ tỉ lệ với kích thước trạng thái thay vì số tài liệu. Trả về danh sách trạng thái theo nhóm chi nhánh.
+        """
+        def fold_chunk(branch_chunk):
+            state = initial_fn()
+            for doc in build_query(branch_chunk, None, None).stream():
+                fold_fn(state, doc)
+            return state
+        futures = [self._pool.submit(fold_chunk, chunk) for chunk in chunk_branches(branch_ids, branch_chunk_size)]
+        return [future.result() for future in futures]
+
+@st.cache_resource
+def get_query_executor() -> QueryExecutor:
+    """Một thread pool dùng chung cho toàn tiến trình, giới hạn số truy vấn chạy song song tới Firestore."""
+    return QueryExecutor()
@@ -0,0 +1,144 @@
+"""
+Các hàm dựng báo cáo thuần (không truy cập Firestore) trên khung dữ liệu dòng hàng (line frame).
+Mỗi dòng của line frame là doanh số một SKU tại một chi nhánh trong một ngày (hoặc trong cả khoảng ngày),
+với các cột trong LINE_COLUMNS. Tất cả phép tính đều được vector hoá bằng pandas/numpy (factorize + bincount, np.where).
+"""
+import numpy as np
+import pandas as pd
+
+LINE_COLUMNS = ['branch_id', 'date', 'sku', 'name', 'quantity_sold', 'revenue', 'cogs']
+NUMERIC_LINE_COLUMNS = ['quantity_sold', 'revenue', 'cogs']
+
+def _empty_line_frame() -> pd.DataFrame:
+    return pd.DataFrame({col: pd.Series(dtype='float64' if col in NUMERIC_LINE_COLUMNS else 'object') for col in LINE_COLUMNS})
+
+def _finalize_line_frame(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.reindex(columns=LINE_COLUMNS)
+    df[NUMERIC_LINE_COLUMNS] = df[NUMERIC_LINE_COLUMNS].apply(pd.to_numeric, errors='coerce').fillna(0.0)
+    df['name'] = df['name'].fillna('N/A')
+    df = df[df['sku'].notna()].reset_index(drop=True)
+    # Mã hoá từ điển các cột chuỗi ít giá trị (giống cột dictionary của Parquet): giảm bộ nhớ, group-by trên mã số nguyên.
+    return df.astype({'branch_id': 'category', 'sku': 'category', 'name': 'category'})
+
+def line_frame_from_rollups(records: list) -> pd.DataFrame:
+    """Dựng line frame từ các bản ghi tổng hợp (chi nhánh, ngày, SKU)."""
+    if not records:
+        return _empty_line_frame()
+    return _finalize_line_frame(pd.DataFrame.from_records(records))
+
+def line_frame_from_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Dựng line frame từ một DataFrame tổng hợp có sẵn (kho Parquet), không đi qua list dict."""
+    if df.empty:
+        return _empty_line_frame()
+    return _finalize_line_frame(df)
+
+def _group_sums(keys: pd.Series, values: dict) -> pd.DataFrame:
+    """
+    Tổng theo khoá bằng mã số nguyên (categorical/factorize) + np.bincount, nhanh hơn groupby trên cột chuỗi.
+    Trả về DataFrame gồm cột khoá và các cột tổng, cùng vị trí một dòng đại diện của mỗi khoá (`_row`) để lấy các cột mô tả như tên.
+    """
+    if isinstance(keys.dtype, pd.CategoricalDtype):
+        codes, uniques = keys.cat.codes.to_numpy(), keys.cat.categories
+    else:
+        codes, uniques = pd.factorize(keys, sort=False)
+    n_groups = len(uniques)
+    result = pd.DataFrame({'key': np.asarray(uniques, dtype=object)})
+    for name, column in values.items():
+        result[name] = np.bincount(codes, weights=np.asarray(column, dtype='float64'), minlength=n_groups)
+    sample_rows = np.zeros(n_groups, dtype='int64')
+    sample_rows[codes] = np.arange(len(codes))
+    result['_row'] = sample_rows
+    # Bỏ các category không còn dòng nào (ví dụ sau khi lọc line frame).
+    return result[np.bincount(codes, minlength=n_groups) > 0].reset_index(drop=True)
+
+def margin_percent(profit, revenue) -> np.ndarray:
+    """Tỷ suất lợi nhuận (%) vector hoá; bằng 0 khi doanh thu không dương."""
+    profit = np.asarray(profit, dtype='float64')
+    revenue = np.asarray(revenue, dtype='float64')
+    safe_revenue = np.where(revenue > 0, revenue, 1.0)
+    return np.where(revenue > 0, profit / safe_revenue * 100, 0.0)
+
+def build_profit_analysis(line_df: pd.DataFrame, product_categories: dict, category_names: dict):
+    """
+    Lợi nhuận theo sản phẩm và theo danh mục.
+    product_categories: sku -> category_id; category_names: category_id -> tên danh mục.
+    Trả về None nếu không có dữ liệu bán hàng.
+    """
+    if line_df.empty:
+        return None
+
+    profit_df = _group_sums(line_df['sku'], {
+        'total_quantity_sold': line_df['quantity_sold'],
+        'total_revenue': line_df['revenue'],
+        'total_cogs': line_df['cogs'],
+    }).rename(columns={'key': 'product_id'})
+    profit_df['product_name'] = line_df['name'].iloc[profit_df.pop('_row').to_numpy()].to_numpy()
+    profit_df['total_profit'] = profit_df['total_revenue'] - profit_df.pop('total_cogs')
+    profit_df['category_id'] = profit_df['product_id'].map(product_categories)
+    profit_df['category_name'] = profit_df['category_id'].map(category_names).fillna('Không có danh mục')
+    profit_df['profit_margin'] = margin_percent(profit_df['total_profit'], profit_df['total_revenue'])
+    profit_df = profit_df[['product_id', 'product_name', 'category_id', 'total_quantity_sold', 'total_revenue',
+                           'total_profit', 'category_name', 'profit_margin']]
+
+    category_profit_df = _group_sums(profit_df['category_name'], {
+        'total_revenue': profit_df['total_revenue'],
+        'total_profit': profit_df['total_profit'],
+    }).drop(columns='_row').rename(columns={'key': 'category_name'})
+    category_profit_df['profit_margin'] = margin_percent(category_profit_df['total_profit'], category_profit_df['total_revenue'])
+
+    return {
+        'product_profit_df': profit_df.sort_values(by='total_profit', ascending=False).reset_index(drop=True),
+        'category_profit_df': category_profit_df.sort_values(by='total_profit', ascending=False).reset_index(drop=True),
+    }
+
+def build_top_products(line_df: pd.DataFrame, limit: int = 5) -> pd.DataFrame:
+    """Top sản phẩm theo doanh thu, cùng định dạng cột với báo cáo doanh thu."""
+    if line_df.empty:
+        return pd.DataFrame(columns=['sku', 'name', 'Doanh_thu', 'Lợi_nhuận', 'Số_lượng'])
+    top_products = _group_sums(line_df['sku'], {
+        'Doanh_thu': line_df['revenue'],
+        'cogs': line_df['cogs'],
+        'Số_lượng': line_df['quantity_sold'],
+    }).rename(columns={'key': 'sku'})
+    top_products['name'] = line_df['name'].iloc[top_products.pop('_row').to_numpy()].to_numpy()
+    top_products['Lợi_nhuận'] = top_products['Doanh_thu'] - top_products.pop('cogs')
+    top_products = top_products.nlargest(limit, 'Doanh_thu').reset_index(drop=True)
+    return top_products[['sku', 'name', 'Doanh_thu', 'Lợi_nhuận', 'Số_lượng']]
+
+def build_pnl_totals(daily_records: list, cost_group_names: dict, ungrouped_key: str = '_none') -> dict:
+    """Tổng hợp P&L từ các bản ghi (chi nhánh, ngày): doanh thu, giá vốn, chi phí theo nhóm và theo phân loại."""
+    totals = {'order_count': 0, 'total_revenue': 0.0, 'total_cogs': 0.0, 'total_operating_expenses': 0.0}
+    by_group, by_classification = {}, {}
+    for record in daily_records:
+        for field in totals:
+            totals[field] += record.get(field, 0) or 0
+        for group_id, amount in (record.get('expenses_by_group') or {}).items():
+            group_name = cost_group_names.get(group_id, "Chưa phân loại")
+            by_group[group_name] = by_group.get(group_name, 0) + amount
+        for classification, amount in (record.get('expenses_by_classification') or {}).items():
+            classification = "Chưa phân loại" if classification == ungrouped_key else classification
+            by_classification[classification] = by_classification.get(classification, 0) + amount
+    totals['order_count'] = int(totals['order_count'])
+    totals['gross_profit'] = totals['total_revenue'] - totals['total_cogs']
+    totals['net_profit'] = totals['gross_profit'] - totals['total_operating_expenses']
+    totals['operating_expenses_by_group'] = by_group
+    totals['operating_expenses_by_classification'] = by_classification
+    return totals
+
+def build_revenue_summary(daily_records: list):
+    """KPI doanh thu và doanh thu theo ngày từ các bản ghi (chi nhánh, ngày). Trả về None nếu không có đơn hàng."""
+    sales = [r for r in daily_records if r.get('order_count', 0) > 0]
+    if not sales:
+        return None
+    daily_df = pd.DataFrame(sales).reindex(columns=['date', 'order_count', 'total_revenue', 'total_cogs']).fillna(0)
+    total_revenue = daily_df['total_revenue'].sum()
+    total_orders = int(daily_df['order_count'].sum())
+    daily_df['date'] = pd.to_datetime(daily_df['date']).dt.date
+    revenue_by_day = daily_df.groupby('date')['total_revenue'].sum().reset_index()
+    return {
+        "total_revenue": total_revenue,
+        "total_profit": total_revenue - daily_df['total_cogs'].sum(),
+        "total_orders": total_orders,
+        "average_order_value": total_revenue / total_orders if total_orders > 0 else 0,
+        "revenue_by_day": revenue_by_day.rename(columns={'date': 'Ngày', 'total_revenue': 'Doanh thu'}).set_index('Ngày'),
+    }
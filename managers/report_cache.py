@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+import streamlit as st
+
+from .rollup_manager import rollup_day_key
+
+ALL_BRANCHES_SCOPE = '__all__'
+
+def _day_range(start_day: str, end_day: str) -> list:
+    start, end = date.fromisoformat(start_day), date.fromisoformat(end_day)
+    return [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+
+def _contiguous_runs(days: list) -> list:
+    """Gom danh sách ngày (đã sắp xếp) thành các đoạn liên tiếp [(ngày_đầu, ngày_cuối), ...]."""
+    runs = []
+    for day in days:
+        if runs and date.fromisoformat(day) - date.fromisoformat(runs[-1][1]) == timedelta(days=1):
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return [tuple(run) for run in runs]
+
+class DailyAggregateCache:
+    """
+    Bộ nhớ đệm các tổng hợp một phần theo (loại, chi nhánh, ngày), dùng chung cho mọi phiên trong tiến trình.
+    Với một khoảng ngày mới, chỉ những ngày còn thiếu mới được đọc từ Firestore rồi ghép lại.
+    Các ngày đã đóng được giữ vô thời hạn (cho tới khi bị loại do vượt giới hạn hoặc bị huỷ hiệu lực),
+    riêng ngày hôm nay được làm mới sau `today_ttl_seconds`.
+    Việc đọc Firestore diễn ra ngoài khoá; mỗi lần huỷ hiệu lực tăng bộ đếm thế hệ, và kết quả của một lượt đọc
+    chỉ được lưu khi thế hệ của (chi nhánh, ngày) không đổi trong lúc đọc, để dữ liệu cũ không bị giữ vô thời hạn.
+    """
+    def __init__(self, today_ttl_seconds: int = 60, max_entries: int = 50000):
+        self.today_ttl_seconds = today_ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (kind, scope, day) -> (fetched_at, records)
+        self._changes = {}  # (branch_id | None, day | None) -> (thời điểm, thế hệ) của lần huỷ hiệu lực gần nhất
+        self._generation = 0  # tăng sau mỗi lần huỷ hiệu lực
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'fetches': 0}
+
+    def _is_fresh(self, key, today: str) -> bool:
+        entry = self._entries.get(key)
+        if entry is None:
+            return False
+        fetched_at, _ = entry
+        return key[2] < today or (time.time() - fetched_at) < self.today_ttl_seconds
+
+    def _store(self, key, records: list):
+        self._entries[key] = (time.time(), records)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _key_generation(self, scope: str, day: str) -> int:
+        """Thế hệ của (phạm vi, ngày): thế hệ lớn nhất trong các lần huỷ hiệu lực có ảnh hưởng tới nó. Gọi khi giữ khoá."""
+        return max((generation for (branch_id, change_day), (_, generation) in self._changes.items()
+                    if (change_day is None or change_day == day)
+                    and (branch_id is None or scope in (branch_id, ALL_BRANCHES_SCOPE))), default=0)
+
+    def get_range(self, kind: str, start_date, end_date, branch_ids: list, fetch_fn) -> list:
+        """
+        Trả về các bản ghi tổng hợp trong khoảng ngày cho các chi nhánh.
+        fetch_fn(start_day, end_day, branch_ids) chỉ được gọi cho các đoạn ngày còn thiếu.
+        """
+        start_day, end_day = rollup_day_key(start_date), rollup_day_key(end_date)
+        days = _day_range(start_day, end_day)
+        scopes = list(branch_ids) if branch_ids else [ALL_BRANCHES_SCOPE]
+        today = date.today().isoformat()
+
+        with self._lock:
+            missing_by_day = {}
+            for day in days:
+                stale_scopes = [scope for scope in scopes if not self._is_fresh((kind, scope, day), today)]
+                if stale_scopes:
+                    missing_by_day[day] = stale_scopes
+            self.stats['hits'] += len(days) * len(scopes) - sum(len(s) for s in missing_by_day.values())
+            self.stats['misses'] += sum(len(s) for s in missing_by_day.values())
+            generations = {(scope, day): self._key_generation(scope, day)
+                           for day, stale_scopes in missing_by_day.items() for scope in stale_scopes}
+
+        fetched = {}
+
+        for run_start, run_end in _contiguous_runs(sorted(missing_by_day)):
+            run_days = _day_range(run_start, run_end)
+            run_scopes = sorted({scope for day in run_days for scope in missing_by_day[day]})
+            records = fetch_fn(run_start, run_end, None if run_scopes == [ALL_BRANCHES_SCOPE] else run_scopes)
+
+            grouped = {(scope, day): [] for scope in run_scopes for day in run_days}
+            for record in records:
+                scope = ALL_BRANCHES_SCOPE if run_scopes == [ALL_BRANCHES_SCOPE] else record.get('branch_id')
+                if (scope, record.get('date')) in grouped:
+                    grouped[(scope, record.get('date'))].append(record)
+            with self._lock:
+                self.stats['fetches'] += 1
+                for (scope, day), day_records in grouped.items():
+                    fetched[(scope, day)] = day_records
+                    # Bị huỷ hiệu lực trong lúc đọc: vẫn trả kết quả cho lượt gọi này nhưng không lưu vào bộ đệm.
+                    if self._key_generation(scope, day) == generations.get((scope, day), 0):
+                        self._store((kind, scope, day), day_records)
+
+        result = []
+        with self._lock:
+            for scope in scopes:
+                for day in days:
+                    if (scope, day) in fetched:
+                        result.extend(fetched[(scope, day)])
+                        continue
+                    entry = self._entries.get((kind, scope, day))
+                    if entry:
+                        self._entries.move_to_end((kind, scope, day))
+                        result.extend(entry[1])
+        return result
+
+    def invalidate(self, branch_id: str = None, day=None):
+        """Huỷ hiệu lực các ngày bị thay đổi (ví dụ: xoá đơn cũ, chi phí ghi lùi ngày). Không tham số = xoá toàn bộ."""
+        day_key = rollup_day_key(day) if day else None
+        with self._lock:
+            self._generation += 1
+            if branch_id is None and day_key is None:
+                self._entries.clear()
+                self._changes = {(None, None): (time.time(), self._generation)}
+                return
+            self._changes[(branch_id, day_key)] = (time.time(), self._generation)
+            for key in list(self._entries):
+                _, scope, entry_day = key
+                if (day_key is None or entry_day == day_key) and (branch_id is None or scope in (branch_id, ALL_BRANCHES_SCOPE)):
+                    del self._entries[key]
+
+    def changed_since(self, start_day: str, end_day: str, branch_ids: list, since: float) -> bool:
+        """Có ngày nào trong khoảng (của các chi nhánh, None = mọi chi nhánh) bị huỷ hiệu lực sau thời điểm `since` không."""
+        with self._lock:
+            changes = list(self._changes.items())
+        return any(
+            changed_at > since
+            and (day is None or start_day <= day <= end_day)
+            and (branch_id is None or not branch_ids or branch_id in branch_ids)
+            for (branch_id, day), (changed_at, _) in changes
+        )
+
+    def invalidate_transaction(self, trans_data: dict):
+        if trans_data and trans_data.get('created_at'):
+            self.invalidate(trans_data.get('branch_id'), trans_data['created_at'])
+
+@st.cache_resource
+def get_daily_aggregate_cache() -> DailyAggregateCache:
+    """Một bộ nhớ đệm duy nhất cho toàn tiến trình Streamlit."""
+    return DailyAggregateCache()
@@ -1,5 +1,6 @@
 
 import logging
+import time
 from datetime import datetime, timedelta
 from google.cloud.firestore import Query
 import pandas as pd
@@ -7,152 +8,250 @@ from dateutil.relativedelta import relativedelta
 import streamlit as st
 
 from .cost_manager import CostManager
+from .rollup_manager import RollupManager, UNGROUPED_KEY
+from .analytics_store import AnalyticsStore, DEFAULT_STORE_DIR
+from .report_cache import get_daily_aggregate_cache
+from .projections import project
+from .query_executor import get_query_executor
+from .report_builders import (line_frame_from_rollups, build_profit_analysis, build_top_products,
+                              build_pnl_totals, build_revenue_summary)
+
+REPORT_BACKENDS = ('firestore', 'parquet')
+REPORT_BUNDLE_TTL_SECONDS = 60
+MAX_REPORT_BUNDLES = 8
 
 def hash_report_manager(manager):
     return "ReportManager"
 
 class ReportManager:
-    def __init__(self, firebase_client, cost_mgr: CostManager):
+    def __init__(self, firebase_client, cost_mgr: CostManager, backend: str = None, scheduler=None):
         self.db = firebase_client.db
         self.cost_mgr = cost_mgr
+        self.rollup_mgr = RollupManager(firebase_client)
+        self.analytics_store = AnalyticsStore(firebase_client, root_dir=st.secrets.get("analytics_store_dir", DEFAULT_STORE_DIR))
+        self.backend = backend or st.secrets.get("report_backend", "firestore")
+        self.aggregate_cache = get_daily_aggregate_cache()
+        self.executor = get_query_executor()
+        if self.backend not in REPORT_BACKENDS:
+            raise ValueError(f"Backend báo cáo không hợp lệ: {self.backend}")
         self.transactions_collection = self.db.collection('transactions')
         self.products_collection = self.db.collection('products')
         self.inventory_collection = self.db.collection('inventory')
         self.categories_collection = self.db.collection('ProductCategories')
-
-    def get_profit_loss_statement(self, start_date: datetime, end_date: datetime, branch_ids: list = None):
+        self._report_bundles = {}
+        self.scheduler = scheduler  # ReportScheduler: nguồn các báo cáo chuẩn đã được tính sẵn
+
+    def set_backend(self, backend: str):
+        """Chuyển nguồn dữ liệu cho báo cáo doanh thu, phân tích lợi nhuận và P&L."""
+        if backend not in REPORT_BACKENDS:
+            raise ValueError(f"Backend báo cáo không hợp lệ: {backend}")
+        self.backend = backend
+
+    def _get_daily_rollups(self, start_date: datetime, end_date: datetime, branch_ids: list = None, backend: str = None):
+        if (backend or self.backend) == 'parquet':
+            return self.analytics_store.daily_rollups(start_date, end_date, branch_ids)
+        return self.aggregate_cache.get_range('daily', start_date, end_date, branch_ids, self.rollup_mgr.get_daily_rollups)
+
+    def _get_sku_lines(self, start_date: datetime, end_date: datetime, branch_ids: list = None, backend: str = None):
+        """Line frame theo SKU: kho Parquet trả thẳng DataFrame; Firestore dựng từ các tài liệu tổng hợp (chi nhánh, ngày, SKU)."""
+        if (backend or self.backend) == 'parquet':
+            return self.analytics_store.sku_lines(start_date, end_date, branch_ids)
+        return line_frame_from_rollups(
+            self.aggregate_cache.get_range('sku', start_date, end_date, branch_ids, self.rollup_mgr.get_sku_rollups))
+
+    def load_category_maps(self) -> tuple:
+        """({product_id: category_id}, {category_id: tên danh mục}) cho phân tích lợi nhuận theo danh mục."""
+        product_categories = {p.id: p.to_dict().get('category_id') for p in project(self.products_collection, 'products.category').stream()}
+        category_names = {c.id: c.to_dict().get('category_name', 'N/A') for c in project(self.categories_collection, 'categories.name').stream()}
+        return product_categories, category_names
+
+    def load_report_inputs(self, start_date: datetime, end_date: datetime, branch_ids: list = None, backend: str = None) -> dict:
+        """Dữ liệu đầu vào của gói báo cáo: bản ghi tổng hợp (chi nhánh, ngày) và line frame theo SKU của khoảng ngày."""
+        return {
+            'daily_records': self._get_daily_rollups(start_date, end_date, branch_ids, backend),
+            'line_df': self._get_sku_lines(start_date, end_date, branch_ids, backend),
+        }
+
+    def build_report_bundle(self, inputs: dict, category_maps: tuple = None) -> dict:
+        """Dựng mọi báo cáo theo khoảng ngày từ dữ liệu đầu vào (xem load_report_inputs)."""
+        daily_records, line_df = inputs['daily_records'], inputs['line_df']
+        cost_groups = {g['id']: g['group_name'] for g in self.cost_mgr.get_all_cost_groups()}
+        product_categories, category_names = category_maps or self.load_category_maps()
+
+        revenue = build_revenue_summary(daily_records)
+        if revenue is not None:
+            revenue['top_products_by_revenue'] = build_top_products(line_df, limit=5)
+
+        return {
+            'built_at': time.time(),
+            'pnl': build_pnl_totals(daily_records, cost_groups, UNGROUPED_KEY),
+            'revenue': revenue,
+            'profit_analysis': build_profit_analysis(line_df, product_categories, category_names),
+        }
+
+    def _precomputed_inputs_with_today(self, start_date: datetime, end_date: datetime, branch_ids: list = None):
+        """
+        Kỳ kết thúc hôm nay (từ đầu tháng đến nay): đầu vào đã tính sẵn đến hôm qua ghép với phần hôm nay
+        đọc trực tiếp (chỉ một ngày), hoặc None nếu không có gói tính sẵn phù hợp.
+        """
+        closed = self.scheduler.lookup_closed_part(start_date, end_date, branch_ids)
+        if closed is None or 'inputs' not in closed:
+            return None
+        today_start = datetime.combine(closed['end_day'] + timedelta(days=1), datetime.min.time())
+        today_inputs = self.load_report_inputs(today_start, end_date, branch_ids, backend='firestore')
+        closed_lines, today_lines = closed['inputs']['line_df'], today_inputs['line_df']
+        if closed_lines.empty or today_lines.empty:
+            line_df = today_lines if closed_lines.empty else closed_lines
+        else:
+            line_df = pd.concat([closed_lines, today_lines], ignore_index=True)
+        return {'daily_records': closed['inputs']['daily_records'] + today_inputs['daily_records'], 'line_df': line_df}
+
+    def get_report_bundle(self, start_date: datetime, end_date: datetime, branch_ids: list = None, backend: str = None,
+                          use_precomputed: bool = True, category_maps: tuple = None) -> dict:
+        """
+        Đọc khoảng ngày một lần (tổng hợp ngày + tổng hợp SKU) và dựng cùng lúc mọi báo cáo theo khoảng ngày:
+        P&L, chi phí theo nhóm/phân loại, doanh thu theo ngày, top sản phẩm, lợi nhuận theo SKU và danh mục.
+        Kết quả được giữ theo khoá truy vấn trong phiên (ReportManager nằm trong st.session_state), nên chuyển
+        qua lại giữa trang P&L và trang phân tích cho cùng kỳ không đọc lại Firestore.
+        Với các kỳ chuẩn đã được tính sẵn (xem ReportScheduler), trả ngay gói đã lưu kèm `as_of`; kỳ từ đầu tháng
+        đến nay dùng gói tính sẵn đến hôm qua và chỉ đọc thêm dữ liệu của hôm nay.
+        `category_maps` (kết quả load_category_maps) cho phép dùng lại danh mục sản phẩm khi dựng nhiều gói liên tiếp.
+        """
+        cached = self._cached_bundle(start_date, end_date, branch_ids, backend, use_precomputed)
+        if cached is not None:
+            return cached
+
+        key = (start_date, end_date, tuple(sorted(branch_ids or ())), backend or self.backend)
+        inputs = None
+        if use_precomputed and self.scheduler and (backend or self.backend) == 'firestore':
+            inputs = self._precomputed_inputs_with_today(start_date, end_date, branch_ids)
+        if inputs is None:
+            inputs = self.load_report_inputs(start_date, end_date, branch_ids, backend)
+
+        bundle = self.build_report_bundle(inputs, category_maps)
+        self._report_bundles[key] = bundle
+        while len(self._report_bundles) > MAX_REPORT_BUNDLES:
+            self._report_bundles.pop(next(iter(self._report_bundles)))
+        return bundle
+
+    def _cached_bundle(self, start_date: datetime, end_date: datetime, branch_ids: list = None, backend: str = None,
+                       use_precomputed: bool = True):
+        """Gói báo cáo đã có sẵn (tính sẵn hoặc còn hạn trong phiên) mà không phát sinh lượt đọc nào, hoặc None."""
+        if use_precomputed and self.scheduler and (backend or self.backend) == 'firestore':
+            precomputed = self.scheduler.lookup(start_date, end_date, branch_ids)
+            if precomputed is not None:
+                return precomputed
+        cached = self._report_bundles.get((start_date, end_date, tuple(sorted(branch_ids or ())), backend or self.backend))
+        if cached and time.time() - cached['built_at'] < REPORT_BUNDLE_TTL_SECONDS:
+            return cached
+        return None
+
+    def _aggregate_sales_kpis(self, start_date: datetime, end_date: datetime, branch_ids: list = None) -> dict:
+        """
+        KPI doanh thu bằng truy vấn tổng hợp phía máy chủ (count/sum/avg) trên `transactions`:
+        Firestore chỉ trả về các con số, không tải tài liệu nào. Mỗi nhóm chi nhánh là một truy vấn.
+        """
+        def build_query(branch_chunk, *_):
+            query = self.transactions_collection.where('type', '==', 'SALE') \
+                .where('created_at', '>=', start_date).where('created_at', '<=', end_date)
+            if branch_chunk:
+                query = query.where('branch_id', 'in', branch_chunk)
+            return query.count(alias='orders').sum('total_amount', alias='revenue') \
+                .sum('total_cogs', alias='cogs').avg('total_amount', alias='average')
+
+        partials = self.executor.run(build_query, branch_ids,
+                                     mapper=lambda results: {r.alias: r.value for r in results})
+        orders = int(sum(p.get('orders') or 0 for p in partials))
+        revenue = float(sum(p.get('revenue') or 0 for p in partials))
+        cogs = float(sum(p.get('cogs') or 0 for p in partials))
+        # Nhiều nhóm chi nhánh: trung bình gộp = tổng doanh thu / tổng số đơn.
+        average = float(partials[0].get('average') or 0) if len(partials) == 1 else (revenue / orders if orders else 0)
+        return {"total_revenue": revenue, "total_profit": revenue - cogs, "total_orders": orders, "average_order_value": average}
+
+    def get_revenue_kpis(self, start_date: datetime, end_date: datetime, branch_ids: list, backend: str = None):
         """
-        Tạo báo cáo Lãi và Lỗ từ một nguồn dữ liệu duy nhất: collection 'transactions'.
+        Các chỉ số đầu trang báo cáo doanh thu. Thứ tự ưu tiên: gói báo cáo đã có sẵn (0 lượt đọc),
+        truy vấn tổng hợp phía máy chủ, rồi tính cục bộ từ dữ liệu tổng hợp theo ngày khi truy vấn tổng hợp
+        không khả dụng (thiếu chỉ mục, trình giả lập, backend Parquet).
         """
         try:
-            query = self.transactions_collection \
-                         .where('created_at', '>=', start_date) \
-                         .where('created_at', '<=', end_date)
-            
-            if branch_ids and isinstance(branch_ids, list) and len(branch_ids) > 0:
-                query = query.where('branch_id', 'in', branch_ids)
-            
-            all_transactions = query.stream()
-
-            total_revenue = 0.0
-            total_cogs = 0.0
-            total_operating_expenses = 0.0
-            order_count = 0
-            op_expenses_by_group = {}
-
-            cost_groups_raw = self.cost_mgr.get_all_category_items('cost_groups')
-            cost_groups = {g['id']: g['group_name'] for g in cost_groups_raw}
-
-            for trans in all_transactions:
-                trans_data = trans.to_dict()
-                trans_type = trans_data.get('type')
-
-                if trans_type == 'SALE':
-                    total_revenue += trans_data.get('total_amount', 0)
-                    total_cogs += trans_data.get('total_cogs', 0)
-                    order_count += 1
-                
-                elif trans_type == 'EXPENSE':
-                    expense_amount = abs(trans_data.get('total_amount', 0))
-                    total_operating_expenses += expense_amount
-                    group_id = trans_data.get('expense_details', {}).get('group_id')
-                    group_name = cost_groups.get(group_id, "Chưa phân loại")
-                    op_expenses_by_group[group_name] = op_expenses_by_group.get(group_name, 0) + expense_amount
-
-            gross_profit = total_revenue - total_cogs
-            net_profit = gross_profit - total_operating_expenses
+            bundle = self._cached_bundle(start_date, end_date, branch_ids, backend)
+            if bundle is not None:
+                revenue = bundle['revenue']
+                kpis = {k: revenue[k] for k in ('total_revenue', 'total_profit', 'total_orders', 'average_order_value')} if revenue else None
+                return {"success": True, "data": kpis, "as_of": bundle.get('as_of'), "source": "bundle"}
+
+            if (backend or self.backend) == 'firestore':
+                try:
+                    kpis = self._aggregate_sales_kpis(start_date, end_date, branch_ids)
+                    return {"success": True, "data": kpis if kpis['total_orders'] else None, "source": "aggregation"}
+                except Exception as e:
+                    logging.warning(f"Truy vấn tổng hợp KPI không khả dụng, chuyển sang tính cục bộ: {e}")
+
+            summary = build_revenue_summary(self._get_daily_rollups(start_date, end_date, branch_ids, backend))
+            kpis = {k: summary[k] for k in ('total_revenue', 'total_profit', 'total_orders', 'average_order_value')} if summary else None
+            return {"success": True, "data": kpis, "source": "local"}
+        except Exception as e:
+            logging.error(f"Lỗi khi lấy KPI doanh thu: {e}")
+            return {"success": False, "message": str(e)}
 
+    def clear_report_bundles(self):
+        self._report_bundles.clear()
+
+    def export_analytics_store(self, full_refresh: bool = False):
+        """Sao chép tăng dần dữ liệu Firestore sang kho phân tích cục bộ (Parquet)."""
+        return self.analytics_store.export_all(full_refresh=full_refresh)
+
+    def get_profit_loss_statement(self, start_date: datetime, end_date: datetime, branch_ids: list = None, backend: str = None):
+        """
+        Tạo báo cáo Lãi và Lỗ từ các tài liệu tổng hợp theo (chi nhánh, ngày).
+        backend: 'firestore' (mặc định) hoặc 'parquet' để đọc từ kho phân tích cục bộ.
+        """
+        try:
+            bundle = self.get_report_bundle(start_date, end_date, branch_ids, backend)
+            pnl = bundle['pnl']
             return {
                 "success": True,
+                "as_of": bundle.get('as_of'),
                 "data": {
                     "start_date": start_date.strftime('%Y-%m-%d'),
                     "end_date": end_date.strftime('%Y-%m-%d'),
                     "branch_ids": branch_ids,
-                    "order_count": order_count,
-                    "total_revenue": total_revenue,
-                    "total_cogs": total_cogs,
-                    "gross_profit": gross_profit,
-                    "operating_expenses_by_group": op_expenses_by_group,
-                    "total_operating_expenses": total_operating_expenses,
-                    "net_profit": net_profit
+                    **pnl
                 }
             }
         except Exception as e:
             logging.error(f"Lỗi khi tạo báo cáo P&L: {e}")
             return {"success": False, "message": f"Đã xảy ra lỗi: {e}"}
 
-    def get_profit_analysis_report(self, start_date: datetime, end_date: datetime, branch_ids: list):
+    def get_profit_analysis_report(self, start_date: datetime, end_date: datetime, branch_ids: list, backend: str = None):
         try:
-            products_snapshot = self.products_collection.stream()
-            product_details = {p.id: p.to_dict() for p in products_snapshot}
-            categories_snapshot = self.categories_collection.stream()
-            category_details = {c.id: c.to_dict().get('category_name', 'N/A') for c in categories_snapshot}
-
-            query = self.transactions_collection.where('type', '==', 'SALE') \
-                                               .where('created_at', '>=', start_date) \
-                                               .where('created_at', '<=', end_date)
-            if branch_ids:
-                query = query.where('branch_id', 'in', branch_ids)
-            transactions = query.stream()
-
-            product_profit_data = {}
-            for trans in transactions:
-                trans_data = trans.to_dict()
-                for item in trans_data.get('items', []):
-                    sku = item.get('sku')
-                    if not sku: continue
-                    quantity = item.get('quantity', 0)
-                    revenue = item.get('final_price', 0) * quantity
-                    cogs = item.get('line_cogs', 0)
-                    profit = revenue - cogs
-                    if sku not in product_profit_data:
-                        product_profit_data[sku] = {
-                            'product_name': item.get('name', 'N/A'),
-                            'category_id': product_details.get(sku, {}).get('category_id'),
-                            'total_quantity_sold': 0, 'total_revenue': 0, 'total_profit': 0
-                        }
-                    product_profit_data[sku]['total_quantity_sold'] += quantity
-                    product_profit_data[sku]['total_revenue'] += revenue
-                    product_profit_data[sku]['total_profit'] += profit
-
-            if not product_profit_data:
+            bundle = self.get_report_bundle(start_date, end_date, branch_ids, backend)
+            report_data = bundle['profit_analysis']
+            if report_data is None:
                 return {"success": True, "data": None, "message": "Không có dữ liệu bán hàng trong kỳ."}
-
-            profit_df = pd.DataFrame.from_dict(product_profit_data, orient='index').reset_index().rename(columns={'index': 'product_id'})
-            profit_df['category_name'] = profit_df['category_id'].map(category_details).fillna('Không có danh mục')
-            profit_df['profit_margin'] = profit_df.apply(
-                lambda row: (row['total_profit'] / row['total_revenue']) * 100 if row['total_revenue'] > 0 else 0, axis=1)
-
-            category_profit_df = profit_df.groupby('category_name').agg(
-                total_revenue=('total_revenue', 'sum'),
-                total_profit=('total_profit', 'sum')
-            ).reset_index()
-            category_profit_df['profit_margin'] = category_profit_df.apply(
-                lambda row: (row['total_profit'] / row['total_revenue']) * 100 if row['total_revenue'] > 0 else 0, axis=1)
-
-            profit_df = profit_df.sort_values(by='total_profit', ascending=False)
-            category_profit_df = category_profit_df.sort_values(by='total_profit', ascending=False)
-            return {"success": True, "data": {'product_profit_df': profit_df, 'category_profit_df': category_profit_df}}
+            return {"success": True, "data": report_data, "as_of": bundle.get('as_of')}
         except Exception as e:
             logging.error(f"Lỗi khi tạo báo cáo phân tích lợi nhuận: {e}")
             return {"success": False, "message": str(e)}
 
     def get_inventory_report(self, branch_ids: list):
         try:
-            products_snapshot = self.products_collection.stream()
+            products_snapshot = project(self.products_collection, 'products.name').stream()
             product_details = {p.id: p.to_dict() for p in products_snapshot}
 
-            inventory_query = self.inventory_collection
-            if branch_ids:
-                inventory_query = inventory_query.where('branch_id', 'in', branch_ids)
-            inventory_docs = list(inventory_query.stream())
+            def build_inventory_query(branch_chunk, *_):
+                inventory_query = self.inventory_collection
+                if branch_chunk:
+                    inventory_query = inventory_query.where('branch_id', 'in', branch_chunk)
+                return project(inventory_query, 'inventory.valuation')
+            inventory_docs = self.executor.run(build_inventory_query, branch_ids, mapper=lambda doc: doc.to_dict())
 
             if not inventory_docs:
                 return {"success": True, "data": None, "message": "Không có dữ liệu tồn kho."}
 
             inventory_list = []
-            for item_doc in inventory_docs:
-                item_data = item_doc.to_dict()
+            for item_data in inventory_docs:
                 sku = item_data.get('sku')
                 product_info = product_details.get(sku, {})
                 inventory_list.append({
@@ -193,65 +292,19 @@ class ReportManager:
             logging.error(f"Lỗi khi tạo báo cáo tồn kho: {e}")
             return { "success": False, "message": str(e) }
 
-    def get_revenue_report(self, start_date: datetime, end_date: datetime, branch_ids: list):
+    def get_revenue_report(self, start_date: datetime, end_date: datetime, branch_ids: list, backend: str = None):
         try:
-            query = self.transactions_collection.where('type', '==', 'SALE') \
-                                       .where('created_at', '>=', start_date) \
-                                       .where('created_at', '<=', end_date)
-            if branch_ids:
-                query = query.where('branch_id', 'in', branch_ids)
-            transactions = list(query.stream())
-
-            if not transactions:
+            bundle = self.get_report_bundle(start_date, end_date, branch_ids, backend)
+            report_data = bundle['revenue']
+            if report_data is None:
                 return {"success": True, "data": None, "message": "Không có giao dịch trong kỳ."}
 
-            revenue_data = [t.to_dict() for t in transactions]
-            revenue_df = pd.DataFrame(revenue_data)
-            
-            # Convert created_at to datetime objects if they are not already
-            if not pd.api.types.is_datetime64_any_dtype(revenue_df['created_at']):
-                 revenue_df['created_at'] = pd.to_datetime(revenue_df['created_at'])
-
-            # KPIs
-            total_revenue = revenue_df['total_amount'].sum()
-            total_cogs = revenue_df['total_cogs'].sum()
-            total_profit = total_revenue - total_cogs
-            total_orders = len(revenue_df)
-            average_order_value = total_revenue / total_orders if total_orders > 0 else 0
-            
-            # Revenue by Day
-            revenue_df['date'] = revenue_df['created_at'].dt.date
-            revenue_by_day = revenue_df.groupby('date')['total_amount'].sum().reset_index()
-            revenue_by_day = revenue_by_day.rename(columns={'date':'Ngày', 'total_amount':'Doanh thu'}).set_index('Ngày')
-
-            # Top Products
-            items_series = revenue_df['items'].explode()
-            items_df = pd.DataFrame(items_series.tolist())
-            items_df['revenue'] = items_df['final_price'] * items_df['quantity']
-            items_df['profit'] = items_df['revenue'] - items_df['line_cogs']
-            
-            top_products = items_df.groupby(['sku', 'name']).agg(
-                Doanh_thu = ('revenue', 'sum'),
-                Lợi_nhuận = ('profit', 'sum'),
-                Số_lượng = ('quantity', 'sum')
-            ).sort_values(by='Doanh_thu', ascending=False).head(5).reset_index()
-
-            report_data = {
-                "total_revenue": total_revenue,
-                "total_profit": total_profit,
-                "total_orders": total_orders,
-                "average_order_value": average_order_value,
-                "revenue_by_day": revenue_by_day,
-                "top_products_by_revenue": top_products
-            }
-
-            return {"success": True, "data": report_data, "message": "Lấy báo cáo doanh thu thành công"}
+            return {"success": True, "data": report_data, "as_of": bundle.get('as_of'), "message": "Lấy báo cáo doanh thu thành công"}
         except Exception as e:
             logging.error(f"Lỗi khi lấy báo cáo doanh thu: {e}")
             return {"success": False, "message": str(e)}
 
-# Áp dụng decorator cho các phương thức sau khi class đã được định nghĩa
-ReportManager.get_profit_loss_statement = st.cache_data(ttl=900, hash_funcs={ReportManager: hash_report_manager})(ReportManager.get_profit_loss_statement)
+# Áp dụng decorator cho các phương thức sau khi class đã được định nghĩa.
+# Các báo cáo theo khoảng ngày không dùng st.cache_data: dữ liệu tổng hợp đã được đệm theo từng (chi nhánh, ngày)
+# trong DailyAggregateCache, nên dời ngày kết thúc chỉ tốn số lần đọc của những ngày mới.
 ReportManager.get_inventory_report = st.cache_data(ttl=300, hash_funcs={ReportManager: hash_report_manager})(ReportManager.get_inventory_report)
-ReportManager.get_profit_analysis_report = st.cache_data(ttl=900, hash_funcs={ReportManager: hash_report_manager})(ReportManager.get_profit_analysis_report)
-ReportManager.get_revenue_report = st.cache_data(ttl=900, hash_funcs={ReportManager: hash_report_manager})(ReportManager.get_revenue_report)
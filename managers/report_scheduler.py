@@ -0,0 +1,242 @@
+import os
+import pickle
+import logging
+import threading
+from datetime import datetime, date, timedelta
+import streamlit as st
+
+from .branch_manager import BranchManager
+from .cost_manager import CostManager
+from .report_cache import DailyAggregateCache, get_daily_aggregate_cache
+from .report_manager import ReportManager
+from .rollup_manager import RollupManager
+
+DEFAULT_PRECOMPUTE_DIR = os.path.join("data", "precomputed_reports")
+DEFAULT_RUN_TIMES = ["00:15", "06:00", "12:00", "18:00"]
+CONSOLIDATED_SCOPE = "all"
+# Chỉ tính sẵn phần đã khép lại của mỗi kỳ: hôm nay thay đổi sau mỗi đơn hàng. Kỳ "từ đầu tháng" được tính sẵn
+# đến hôm qua; phần của hôm nay được đọc trực tiếp và ghép vào khi xem báo cáo (ReportManager.get_report_bundle).
+PRECOMPUTED_PERIODS = ('yesterday', 'month_to_date', 'last_month')
+
+def standard_periods(today: date = None) -> dict:
+    """Các kỳ báo cáo chuẩn được tính sẵn: hôm qua, từ đầu tháng đến nay, tháng trước."""
+    today = today or date.today()
+    first_of_month = today.replace(day=1)
+    last_month_end = first_of_month - timedelta(days=1)
+    return {
+        'yesterday': (today - timedelta(days=1), today - timedelta(days=1)),
+        'month_to_date': (first_of_month, today),
+        'last_month': (last_month_end.replace(day=1), last_month_end),
+    }
+
+def closed_range(start_day: date, end_day: date, today: date):
+    """Phần đã khép lại (đến hết hôm qua) của khoảng ngày, hoặc None nếu khoảng không có ngày nào trước hôm nay."""
+    closed_end = min(end_day, today - timedelta(days=1))
+    return (start_day, closed_end) if start_day <= closed_end else None
+
+PERIOD_LABELS = {'yesterday': "Hôm qua", 'month_to_date': "Tháng này (đến hôm nay)", 'last_month': "Tháng trước"}
+
+def _scope_key(branch_ids: list) -> str:
+    return CONSOLIDATED_SCOPE if not branch_ids else "+".join(sorted(branch_ids))
+
+class PrecomputedReportStore:
+    """Lưu các gói báo cáo đã tính sẵn ra đĩa, mỗi (khoảng ngày, phạm vi chi nhánh) một tệp pickle."""
+    def __init__(self, root_dir: str = DEFAULT_PRECOMPUTE_DIR):
+        self.root_dir = root_dir
+
+    def _path(self, start_day: date, end_day: date, scope: str) -> str:
+        return os.path.join(self.root_dir, f"{start_day.isoformat()}_{end_day.isoformat()}__{scope}.pkl")
+
+    def save(self, start_day: date, end_day: date, scope: str, payload: dict):
+        os.makedirs(self.root_dir, exist_ok=True)
+        path = self._path(start_day, end_day, scope)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)  # ghi nguyên tử: trang báo cáo không bao giờ đọc phải tệp dở dang
+
+    def load(self, start_day: date, end_day: date, scope: str):
+        path = self._path(start_day, end_day, scope)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except Exception as e:
+            logging.warning(f"Không đọc được báo cáo tính sẵn {path}: {e}")
+            return None
+
+    def prune(self, keep_paths: set):
+        if not os.path.isdir(self.root_dir):
+            return
+        for file_name in os.listdir(self.root_dir):
+            path = os.path.join(self.root_dir, file_name)
+            if file_name.endswith('.pkl') and path not in keep_paths:
+                os.remove(path)
+
+class ReportScheduler:
+    """
+    Tính sẵn các báo cáo của kỳ đã khép lại (hôm qua, từ đầu tháng đến hôm qua, tháng trước) cho từng chi nhánh
+    và toàn hệ thống trong một luồng nền, theo các mốc giờ trong ngày (giống cron). Trang báo cáo lấy kết quả tức thì
+    kèm thời điểm tính ("as of"); kỳ từ đầu tháng đến nay ghép gói tính sẵn với phần hôm nay đọc trực tiếp,
+    các khoảng ngày tuỳ chỉnh khác được tính trực tiếp.
+    Gói tính sẵn bị bỏ qua (và được tính lại ở nền) khi DailyAggregateCache ghi nhận thay đổi trong kỳ sau
+    thời điểm tính: huỷ đơn, chi phí ghi lùi ngày, dựng lại dữ liệu tổng hợp.
+    """
+    def __init__(self, report_mgr, branch_mgr: BranchManager, store: PrecomputedReportStore, run_times: list = None,
+                 aggregate_cache: DailyAggregateCache = None):
+        self.report_mgr = report_mgr
+        self.branch_mgr = branch_mgr
+        self.store = store
+        self.aggregate_cache = aggregate_cache
+        self.run_times = sorted(run_times or DEFAULT_RUN_TIMES)
+        self.last_run_at = None
+        self.last_error = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._run_lock = threading.Lock()
+        self._thread = None
+
+    def _scopes(self) -> list:
+        return [None] + [[b['id']] for b in self.branch_mgr.list_branches(active_only=True)]
+
+    def run_once(self):
+        """Tính lại các kỳ đã khép lại cho mọi phạm vi. Trả về số gói báo cáo đã lưu."""
+        with self._run_lock:
+            as_of = datetime.now()
+            self.last_error = None
+            keep_paths, saved = set(), 0
+            periods = standard_periods(as_of.date())
+            # Danh mục sản phẩm đọc một lần cho cả lượt chạy, không phải một lần cho mỗi kỳ × phạm vi.
+            category_maps = self.report_mgr.load_category_maps()
+            for period in PRECOMPUTED_PERIODS:
+                closed = closed_range(*periods[period], as_of.date())
+                if closed is None:
+                    continue  # ngày đầu tháng: kỳ từ đầu tháng chỉ gồm hôm nay
+                start_day, end_day = closed
+                start_datetime = datetime.combine(start_day, datetime.min.time())
+                end_datetime = datetime.combine(end_day, datetime.max.time())
+                for branch_ids in self._scopes():
+                    scope = _scope_key(branch_ids)
+                    path = self.store._path(start_day, end_day, scope)
+                    if path in keep_paths:
+                        continue  # ngày 2 trong tháng: từ đầu tháng đến hôm qua trùng với hôm qua
+                    try:
+                        # Lưu kèm dữ liệu đầu vào để ghép thêm phần hôm nay khi xem kỳ từ đầu tháng đến nay.
+                        inputs = self.report_mgr.load_report_inputs(start_datetime, end_datetime, branch_ids, backend='firestore')
+                        bundle = self.report_mgr.build_report_bundle(inputs, category_maps=category_maps)
+                        self.store.save(start_day, end_day, scope, {**bundle, 'inputs': inputs, 'period': period,
+                                                                   'start_day': start_day, 'end_day': end_day, 'as_of': as_of})
+                        keep_paths.add(path)
+                        saved += 1
+                    except Exception as e:
+                        self.last_error = f"{period}/{scope}: {e}"
+                        logging.error(f"Lỗi khi tính sẵn báo cáo {period} cho {scope}: {e}")
+            self.store.prune(keep_paths)
+            self.report_mgr.clear_report_bundles()
+            self.last_run_at = as_of
+            logging.info(f"Đã tính sẵn {saved} gói báo cáo lúc {as_of:%H:%M:%S}.")
+            return saved
+
+    def lookup(self, start_date, end_date, branch_ids: list = None):
+        """Gói báo cáo tính sẵn cho đúng khoảng ngày và phạm vi chi nhánh, hoặc None nếu chưa có hoặc đã cũ."""
+        start_day = start_date.date() if isinstance(start_date, datetime) else start_date
+        end_day = end_date.date() if isinstance(end_date, datetime) else end_date
+        if end_day >= date.today():
+            return None  # kỳ còn mở: gói cũ (nếu có) không chứa các đơn mới
+        payload = self.store.load(start_day, end_day, _scope_key(branch_ids))
+        if payload is None and branch_ids and len(branch_ids) > 1:
+            # Chọn đủ mọi chi nhánh đang hoạt động tương đương với báo cáo toàn hệ thống.
+            active_ids = {b['id'] for b in self.branch_mgr.list_branches(active_only=True)}
+            if set(branch_ids) == active_ids:
+                payload = self.store.load(start_day, end_day, CONSOLIDATED_SCOPE)
+        if payload is not None and self.aggregate_cache and self.aggregate_cache.changed_since(
+                start_day.isoformat(), end_day.isoformat(), branch_ids, payload['as_of'].timestamp()):
+            self.trigger()
+            return None
+        return payload
+
+    def lookup_closed_part(self, start_date, end_date, branch_ids: list = None):
+        """
+        Với khoảng ngày kết thúc hôm nay (từ đầu tháng đến nay): gói tính sẵn của phần đã khép lại
+        (từ ngày bắt đầu đến hôm qua), hoặc None. Phần của hôm nay do ReportManager đọc trực tiếp rồi ghép vào.
+        """
+        start_day = start_date.date() if isinstance(start_date, datetime) else start_date
+        end_day = end_date.date() if isinstance(end_date, datetime) else end_date
+        today = date.today()
+        if end_day != today or start_day >= today:
+            return None
+        return self.lookup(start_day, today - timedelta(days=1), branch_ids)
+
+    def _seconds_until_next_run(self, now: datetime) -> float:
+        for run_time in self.run_times:
+            hour, minute = map(int, run_time.split(':'))
+            candidate = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            if candidate > now:
+                return (candidate - now).total_seconds()
+        hour, minute = map(int, self.run_times[0].split(':'))
+        tomorrow = (now + timedelta(days=1)).replace(hour=hour, minute=minute, second=0, microsecond=0)
+        return (tomorrow - now).total_seconds()
+
+    def _loop(self):
+        # Lần chạy đầu ngay khi khởi động để trang báo cáo có dữ liệu sớm.
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                self.last_error = str(e)
+                logging.error(f"Lỗi trong luồng tính sẵn báo cáo: {e}")
+            self._wake.wait(timeout=self._seconds_until_next_run(datetime.now()))
+            self._wake.clear()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._loop, name="report-precompute", daemon=True)
+        self._thread.start()
+
+    def trigger(self):
+        """Yêu cầu luồng nền tính lại ngay (ví dụ: sau khi dựng lại dữ liệu tổng hợp)."""
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def status(self) -> dict:
+        return {
+            'running': bool(self._thread and self._thread.is_alive()),
+            'last_run_at': self.last_run_at,
+            'last_error': self.last_error,
+            'run_times': self.run_times,
+        }
+
+@st.cache_resource
+def get_report_scheduler(_firebase_client):
+    """Một luồng tính sẵn duy nhất cho toàn tiến trình Streamlit; tắt bằng secrets `report_precompute_enabled = false`."""
+    if not st.secrets.get("report_precompute_enabled", True):
+        return None
+    report_mgr = ReportManager(_firebase_client, CostManager(_firebase_client), backend='firestore')
+    scheduler = ReportScheduler(
+        report_mgr, BranchManager(_firebase_client),
+        PrecomputedReportStore(st.secrets.get("report_precompute_dir", DEFAULT_PRECOMPUTE_DIR)),
+        run_times=list(st.secrets.get("report_precompute_times", DEFAULT_RUN_TIMES)),
+        aggregate_cache=get_daily_aggregate_cache(),
+    )
+    scheduler.start()
+    return scheduler
+
+@st.cache_resource
+def start_rollup_backfill(_firebase_client):
+    """Chạy (một lần cho mỗi tiến trình) việc khởi tạo tổng hợp cho dữ liệu cũ trong luồng nền, xem RollupManager.backfill_rollups."""
+    def _backfill():
+        try:
+            result = RollupManager(_firebase_client).backfill_rollups()
+            if result['rebuilt_through']:
+                # Bỏ các tổng hợp rỗng đã đệm; gói báo cáo tính sẵn của các kỳ liên quan được tính lại.
+                get_daily_aggregate_cache().invalidate()
+        except Exception as e:
+            logging.error(f"Lỗi khi khởi tạo tổng hợp cho dữ liệu cũ: {e}")
+
+    thread = threading.Thread(target=_backfill, name="rollup-backfill", daemon=True)
+    thread.start()
@@ -0,0 +1,225 @@
+import logging
+from datetime import datetime, date, timedelta
+from google.cloud import firestore
+
+from .projections import project, references_only
+from .query_executor import get_query_executor
+
+DAILY_ROLLUPS_COLLECTION = 'daily_sales_rollups'
+SKU_ROLLUPS_COLLECTION = 'daily_sku_rollups'
+UNGROUPED_KEY = '_none'
+# Tài liệu đánh dấu tiến độ khởi tạo tổng hợp cho dữ liệu cũ (collection `settings`).
+BACKFILL_MARKER_DOC = 'rollup_backfill'
+
+def rollup_day_key(value) -> str:
+    """Chuẩn hoá created_at (datetime, date hoặc chuỗi ISO) thành khoá ngày 'YYYY-MM-DD'."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if isinstance(value, (datetime, date)):
+        return value.strftime('%Y-%m-%d')
+    raise ValueError(f"Không thể xác định ngày từ giá trị: {value!r}")
+
+class RollupManager:
+    """
+    Duy trì các tài liệu tổng hợp theo (chi nhánh, ngày) và (chi nhánh, ngày, SKU).
+    Các bộ đếm được cộng dồn bằng `firestore.Increment` bên trong cùng transaction/batch
+    ghi giao dịch gốc, nhờ đó báo cáo chỉ cần đọc số ngày × số chi nhánh tài liệu.
+    """
+    def __init__(self, firebase_client):
+        self.db = firebase_client.db
+        self.daily_col = self.db.collection(DAILY_ROLLUPS_COLLECTION)
+        self.sku_col = self.db.collection(SKU_ROLLUPS_COLLECTION)
+        self.transactions_col = self.db.collection('transactions')
+        self.executor = get_query_executor()
+
+    def _daily_ref(self, branch_id: str, day: str):
+        return self.daily_col.document(f"{branch_id}_{day}")
+
+    def _sku_ref(self, branch_id: str, day: str, sku: str):
+        return self.sku_col.document(f"{branch_id}_{day}_{sku}")
+
+    def _aggregate_sale_lines(self, items: list) -> dict:
+        """Gộp các dòng hàng của một đơn theo SKU (một SKU có thể xuất hiện nhiều lần)."""
+        lines = {}
+        for item in items:
+            sku = item.get('sku')
+            if not sku: continue
+            quantity = item.get('quantity', 0)
+            line = lines.setdefault(sku, {'name': item.get('name', 'N/A'), 'quantity_sold': 0, 'revenue': 0.0, 'cogs': 0.0})
+            line['quantity_sold'] += quantity
+            line['revenue'] += item.get('final_price', 0) * quantity
+            line['cogs'] += item.get('line_cogs', 0)
+        return lines
+
+    def apply_transaction(self, writer, trans_data: dict, sign: int = 1):
+        """
+        Ghi các bộ đếm tổng hợp cho một giao dịch vào `writer` (Firestore transaction hoặc batch).
+        Dùng sign=-1 để đảo ngược khi giao dịch bị xoá.
+        """
+        branch_id = trans_data.get('branch_id')
+        created_at = trans_data.get('created_at')
+        if not branch_id or not created_at:
+            logging.warning(f"Bỏ qua tổng hợp cho giao dịch {trans_data.get('id')}: thiếu branch_id hoặc created_at.")
+            return
+
+        day = rollup_day_key(created_at)
+        base_fields = {'branch_id': branch_id, 'date': day, 'updated_at': firestore.SERVER_TIMESTAMP}
+        trans_type = trans_data.get('type')
+
+        if trans_type == 'SALE':
+            writer.set(self._daily_ref(branch_id, day), {
+                **base_fields,
+                'order_count': firestore.Increment(sign),
+                'total_revenue': firestore.Increment(sign * trans_data.get('total_amount', 0)),
+                'total_cogs': firestore.Increment(sign * trans_data.get('total_cogs', 0)),
+            }, merge=True)
+
+            for sku, line in self._aggregate_sale_lines(trans_data.get('items', [])).items():
+                writer.set(self._sku_ref(branch_id, day, sku), {
+                    **base_fields,
+                    'sku': sku,
+                    'name': line['name'],
+                    'quantity_sold': firestore.Increment(sign * line['quantity_sold']),
+                    'revenue': firestore.Increment(sign * line['revenue']),
+                    'cogs': firestore.Increment(sign * line['cogs']),
+                }, merge=True)
+
+        elif trans_type == 'EXPENSE':
+            amount = abs(trans_data.get('total_amount', 0))
+            expense_details = trans_data.get('expense_details') or {}
+            group_key = expense_details.get('group_id') or UNGROUPED_KEY
+            class_key = expense_details.get('classification') or UNGROUPED_KEY
+            writer.set(self._daily_ref(branch_id, day), {
+                **base_fields,
+                'expense_count': firestore.Increment(sign),
+                'total_operating_expenses': firestore.Increment(sign * amount),
+                'expenses_by_group': {group_key: firestore.Increment(sign * amount)},
+                'expenses_by_classification': {class_key: firestore.Increment(sign * amount)},
+            }, merge=True)
+
+    def _range_query(self, collection, start_day: str, end_day: str, branch_ids: list = None):
+        query = collection.where('date', '>=', start_day).where('date', '<=', end_day)
+        if branch_ids:
+            query = query.where('branch_id', 'in', branch_ids)
+        return query
+
+    def _fan_out(self, collection, projection: str, start_date, end_date, branch_ids: list = None) -> list:
+        """Đọc song song theo nhóm chi nhánh và lát ngày, tránh giới hạn của toán tử 'in' khi chọn nhiều chi nhánh."""
+        def build_query(branch_chunk, slice_start, slice_end):
+            query = self._range_query(collection, slice_start.isoformat(), slice_end.isoformat(), branch_chunk)
+            return project(query, projection)
+        start_day = date.fromisoformat(rollup_day_key(start_date))
+        end_day = date.fromisoformat(rollup_day_key(end_date))
+        return self.executor.run(build_query, branch_ids, start_day, end_day, mapper=lambda doc: doc.to_dict())
+
+    def get_daily_rollups(self, start_date, end_date, branch_ids: list = None) -> list:
+        """Lấy các tài liệu tổng hợp (chi nhánh, ngày) trong khoảng ngày."""
+        return self._fan_out(self.daily_col, 'daily_sales_rollups.report', start_date, end_date, branch_ids)
+
+    def get_sku_rollups(self, start_date, end_date, branch_ids: list = None) -> list:
+        """Lấy các tài liệu tổng hợp (chi nhánh, ngày, SKU) trong khoảng ngày."""
+        return self._fan_out(self.sku_col, 'daily_sku_rollups.report', start_date, end_date, branch_ids)
+
+    def rebuild_rollups(self, start_date: datetime, end_date: datetime, batch_size: int = 400):
+        """
+        Tính lại toàn bộ tài liệu tổng hợp trong khoảng thời gian từ collection 'transactions'.
+        Dùng để khởi tạo dữ liệu cho các giao dịch cũ hoặc sửa sai lệch; ghi đè giá trị tuyệt đối.
+        """
+        start_day, end_day = rollup_day_key(start_date), rollup_day_key(end_date)
+        daily_docs, sku_docs = {}, {}
+
+        def build_query(_, slice_start, slice_end):
+            query = self.transactions_col.where('created_at', '>=', slice_start).where('created_at', '<=', slice_end)
+            return project(query, 'transactions.rollup_source')
+
+        for trans_data in self.executor.run(build_query, None, start_date, end_date, mapper=lambda doc: doc.to_dict()):
+            branch_id = trans_data.get('branch_id')
+            created_at = trans_data.get('created_at')
+            if not branch_id or not created_at: continue
+            day = rollup_day_key(created_at)
+            daily = daily_docs.setdefault((branch_id, day), {
+                'branch_id': branch_id, 'date': day, 'order_count': 0, 'total_revenue': 0.0, 'total_cogs': 0.0,
+                'expense_count': 0, 'total_operating_expenses': 0.0,
+                'expenses_by_group': {}, 'expenses_by_classification': {},
+            })
+            trans_type = trans_data.get('type')
+            if trans_type == 'SALE':
+                daily['order_count'] += 1
+                daily['total_revenue'] += trans_data.get('total_amount', 0)
+                daily['total_cogs'] += trans_data.get('total_cogs', 0)
+                for sku, line in self._aggregate_sale_lines(trans_data.get('items', [])).items():
+                    sku_doc = sku_docs.setdefault((branch_id, day, sku), {
+                        'branch_id': branch_id, 'date': day, 'sku': sku, 'name': line['name'],
+                        'quantity_sold': 0, 'revenue': 0.0, 'cogs': 0.0,
+                    })
+                    sku_doc['quantity_sold'] += line['quantity_sold']
+                    sku_doc['revenue'] += line['revenue']
+                    sku_doc['cogs'] += line['cogs']
+            elif trans_type == 'EXPENSE':
+                amount = abs(trans_data.get('total_amount', 0))
+                expense_details = trans_data.get('expense_details') or {}
+                group_key = expense_details.get('group_id') or UNGROUPED_KEY
+                class_key = expense_details.get('classification') or UNGROUPED_KEY
+                daily['expense_count'] += 1
+                daily['total_operating_expenses'] += amount
+                daily['expenses_by_group'][group_key] = daily['expenses_by_group'].get(group_key, 0) + amount
+                daily['expenses_by_classification'][class_key] = daily['expenses_by_classification'].get(class_key, 0) + amount
+
+        writes = [('delete', doc.reference, None) for col in (self.daily_col, self.sku_col)
+                  for doc in references_only(self._range_query(col, start_day, end_day)).stream()]
+        writes += [('set', self._daily_ref(b, d), data) for (b, d), data in daily_docs.items()]
+        writes += [('set', self._sku_ref(b, d, s), data) for (b, d, s), data in sku_docs.items()]
+
+        for i in range(0, len(writes), batch_size):
+            batch = self.db.batch()
+            for op, ref, data in writes[i:i + batch_size]:
+                if op == 'delete':
+                    batch.delete(ref)
+                else:
+                    batch.set(ref, {**data, 'updated_at': firestore.SERVER_TIMESTAMP})
+            batch.commit()
+
+        logging.info(f"Đã tính lại {len(daily_docs)} tổng hợp ngày và {len(sku_docs)} tổng hợp SKU ({start_day} → {end_day}).")
+        return {'daily': len(daily_docs), 'sku': len(sku_docs)}
+
+    def backfill_rollups(self, today: date = None, chunk_days: int = 31) -> dict:
+        """
+        Khởi tạo một lần tổng hợp cho các giao dịch có trước khi tổng hợp được ghi cùng giao dịch: báo cáo chỉ đọc
+        tổng hợp, nên thiếu bước này các ngày cũ hiển thị bằng 0 và lệch với các ô KPI (đọc thẳng `transactions`).
+        Lần chạy đầu ghi nhận `first_live_day` (hôm nay). Mọi ngày trước đó được tính lại ngay. Riêng ngày
+        `first_live_day` chỉ được tính lại khi đã khép lại (lần chạy sau), vì các đơn trước lúc triển khai trong ngày
+        đó chưa có tổng hợp. Tiến độ (`completed_through`) được lưu sau mỗi đoạn `chunk_days` ngày nên có thể chạy tiếp
+        khi bị ngắt. Trả về {'rebuilt_from', 'rebuilt_through'} (None nếu không còn gì phải làm).
+        """
+        today = today or date.today()
+        marker_ref = self.db.collection('settings').document(BACKFILL_MARKER_DOC)
+        marker = marker_ref.get()
+        state = (marker.to_dict() or {}) if marker.exists else {}
+        first_live_day = state.get('first_live_day')
+        if not first_live_day:
+            first_live_day = today.isoformat()
+            marker_ref.set({'first_live_day': first_live_day}, merge=True)
+        completed_through = state.get('completed_through')
+        if completed_through and completed_through >= first_live_day:
+            return {'rebuilt_from': None, 'rebuilt_through': None}
+
+        if completed_through:
+            chunk_start = date.fromisoformat(completed_through) + timedelta(days=1)
+        else:
+            earliest = list(project(self.transactions_col.order_by('created_at').limit(1), 'transactions.rollup_source').stream())
+            if not earliest:
+                marker_ref.set({'completed_through': first_live_day}, merge=True)
+                return {'rebuilt_from': None, 'rebuilt_through': None}
+            chunk_start = date.fromisoformat(rollup_day_key(earliest[0].to_dict()['created_at']))
+        target_end = min(date.fromisoformat(first_live_day), today - timedelta(days=1))
+
+        rebuilt_from = chunk_start
+        while chunk_start <= target_end:
+            chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), target_end)
+            self.rebuild_rollups(datetime.combine(chunk_start, datetime.min.time()), datetime.combine(chunk_end, datetime.max.time()))
+            marker_ref.set({'completed_through': chunk_end.isoformat()}, merge=True)
+            chunk_start = chunk_end + timedelta(days=1)
+        if rebuilt_from > target_end:
+            return {'rebuilt_from': None, 'rebuilt_through': None}
+        logging.info(f"Đã khởi tạo tổng hợp cho dữ liệu cũ: {rebuilt_from} → {target_end}.")
+        return {'rebuilt_from': rebuilt_from.isoformat(), 'rebuilt_through': target_end.isoformat()}
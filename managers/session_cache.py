@@ -0,0 +1,55 @@
+import time
+import threading
+import streamlit as st
+
+DEFAULT_SESSION_CACHE_TTL = 120  # giây
+DEFAULT_LAST_SEEN_INTERVAL_MINUTES = 15
+
+class TTLCache:
+    """Bộ đệm khoá → giá trị trong tiến trình, mỗi mục hết hạn sau `ttl` giây."""
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if time.monotonic() >= expires:
+                del self._items[key]
+                return None
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        with self._lock:
+            for key in [k for k, (_, value) in self._items.items() if predicate(value)]:
+                del self._items[key]
+
+class SessionCache:
+    """
+    Các phiên đăng nhập đã xác thực (theo token hash) và hồ sơ người dùng (theo uid) trong thời gian ngắn,
+    để phiên Streamlit mới của người dùng quay lại không phải đọc Firestore. Thu hồi phiên hoặc sửa người dùng
+    trong tiến trình này có hiệu lực ngay; ở tiến trình khác chậm tối đa `ttl` giây.
+    """
+    def __init__(self, ttl: float = DEFAULT_SESSION_CACHE_TTL):
+        self.sessions = TTLCache(ttl)
+        self.users = TTLCache(ttl)
+
+    def invalidate_user(self, uid: str):
+        self.users.invalidate(uid)
+        self.sessions.invalidate_where(lambda session: session.get('user_id') == uid)
+
+@st.cache_resource
+def get_session_cache() -> SessionCache:
+    return SessionCache(ttl=float(st.secrets.get("session_cache_ttl_seconds", DEFAULT_SESSION_CACHE_TTL)))
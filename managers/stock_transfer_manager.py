@@ -3,6 +3,7 @@ import uuid
 from datetime import datetime
 from google.cloud import firestore
 from .inventory_manager import InventoryManager
+from .projections import project
 
 class StockTransferManager:
     """
@@ -99,14 +100,14 @@ class StockTransferManager:
         transfer_ref.update({"status": "CANCELLED", "cancellation_info": cancellation_info})
         return True
 
-    def get_outgoing_transfers(self, branch_id: str, status: list) -> list:
+    def get_outgoing_transfers(self, branch_id: str, status: list, full: bool = False) -> list:
         if not branch_id or not status: return []
         query = self.transfers_col.where('source_branch_id', '==', branch_id).where('status', 'in', status)
-        transfers = [doc.to_dict() for doc in query.stream()]
+        transfers = [doc.to_dict() for doc in project(query, 'stock_transfers.list', full=full).stream()]
         return sorted(transfers, key=lambda x: x['created_at'], reverse=True)
 
-    def get_incoming_transfers(self, branch_id: str, status: list) -> list:
+    def get_incoming_transfers(self, branch_id: str, status: list, full: bool = False) -> list:
         if not branch_id or not status: return []
         query = self.transfers_col.where('destination_branch_id', '==', branch_id).where('status', 'in', status)
-        transfers = [doc.to_dict() for doc in query.stream()]
+        transfers = [doc.to_dict() for doc in project(query, 'stock_transfers.list', full=full).stream()]
         return sorted(transfers, key=lambda x: x['created_at'], reverse=True)
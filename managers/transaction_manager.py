@@ -1,10 +1,29 @@
+import logging
 import streamlit as st
 from datetime import datetime, time
+from managers.query_executor import get_query_executor
+from managers.export_manager import ExportManager
+from managers.projections import project
+from managers.transaction_search import TransactionSearch
+
+HISTORY_PAGE_SIZE = 50
+
+def hash_transaction_manager(manager):
+    return "TransactionManager"
+
+def _normalize_created_at(txn_data: dict) -> dict:
+    # Convert Firestore Timestamp to Python datetime object if it's not already
+    if 'created_at' in txn_data and hasattr(txn_data['created_at'], 'to_pydatetime'):
+        txn_data['created_at'] = txn_data['created_at'].to_pydatetime()
+    return txn_data
 
 class TransactionManager:
     def __init__(self, firebase_client):
         # FIX: Directly get the db instance from the firebase_client
         self.db = firebase_client.db
+        self.executor = get_query_executor()
+        self.exporter = ExportManager(firebase_client)
+        self.searcher = TransactionSearch(firebase_client)
 
     def query_transactions(self, start_date, end_date, branch_id=None):
         """
@@ -25,37 +44,63 @@ class TransactionManager:
         start_datetime = datetime.combine(start_date, time.min)
         end_datetime = datetime.combine(end_date, time.max)
 
-        # Start with the base query on the collection
-        query = db.collection('transactions')
+        def build_query(_, slice_start, slice_end):
+            # Start with the base query on the collection
+            query = db.collection('transactions')
 
-        # Apply filters
-        query = query.where('created_at', '>=', start_datetime)
-        query = query.where('created_at', '<=', end_datetime)
+            # Apply filters
+            query = query.where('created_at', '>=', slice_start)
+            query = query.where('created_at', '<=', slice_end)
 
-        if branch_id:
-            query = query.where('branch_id', '==', branch_id)
-            
-        # Order by creation time for chronological display
-        query = query.order_by('created_at', direction='DESCENDING')
+            if branch_id:
+                query = query.where('branch_id', '==', branch_id)
+
+            # Order by creation time for chronological display
+            return query.order_by('created_at', direction='DESCENDING')
 
         try:
-            docs = query.stream()
+            # Long ranges are split into time slices read in parallel, newest slice first
+            docs = self.executor.run(build_query, None, start_datetime, end_datetime, descending=True)
             transactions = []
-            for doc in docs:
-                txn_data = doc.to_dict()
-                txn_data['id'] = doc.id
-                
-                # Convert Firestore Timestamp to Python datetime object if it's not already
-                if 'created_at' in txn_data and hasattr(txn_data['created_at'], 'to_pydatetime'):
-                    txn_data['created_at'] = txn_data['created_at'].to_pydatetime()
-                
-                transactions.append(txn_data)
+            for txn_data in docs:
+                transactions.append(_normalize_created_at(txn_data))
             return transactions
         except Exception as e:
-            # DEBUG: Provide a more informative error message
+            logging.error(f"Error querying transactions from Firestore: {e}", exc_info=True)
             st.error(f"Error querying Firestore: {e}")
-            # Log the full traceback to the console for debugging
-            print(f"[DEBUG] Firestore Query Error: {e}")
-            import traceback
-            traceback.print_exc()
             return []
+
+    def get_transaction_page(self, start_date, end_date, branch_id=None, page_size: int = HISTORY_PAGE_SIZE, cursor=None):
+        """
+        Một trang lịch sử giao dịch (mới nhất trước) chỉ gồm các trường tóm tắt, không kèm mảng `items`.
+        cursor: tài liệu cuối của trang trước (giá trị `next_cursor` lần gọi trước), None cho trang đầu.
+        Trả về {"transactions": [...], "next_cursor": DocumentSnapshot hoặc None nếu đã hết}.
+        """
+        query = self.db.collection('transactions') \
+            .where('created_at', '>=', datetime.combine(start_date, time.min)) \
+            .where('created_at', '<=', datetime.combine(end_date, time.max))
+        if branch_id:
+            query = query.where('branch_id', '==', branch_id)
+        query = project(query.order_by('created_at', direction='DESCENDING'), 'transactions.summary')
+        if cursor is not None:
+            query = query.start_after(cursor)
+
+        # Lấy dư một tài liệu để biết còn trang sau hay không.
+        docs = list(query.limit(page_size + 1).stream())
+        has_more = len(docs) > page_size
+        docs = docs[:page_size]
+        return {
+            "transactions": [_normalize_created_at({**doc.to_dict(), 'id': doc.id}) for doc in docs],
+            "next_cursor": docs[-1] if has_more else None,
+        }
+
+    def get_transaction_details(self, transaction_id: str):
+        """Tài liệu giao dịch đầy đủ (kèm các dòng hàng), chỉ tải khi người dùng mở xem chi tiết."""
+        try:
+            doc = self.db.collection('transactions').document(transaction_id).get()
+            return _normalize_created_at({**doc.to_dict(), 'id': doc.id}) if doc.exists else None
+        except Exception as e:
+            logging.error(f"Error fetching transaction {transaction_id}: {e}")
+            return None
+
+TransactionManager.get_transaction_details = st.cache_data(ttl=600, hash_funcs={TransactionManager: hash_transaction_manager})(TransactionManager.get_transaction_details)
@@ -0,0 +1,108 @@
+import re
+import logging
+from datetime import datetime, time
+
+from .projections import project
+
+SEARCH_PAGE_SIZE = 25
+# Mã đơn đầy đủ có dạng {branch_id}-{yymmdd}-{6 ký tự hex}, ví dụ BR-1A2B3C-260115-9F00AB.
+FULL_ORDER_ID_PATTERN = re.compile(r"^.+-\d{6}-[0-9A-Fa-f]{6}$")
+PREFIX_UPPER_BOUND = "\uf8ff"  # ký tự Unicode rất lớn: mọi chuỗi bắt đầu bằng tiền tố đều nhỏ hơn tiền tố + ký tự này
+
+# Tiền tố mã đơn là truy vấn khoảng trên `id` nên không kết hợp được với các tiêu chí này (ngoài `type`, `branch_id`).
+PREFIX_EXCLUSIVE_CRITERIA = ('customer_id', 'cashier_id', 'start_date', 'end_date', 'min_amount', 'max_amount')
+
+def prefix_conflict_message(criteria: dict):
+    """Thông báo lỗi khi tiền tố mã đơn được nhập cùng tiêu chí khác, hoặc None nếu tổ hợp tiêu chí hợp lệ."""
+    if not (criteria.get('order_id_prefix') or '').strip():
+        return None
+    if any(criteria.get(field) not in (None, '') for field in PREFIX_EXCLUSIVE_CRITERIA):
+        return "Tìm theo mã đơn không kết hợp được với khách hàng, thu ngân, khoảng ngày hay khoảng số tiền. Hãy bỏ bớt một trong hai."
+    return None
+
+class TransactionSearch:
+    """
+    Tìm giao dịch bằng truy vấn có chỉ mục, trả về theo trang (không quét toàn bộ collection).
+    Mỗi tổ hợp tiêu chí mà các form tìm kiếm cho phép đều có chỉ mục khai báo trong firestore.indexes.json:
+      - Mã đơn đầy đủ: đọc trực tiếp tài liệu (một lượt đọc).
+      - Tiền tố mã đơn: khoảng trên trường `id` (mã đơn bắt đầu bằng chi nhánh rồi ngày), sắp theo `id`;
+        chỉ kết hợp với `type` và `branch_id` (người dùng bị giới hạn chi nhánh), mọi tiêu chí khác bị từ chối.
+      - Bất kỳ tổ hợp nào của chi nhánh / khách hàng / thu ngân (so khớp chính xác) + khoảng ngày tuỳ chọn:
+        chỉ mục (type, các trường so khớp, created_at giảm dần).
+      - Như trên + khoảng số tiền: chỉ mục (type, các trường so khớp, total_amount giảm dần, created_at giảm dần).
+    """
+    def __init__(self, firebase_client):
+        self.db = firebase_client.db
+        self.transactions_col = self.db.collection('transactions')
+
+    @staticmethod
+    def _summary(doc) -> dict:
+        data = {**doc.to_dict(), 'id': doc.id}
+        if hasattr(data.get('created_at'), 'to_pydatetime'):
+            data['created_at'] = data['created_at'].to_pydatetime()
+        return data
+
+    def _build_query(self, criteria: dict):
+        query = self.transactions_col
+        if criteria.get('type'):
+            query = query.where('type', '==', criteria['type'])
+
+        prefix = (criteria.get('order_id_prefix') or '').strip()
+        if prefix:
+            # Tiền tố mã đơn đã bao gồm chi nhánh và ngày nên không kết hợp thêm điều kiện khoảng nào khác,
+            # nhưng điều kiện chi nhánh vẫn phải áp dụng để không trả về đơn của chi nhánh khác.
+            if criteria.get('branch_id'):
+                query = query.where('branch_id', '==', criteria['branch_id'])
+            return query.where('id', '>=', prefix).where('id', '<', prefix + PREFIX_UPPER_BOUND).order_by('id')
+
+        for field in ('branch_id', 'customer_id', 'cashier_id'):
+            if criteria.get(field):
+                query = query.where(field, '==', criteria[field])
+
+        if criteria.get('start_date'):
+            query = query.where('created_at', '>=', datetime.combine(criteria['start_date'], time.min))
+        if criteria.get('end_date'):
+            query = query.where('created_at', '<=', datetime.combine(criteria['end_date'], time.max))
+
+        has_amount_range = criteria.get('min_amount') is not None or criteria.get('max_amount') is not None
+        if criteria.get('min_amount') is not None:
+            query = query.where('total_amount', '>=', criteria['min_amount'])
+        if criteria.get('max_amount') is not None:
+            query = query.where('total_amount', '<=', criteria['max_amount'])
+
+        if has_amount_range:
+            query = query.order_by('total_amount', direction='DESCENDING')
+        return query.order_by('created_at', direction='DESCENDING')
+
+    def search(self, criteria: dict, page_size: int = SEARCH_PAGE_SIZE, cursor=None) -> dict:
+        """
+        criteria: order_id_prefix, type, branch_id, customer_id, cashier_id, start_date, end_date, min_amount, max_amount.
+        Trả về {"transactions": [...], "next_cursor": DocumentSnapshot hoặc None}; truyền lại next_cursor để lấy trang sau.
+        Ném ValueError khi tiền tố mã đơn được kết hợp với tiêu chí khác (xem `prefix_conflict_message`).
+        """
+        conflict = prefix_conflict_message(criteria)
+        if conflict:
+            raise ValueError(conflict)
+        prefix = (criteria.get('order_id_prefix') or '').strip()
+        if prefix and cursor is None and FULL_ORDER_ID_PATTERN.match(prefix):
+            doc = self.transactions_col.document(prefix).get()
+            if not doc.exists and prefix != prefix.upper():
+                doc = self.transactions_col.document(prefix.upper()).get()
+            if doc.exists and criteria.get('branch_id') and (doc.to_dict() or {}).get('branch_id') != criteria['branch_id']:
+                return {"transactions": [], "next_cursor": None}
+            if doc.exists and (not criteria.get('type') or doc.get('type') == criteria['type']):
+                return {"transactions": [self._summary(doc)], "next_cursor": None}
+
+        query = project(self._build_query(criteria), 'transactions.summary')
+        if cursor is not None:
+            query = query.start_after(cursor)
+        docs = list(query.limit(page_size + 1).stream())
+
+        if not docs and cursor is None and prefix and prefix != prefix.upper():
+            # Mã đơn được sinh bằng chữ hoa; thử lại khi người dùng gõ chữ thường.
+            return self.search({**criteria, 'order_id_prefix': prefix.upper()}, page_size)
+
+        has_more = len(docs) > page_size
+        docs = docs[:page_size]
+        logging.debug(f"Tìm giao dịch {criteria}: {len(docs)} kết quả, còn trang sau: {has_more}.")
+        return {"transactions": [self._summary(doc) for doc in docs], "next_cursor": docs[-1] if has_more else None}
@@ -0,0 +1,108 @@
+"""Firestore giả lập trong bộ nhớ cho các bài kiểm thử manager (where/order_by/limit/select, batch, Increment)."""
+import pytest
+from google.cloud import firestore
+
+
+def _resolve(current, value):
+    """Áp dụng giá trị ghi kiểu Firestore: Increment cộng dồn, dict lồng nhau được gộp (merge=True), còn lại ghi đè."""
+    if isinstance(value, firestore.Increment):
+        return (current or 0) + value.value
+    if isinstance(value, dict):
+        merged = dict(current or {})
+        for key, inner in value.items():
+            merged[key] = _resolve(merged.get(key), inner)
+        return merged
+    return value
+
+
+class _Snapshot:
+    def __init__(self, ref, data):
+        self.reference, self.id, self._data = ref, ref.id, data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class _Ref:
+    def __init__(self, db, collection, doc_id):
+        self.db, self.collection, self.id = db, collection, doc_id
+
+    def get(self):
+        return _Snapshot(self, self.db.data[self.collection].get(self.id))
+
+    def set(self, data, merge=False):
+        store = self.db.data[self.collection]
+        if merge:
+            store[self.id] = _resolve(store.get(self.id), data)
+        else:
+            store[self.id] = {k: v for k, v in data.items() if v is not firestore.SERVER_TIMESTAMP}
+
+    def delete(self):
+        self.db.data[self.collection].pop(self.id, None)
+
+
+class _Query:
+    def __init__(self, db, collection, filters=(), order=None, size=None):
+        self.db, self.collection, self.filters, self.order, self.size = db, collection, filters, order, size
+
+    def document(self, doc_id):
+        return _Ref(self.db, self.collection, doc_id)
+
+    def where(self, field, op, value):
+        return _Query(self.db, self.collection, self.filters + ((field, op, value),), self.order, self.size)
+
+    def order_by(self, field):
+        return _Query(self.db, self.collection, self.filters, field, self.size)
+
+    def limit(self, size):
+        return _Query(self.db, self.collection, self.filters, self.order, size)
+
+    def select(self, fields):
+        return self
+
+    def stream(self):
+        ops = {'>=': lambda a, b: a >= b, '<=': lambda a, b: a <= b, '==': lambda a, b: a == b, 'in': lambda a, b: a in b}
+        docs = [_Snapshot(_Ref(self.db, self.collection, doc_id), data)
+                for doc_id, data in self.db.data[self.collection].items()
+                if all(data.get(f) is not None and ops[op](data[f], v) for f, op, v in self.filters)]
+        if self.order:
+            docs.sort(key=lambda d: d.to_dict()[self.order])
+        return docs[:self.size] if self.size else docs
+
+
+class _Batch:
+    def __init__(self):
+        self.ops = []
+
+    def set(self, ref, data, merge=False):
+        self.ops.append(lambda: ref.set(data, merge=merge))
+
+    def delete(self, ref):
+        self.ops.append(ref.delete)
+
+    def commit(self):
+        for op in self.ops:
+            op()
+
+
+class _FakeDb:
+    def __init__(self):
+        self.data = {}
+
+    def collection(self, name):
+        self.data.setdefault(name, {})
+        return _Query(self, name)
+
+    def batch(self):
+        return _Batch()
+
+
+class FakeClient:
+    def __init__(self):
+        self.db = _FakeDb()
+
+
+@pytest.fixture
+def fake_client():
+    return FakeClient()
@@ -0,0 +1,149 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from managers.analytics_store import AnalyticsStore
+
+
+def _transactions(store, docs):
+    df, time_column = store._transaction_rows(docs)['transactions']
+    df[time_column] = pd.to_datetime(df[time_column])
+    return df, time_column
+
+
+def _sale(doc_id, day, branch_id='B1', **extra):
+    return {'id': doc_id, 'type': 'SALE', 'status': 'COMPLETED', 'branch_id': branch_id, 'cashier_id': 'u1',
+            'created_at': datetime(2026, 1, day, 10), 'total_amount': 100, 'total_cogs': 60, 'items': [], **extra}
+
+
+def test_null_only_column_part_is_readable_with_other_parts(tmp_path):
+    store = AnalyticsStore(root_dir=str(tmp_path))
+    # Chi nhánh B0 (được quét trước): không đơn nào có khách hàng / khuyến mãi -> cột toàn None.
+    store._write_partitioned('transactions', *_transactions(store, [_sale('T1', 1, 'B0'), _sale('T2', 2, 'B0')]))
+    # Chi nhánh B1: cột có giá trị chuỗi.
+    store._write_partitioned('transactions', *_transactions(store, [_sale('T3', 3, customer_id='C1', promotion_id='P1')]))
+
+    df = store.read('transactions', 'created_at', datetime(2026, 1, 1), datetime(2026, 1, 31),
+                    columns=['id', 'customer_id', 'promotion_id'], dedupe_keys=['id'])
+
+    assert sorted(df['id']) == ['T1', 'T2', 'T3']
+    assert df.set_index('id').loc['T3', 'customer_id'] == 'C1'
+    assert df.set_index('id')['customer_id'].isna().sum() == 2
+
+
+def test_daily_rollups_over_parts_with_null_columns(tmp_path):
+    store = AnalyticsStore(root_dir=str(tmp_path))
+    store._write_partitioned('transactions', *_transactions(store, [_sale('T1', 1, 'B0')]))
+    store._write_partitioned('transactions', *_transactions(store, [_sale('T2', 1, customer_id='C1')]))
+
+    rollups = store.daily_rollups(datetime(2026, 1, 1), datetime(2026, 1, 31, 23, 59))
+
+    assert sorted(r['branch_id'] for r in rollups) == ['B0', 'B1']
+    assert all(r['order_count'] == 1 and r['total_revenue'] == 100.0 for r in rollups)
+
+
+def _write_lines(store, docs):
+    df, time_column = store._transaction_rows(docs)['transaction_lines']
+    df[time_column] = pd.to_datetime(df[time_column])
+    store._write_partitioned('transaction_lines', df, time_column)
+
+
+def test_sku_lines_keeps_latest_export_of_each_order(tmp_path):
+    store = AnalyticsStore(root_dir=str(tmp_path))
+    item = {'sku': 'S1', 'name': 'Áo', 'quantity': 2, 'final_price': 50, 'line_cogs': 60}
+    _write_lines(store, [_sale('T1', 1, items=[item, {**item, 'sku': 'S2', 'name': 'Quần'}]),
+                         _sale('T2', 1, items=[{**item, 'quantity': 1}])])
+    # T1 được sao chép lại sau khi bị sửa (bỏ dòng S2): chỉ bản mới nhất được tính.
+    _write_lines(store, [_sale('T1', 1, items=[item])])
+
+    lines = store.sku_lines(datetime(2026, 1, 1), datetime(2026, 1, 31, 23, 59)).set_index('sku')
+
+    assert list(lines.index) == ['S1']
+    assert lines.loc['S1', 'quantity_sold'] == 3
+    assert lines.loc['S1', 'revenue'] == 150
+    assert lines.loc['S1', 'cogs'] == 120
+    assert lines.loc['S1', 'name'] == 'Áo'
+
+
+def test_sku_lines_empty_store(tmp_path):
+    assert AnalyticsStore(root_dir=str(tmp_path)).sku_lines(datetime(2026, 1, 1), datetime(2026, 1, 31)).empty
+
+
+class _FakeDoc:
+    def __init__(self, doc_id, data):
+        self.id, self._data = doc_id, data
+
+    def get(self, field):
+        return self.id if field == '__name__' else self._data.get(field)
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class _FakeQuery:
+    """Truy vấn Firestore tối giản: where '>=', order_by một trường, limit, start_after."""
+    def __init__(self, docs, field=None, lower=None, order=None, size=None, after=None):
+        self.docs, self.field, self.lower, self.order, self.size, self.after = docs, field, lower, order, size, after
+
+    def _copy(self, **changes):
+        return _FakeQuery(**{**vars(self), **changes})
+
+    def where(self, field, op, value):
+        return self._copy(field=field, lower=value)
+
+    def order_by(self, field):
+        return self._copy(order=field)
+
+    def limit(self, size):
+        return self._copy(size=size)
+
+    def start_after(self, doc):
+        return self._copy(after=doc.get(self.order))
+
+    def stream(self):
+        docs = [d for d in self.docs if self.field is None or (d.get(self.field) is not None and d.get(self.field) >= self.lower)]
+        docs.sort(key=lambda d: d.get(self.order))
+        if self.after is not None:
+            docs = [d for d in docs if d.get(self.order) > self.after]
+        return docs[:self.size]
+
+
+class _FakeDb:
+    def __init__(self):
+        self.collections = {}
+
+    def collection(self, name):
+        return _FakeQuery(self.collections.setdefault(name, []))
+
+
+def _ledger_row(doc_id, business_day, recorded_at):
+    data = {'sku': 'S1', 'branch_id': 'B1', 'reason': 'ADJUSTMENT', 'delta': 1, 'quantity_after': 1,
+            'timestamp': datetime(2026, 1, business_day, 9).isoformat()}
+    if recorded_at is not None:
+        data['recorded_at'] = recorded_at
+    return _FakeDoc(doc_id, data)
+
+
+def test_export_picks_up_backdated_rows_by_write_time(tmp_path):
+    from datetime import timedelta, timezone
+
+    db = _FakeDb()
+    store = AnalyticsStore(root_dir=str(tmp_path), page_size=2)
+    store.db = db
+    now = datetime.now(timezone.utc)
+    # Tài liệu cũ chưa có `recorded_at` vẫn được lấy ở lượt quét đầu tiên.
+    db.collections['inventory_transactions'] = [_ledger_row('L1', 10, None), _ledger_row('L2', 20, now - timedelta(hours=1))]
+    state = {'inventory_transactions': '2026-01-20T09:00:00'}  # Mốc kiểu cũ theo ngày nghiệp vụ: quét lại toàn bộ.
+    assert store.export_collection('inventory_transactions', state) == 2
+
+    # Chứng từ hạch toán lùi về ngày 5, ghi sau lượt trước: phải được sao chép dù ngày nghiệp vụ nhỏ hơn mốc cũ.
+    db.collections['inventory_transactions'].append(_ledger_row('L3', 5, now + timedelta(minutes=1)))
+    assert store.export_collection('inventory_transactions', state) == 1
+
+    df = store.read('inventory_transactions', 'timestamp', datetime(2026, 1, 1), datetime(2026, 1, 31, 23, 59),
+                    columns=['id'], dedupe_keys=['id'])
+    assert sorted(df['id']) == ['L1', 'L2', 'L3']
+    assert state['inventory_transactions']['value'] == (now + timedelta(minutes=1)).isoformat()
@@ -0,0 +1,32 @@
+from datetime import datetime, timedelta, timezone
+
+from managers.inventory_integrity import InventoryIntegrityChecker, RECONCILE_LEDGER_REASON
+
+WRITTEN = datetime(2026, 2, 1, tzinfo=timezone.utc)
+
+
+def _entry(sku, reason, delta, quantity_after, cost, business_day, written_minutes, branch_id='B1'):
+    return {'sku': sku, 'branch_id': branch_id, 'reason': reason, 'delta': delta, 'quantity_after': quantity_after,
+            'cost_at_transaction': cost, 'timestamp': datetime(2026, 1, business_day, 9).isoformat(),
+            'recorded_at': WRITTEN + timedelta(minutes=written_minutes)}
+
+
+def test_replay_starts_from_latest_reconcile_in_write_order(fake_client):
+    fake_client.db.collection('inventory_transactions')
+    fake_client.db.data['inventory_transactions'] = {
+        'L1': _entry('S1', 'GOODS_RECEIPT', 10, 10, 5.0, 1, 0),
+        'L2': _entry('S1', RECONCILE_LEDGER_REASON, -2, 8, 5.0, 2, 1),
+        # Ghi sau phiếu đối soát nhưng hạch toán lùi về ngày 1: vẫn được cộng vì thứ tự theo thời điểm ghi.
+        'L3': _entry('S1', 'GOODS_ISSUE', -3, 5, None, 1, 2),
+        'L4': _entry('S1', 'GOODS_RECEIPT', 4, 9, 6.0, 3, 3),
+        'L5': _entry('s2', 'GOODS_RECEIPT', 7, 7, 2.0, 1, 0, branch_id='B2'),
+    }
+    checker = InventoryIntegrityChecker(fake_client, inventory_mgr=None)
+
+    expected = checker.replay_ledger(['B1', 'B2']).set_index(['branch_id', 'sku'])
+
+    assert expected.loc[('B1', 'S1'), 'ledger_quantity'] == 8 - 3 + 4
+    # Giá vốn của bút toán ghi sau cùng có giá trị (L3 không có giá vốn).
+    assert expected.loc[('B1', 'S1'), 'ledger_average_cost'] == 6.0
+    assert expected.loc[('B1', 'S1'), 'ledger_entries'] == 4
+    assert expected.loc[('B2', 'S2'), 'ledger_quantity'] == 7
@@ -0,0 +1,55 @@
+from datetime import date, datetime, timedelta
+
+from managers.query_executor import day_bounds, split_time_range
+
+
+def test_split_time_range_dates_are_contiguous_and_inclusive():
+    start, end = date(2026, 1, 1), date(2026, 3, 15)
+    slices = split_time_range(start, end, timedelta(days=31))
+
+    assert slices[0][0] == start
+    assert slices[-1][1] == end
+    for (_, previous_end), (next_start, _) in zip(slices, slices[1:]):
+        assert next_start == previous_end + timedelta(days=1)
+
+
+def test_split_time_range_datetimes_do_not_overlap():
+    start, end = datetime(2026, 1, 1), datetime(2026, 2, 20, 23, 59, 59)
+    slices = split_time_range(start, end, timedelta(days=10))
+
+    assert slices[0][0] == start and slices[-1][1] == end
+    for (_, previous_end), (next_start, _) in zip(slices, slices[1:]):
+        assert next_start == previous_end + timedelta(microseconds=1)
+
+
+def test_split_time_range_open_ended():
+    assert split_time_range(None, date(2026, 1, 1)) == [(None, date(2026, 1, 1))]
+    assert split_time_range(date(2026, 1, 1), None) == [(date(2026, 1, 1), None)]
+
+
+def test_day_bounds_is_half_open():
+    assert day_bounds(date(2026, 1, 1), date(2026, 1, 5)) == ('2026-01-01', '2026-01-06')
+    assert day_bounds(None, date(2026, 1, 5)) == (None, '2026-01-06')
+    assert day_bounds(date(2026, 1, 1), None) == ('2026-01-01', None)
+
+
+def _matches(entry_date: str, lower, upper) -> bool:
+    # Cùng điều kiện chuỗi như truy vấn Firestore: entry_date >= lower và entry_date < upper.
+    return (lower is None or entry_date >= lower) and (upper is None or entry_date < upper)
+
+
+def test_sliced_day_filter_counts_every_entry_exactly_once():
+    start, end = date(2026, 1, 1), date(2026, 4, 30)
+    entries = []
+    day = start
+    while day <= end:
+        # Bút toán thường lưu 'YYYY-MM-DD'; bút toán phân bổ lưu 'YYYY-MM-DDT00:00:00'.
+        entries += [day.isoformat(), f"{day.isoformat()}T00:00:00"]
+        day += timedelta(days=1)
+    outside = ['2025-12-31', '2025-12-31T00:00:00', '2026-05-01', '2026-05-01T00:00:00']
+
+    slices = [day_bounds(*s) for s in split_time_range(start, end, timedelta(days=7))]
+    for entry_date in entries:
+        assert sum(_matches(entry_date, lower, upper) for lower, upper in slices) == 1, entry_date
+    for entry_date in outside:
+        assert not any(_matches(entry_date, lower, upper) for lower, upper in slices), entry_date
@@ -0,0 +1,56 @@
+from datetime import date, timedelta
+
+from managers.report_cache import DailyAggregateCache
+
+CLOSED_DAY = (date.today() - timedelta(days=10)).isoformat()
+
+
+def _record(branch_id, day, revenue):
+    return {'branch_id': branch_id, 'date': day, 'total_revenue': revenue}
+
+
+def test_closed_days_are_served_from_cache():
+    cache = DailyAggregateCache()
+    calls = []
+
+    def fetch(start_day, end_day, branch_ids):
+        calls.append((start_day, end_day, branch_ids))
+        return [_record('B1', start_day, 100)]
+
+    assert cache.get_range('daily', CLOSED_DAY, CLOSED_DAY, ['B1'], fetch) == [_record('B1', CLOSED_DAY, 100)]
+    assert cache.get_range('daily', CLOSED_DAY, CLOSED_DAY, ['B1'], fetch) == [_record('B1', CLOSED_DAY, 100)]
+    assert len(calls) == 1
+
+
+def test_invalidation_during_fetch_is_not_cached():
+    cache = DailyAggregateCache()
+    revenue = {'value': 100}
+
+    def stale_fetch(start_day, end_day, branch_ids):
+        records = [_record('B1', start_day, revenue['value'])]
+        # Một đơn bị huỷ và ngày bị huỷ hiệu lực trong khi lượt đọc này đang chạy (ngoài khoá).
+        revenue['value'] = 40
+        cache.invalidate('B1', CLOSED_DAY)
+        return records
+
+    def fetch(start_day, end_day, branch_ids):
+        return [_record('B1', start_day, revenue['value'])]
+
+    assert cache.get_range('daily', CLOSED_DAY, CLOSED_DAY, ['B1'], stale_fetch)[0]['total_revenue'] == 100
+    # Kết quả cũ không được giữ cho ngày đã đóng: lượt sau đọc lại và thấy số liệu mới.
+    assert cache.get_range('daily', CLOSED_DAY, CLOSED_DAY, ['B1'], fetch)[0]['total_revenue'] == 40
+
+
+def test_invalidation_of_other_branch_does_not_drop_fetch():
+    cache = DailyAggregateCache()
+    calls = []
+
+    def fetch(start_day, end_day, branch_ids):
+        calls.append(branch_ids)
+        if len(calls) == 1:
+            cache.invalidate('B2', CLOSED_DAY)
+        return [_record('B1', start_day, 100)]
+
+    cache.get_range('daily', CLOSED_DAY, CLOSED_DAY, ['B1'], fetch)
+    cache.get_range('daily', CLOSED_DAY, CLOSED_DAY, ['B1'], fetch)
+    assert len(calls) == 1
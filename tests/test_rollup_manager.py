@@ -0,0 +1,104 @@
+from datetime import date, datetime
+
+from managers.rollup_manager import RollupManager, UNGROUPED_KEY
+
+
+def _sale(doc_id, created_at, total=100, items=None):
+    return {'id': doc_id, 'type': 'SALE', 'branch_id': 'B1', 'created_at': created_at, 'total_amount': total,
+            'total_cogs': 60, 'items': items or [{'sku': 'S1', 'name': 'Áo', 'quantity': 2, 'final_price': 50, 'line_cogs': 60}]}
+
+
+def _expense(doc_id, created_at, amount=30, group_id='G1'):
+    return {'id': doc_id, 'type': 'EXPENSE', 'branch_id': 'B1', 'created_at': created_at, 'total_amount': -amount,
+            'expense_details': {'group_id': group_id, 'classification': None}}
+
+
+def test_sale_then_void_returns_counters_to_zero(fake_client):
+    client = fake_client
+    rollups = RollupManager(client)
+    sale = _sale('T1', datetime(2026, 1, 5, 10))
+    writer = client.db.batch()
+    rollups.apply_transaction(writer, sale)
+    writer.commit()
+
+    daily = client.db.data['daily_sales_rollups']['B1_2026-01-05']
+    sku = client.db.data['daily_sku_rollups']['B1_2026-01-05_S1']
+    assert (daily['order_count'], daily['total_revenue'], daily['total_cogs']) == (1, 100, 60)
+    assert (sku['quantity_sold'], sku['revenue'], sku['cogs']) == (2, 100, 60)
+
+    writer = client.db.batch()
+    rollups.apply_transaction(writer, sale, sign=-1)
+    writer.commit()
+
+    daily = client.db.data['daily_sales_rollups']['B1_2026-01-05']
+    sku = client.db.data['daily_sku_rollups']['B1_2026-01-05_S1']
+    assert (daily['order_count'], daily['total_revenue'], daily['total_cogs']) == (0, 0, 0)
+    assert (sku['quantity_sold'], sku['revenue'], sku['cogs']) == (0, 0, 0)
+
+
+def test_expense_is_positive_and_delete_reverses_it(fake_client):
+    client = fake_client
+    rollups = RollupManager(client)
+    expense = _expense('CE-1', datetime(2026, 1, 5))
+    writer = client.db.batch()
+    rollups.apply_transaction(writer, expense)
+    writer.commit()
+
+    daily = client.db.data['daily_sales_rollups']['B1_2026-01-05']
+    # Chi phí được lưu âm trên transaction nhưng cộng dương vào tổng chi phí vận hành.
+    assert daily['total_operating_expenses'] == 30
+    assert daily['expenses_by_group'] == {'G1': 30}
+    assert daily['expenses_by_classification'] == {UNGROUPED_KEY: 30}
+    assert 'order_count' not in daily
+
+    writer = client.db.batch()
+    rollups.apply_transaction(writer, expense, sign=-1)
+    writer.commit()
+
+    daily = client.db.data['daily_sales_rollups']['B1_2026-01-05']
+    assert (daily['expense_count'], daily['total_operating_expenses']) == (0, 0)
+    assert daily['expenses_by_group'] == {'G1': 0}
+
+
+def test_rebuild_rollups_recomputes_and_drops_stale_documents(fake_client):
+    client = fake_client
+    client.db.collection('transactions')
+    client.db.data['transactions'] = {
+        'T1': _sale('T1', datetime(2026, 1, 5, 9)),
+        'T2': _sale('T2', datetime(2026, 1, 5, 15), total=40, items=[{'sku': 'S1', 'name': 'Áo', 'quantity': 1, 'final_price': 40, 'line_cogs': 30}]),
+        'CE-1': _expense('CE-1', datetime(2026, 1, 6)),
+    }
+    client.db.collection('daily_sales_rollups')
+    # Tổng hợp sai lệch của một ngày không còn giao dịch nào: phải bị xoá.
+    client.db.data['daily_sales_rollups']['B1_2026-01-07'] = {'branch_id': 'B1', 'date': '2026-01-07', 'order_count': 3}
+    rollups = RollupManager(client)
+
+    result = rollups.rebuild_rollups(datetime(2026, 1, 1), datetime(2026, 1, 31, 23, 59, 59))
+
+    assert result == {'daily': 2, 'sku': 1}
+    daily = client.db.data['daily_sales_rollups']
+    assert set(daily) == {'B1_2026-01-05', 'B1_2026-01-06'}
+    assert (daily['B1_2026-01-05']['order_count'], daily['B1_2026-01-05']['total_revenue']) == (2, 140)
+    assert daily['B1_2026-01-06']['total_operating_expenses'] == 30
+    assert client.db.data['daily_sku_rollups']['B1_2026-01-05_S1']['quantity_sold'] == 3
+
+
+def test_backfill_rebuilds_history_once_and_the_first_live_day_after_it_closes(fake_client):
+    client = fake_client
+    client.db.collection('transactions')
+    client.db.data['transactions'] = {
+        'T1': _sale('T1', datetime(2026, 1, 5, 9)),
+        'T2': _sale('T2', datetime(2026, 3, 1, 9)),  # ngày triển khai: đơn trước lúc bật tổng hợp
+    }
+    rollups = RollupManager(client)
+
+    first = rollups.backfill_rollups(today=date(2026, 3, 1))
+    assert first == {'rebuilt_from': '2026-01-05', 'rebuilt_through': '2026-02-28'}
+    assert set(client.db.data['daily_sales_rollups']) == {'B1_2026-01-05'}
+
+    assert rollups.backfill_rollups(today=date(2026, 3, 1)) == {'rebuilt_from': None, 'rebuilt_through': None}
+
+    second = rollups.backfill_rollups(today=date(2026, 3, 2))
+    assert second == {'rebuilt_from': '2026-03-01', 'rebuilt_through': '2026-03-01'}
+    assert client.db.data['daily_sales_rollups']['B1_2026-03-01']['order_count'] == 1
+    assert rollups.backfill_rollups(today=date(2026, 3, 9)) == {'rebuilt_from': None, 'rebuilt_through': None}
@@ -66,3 +66,27 @@ def render_branch_selector(allowed_branches_map, default_branch_id=None, key_pre
     )
     
     return selected_branch
+
+def render_period_selector(presets, default_start, default_end, key_prefix=""):
+    """
+    Renders a report period selector (preset periods + custom range) and returns (start_date, end_date).
+
+    Args:
+        presets (dict): Mapping of preset label to a (start_date, end_date) tuple.
+        default_start (date): Start date used for the custom range.
+        default_end (date): End date used for the custom range.
+        key_prefix (str, optional): A prefix for the widget keys to ensure uniqueness.
+    """
+    custom_label = "Tùy chọn"
+    period_label = st.selectbox("Kỳ báo cáo", options=list(presets.keys()) + [custom_label], key=f"{key_prefix}_period")
+    is_custom = period_label == custom_label
+    preset_start, preset_end = (default_start, default_end) if is_custom else presets[period_label]
+    col1, col2 = st.columns(2)
+    start_date = col1.date_input("Từ ngày", preset_start, disabled=not is_custom, key=f"{key_prefix}_start_{period_label}")
+    end_date = col2.date_input("Đến ngày", preset_end, disabled=not is_custom, key=f"{key_prefix}_end_{period_label}")
+    return start_date, end_date
+
+def render_as_of_caption(as_of):
+    """Shows when a precomputed report was calculated."""
+    if as_of:
+        st.caption(f"⚡ Số liệu tính sẵn lúc {as_of.strftime('%H:%M %d/%m/%Y')}.")
@@ -1,7 +1,11 @@
 import streamlit as st
 import pandas as pd
-from managers.admin_manager import AdminManager
+from datetime import datetime, timedelta
+from managers.admin_manager import AdminManager, BULK_VOID_MAX_ORDERS
 from managers.auth_manager import AuthManager
+from managers.image_cache import get_image_cache
+from managers.image_gc import DEFAULT_MIN_AGE_HOURS
+from managers.transaction_search import prefix_conflict_message
 from ui._utils import render_page_title, render_section_header
 
 def render_admin_page(admin_mgr: AdminManager, auth_mgr: AuthManager):
@@ -27,14 +31,31 @@ def render_admin_page(admin_mgr: AdminManager, auth_mgr: AuthManager):
 
     st.warning("**CẢNH BÁO:** Các hành động trong trang này có thể gây mất dữ liệu vĩnh viễn và không thể hoàn tác. Hãy thật cẩn trọng.")
     
-    tab1, tab2 = st.tabs(["Xóa Giao Dịch Bán Hàng Lỗi", "Dọn Dẹp Dữ Liệu Kho"])
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["Xóa Giao Dịch Bán Hàng Lỗi", "Dọn Dẹp Dữ Liệu Kho", "Dữ Liệu Tổng Hợp Báo Cáo", "Sao Lưu & Khôi Phục", "Ảnh Sản Phẩm"])
 
     with tab1:
         render_transaction_deletion_tab(admin_mgr, user_info['uid'])
     
     with tab2:
+        render_inventory_integrity_section(admin_mgr, user_info['uid'])
+        st.divider()
         render_inventory_cleanup_tab(admin_mgr)
 
+    with tab3:
+        render_rollup_rebuild_tab(admin_mgr)
+        st.divider()
+        render_analytics_export_section(st.session_state.report_mgr)
+        st.divider()
+        render_report_precompute_section(st.session_state.report_mgr)
+
+    with tab4:
+        render_backup_tab(admin_mgr)
+
+    with tab5:
+        render_image_cache_section()
+        st.divider()
+        render_image_gc_section(admin_mgr)
+
 def render_transaction_deletion_tab(admin_mgr, current_user_id):
     render_section_header("❌ Xóa Giao Dịch SALE và Hoàn Trả Tồn Kho")
 
@@ -49,55 +70,171 @@ def render_transaction_deletion_tab(admin_mgr, current_user_id):
             st.rerun()
         return
 
-    st.markdown("Chức năng này cho phép bạn xóa một giao dịch **bán hàng (SALE)** cụ thể. Hệ thống sẽ **tự động cộng trả lại số lượng tồn kho** tương ứng. Hành động này không thể hoàn tác.")
+    st.markdown("Chức năng này cho phép bạn xóa các giao dịch **bán hàng (SALE)**. Hệ thống sẽ **tự động cộng trả lại số lượng tồn kho** tương ứng. Hành động này không thể hoàn tác.")
 
-    with st.spinner("Đang tải danh sách giao dịch..."):
-        transactions = admin_mgr.get_all_transactions()
-    
-    sale_transactions = [t for t in transactions if t.get('type') == 'SALE']
-    if not sale_transactions:
-        st.info("Hiện không có giao dịch bán hàng (SALE) nào để xóa.")
+    if st.session_state.transaction_to_delete:
+        render_void_confirmation(admin_mgr, current_user_id)
         return
 
-    df = pd.DataFrame(sale_transactions)
-    df_display = df[['id', 'created_at', 'branch_id', 'total_amount', 'total_cogs']].copy()
-    df_display['created_at'] = pd.to_datetime(df_display['created_at']).dt.strftime('%Y-%m-%d %H:%M:%S')
-    df_display['total_amount'] = df_display['total_amount'].apply(lambda x: f"{x:,.0f}đ")
+    with st.form("admin_sale_search"):
+        col1, col2, col3 = st.columns(3)
+        order_id_prefix = col1.text_input("Mã đơn (hoặc phần đầu mã đơn)")
+        start_date = col2.date_input("Từ ngày", value=None, key="admin_sale_start")
+        end_date = col3.date_input("Đến ngày", value=None, key="admin_sale_end")
+        if st.form_submit_button("Tìm giao dịch", type="primary"):
+            criteria = {'order_id_prefix': order_id_prefix, 'start_date': start_date, 'end_date': end_date}
+            if prefix_conflict_message(criteria):
+                st.warning(prefix_conflict_message(criteria))
+            else:
+                st.session_state.admin_sale_search = {'criteria': criteria, 'cursors': [None], 'page': None}
 
-    st.write("**Danh sách các giao dịch bán hàng:**")
-    st.dataframe(df_display, use_container_width=True, hide_index=True)
-    st.divider()
+    state = st.session_state.setdefault('admin_sale_search', {'criteria': {}, 'cursors': [None], 'page': None})
+    if state['page'] is None:
+        with st.spinner("Đang tải danh sách giao dịch..."):
+            state['page'] = admin_mgr.search_sale_transactions(state['criteria'], cursor=state['cursors'][-1])
+
+    sale_transactions = state['page']['transactions']
+    page_number = len(state['cursors'])
+    selected_ids = st.session_state.setdefault('void_selection', [])
+    if not sale_transactions:
+        st.info("Không có giao dịch bán hàng (SALE) nào khớp điều kiện tìm kiếm.")
+    else:
+        df_display = pd.DataFrame([{
+            'id': t['id'],
+            'created_at': t['created_at'].strftime('%Y-%m-%d %H:%M:%S') if t.get('created_at') else "N/A",
+            'branch_id': t.get('branch_id'),
+            'total_amount': f"{t.get('total_amount', 0):,.0f}đ",
+        } for t in sale_transactions])
+
+        st.write(f"**Giao dịch bán hàng — trang {page_number}** (chọn các dòng cần xóa):")
+        selection = st.dataframe(
+            df_display, use_container_width=True, hide_index=True,
+            on_select="rerun", selection_mode="multi-row", key=f"admin_sale_table_{page_number}"
+        )
 
-    if not st.session_state.transaction_to_delete:
-        transaction_ids = [t['id'] for t in sale_transactions]
-        selected_transaction_id = st.selectbox("Chọn Giao Dịch Cần Xóa:", options=[""] + transaction_ids)
-        if selected_transaction_id and st.button("Xóa Giao Dịch Được Chọn...", type="primary"):
-            st.session_state.transaction_to_delete = selected_transaction_id
+        nav_prev, nav_add, nav_next = st.columns(3)
+        if nav_prev.button("← Trang trước", disabled=page_number == 1, use_container_width=True):
+            state['cursors'].pop()
+            state['page'] = None
+            st.rerun()
+        picked = [sale_transactions[i]['id'] for i in (selection.selection.rows if selection else [])]
+        if nav_add.button(f"Thêm {len(picked)} giao dịch vào danh sách xóa", disabled=not picked, use_container_width=True):
+            room = BULK_VOID_MAX_ORDERS - len(selected_ids)
+            new_ids = [t for t in picked if t not in selected_ids]
+            selected_ids.extend(new_ids[:room])
+            if len(new_ids) > room:
+                st.warning(f"Mỗi lần chỉ xóa tối đa {BULK_VOID_MAX_ORDERS} giao dịch.")
+        if nav_next.button("Trang sau →", disabled=state['page']['next_cursor'] is None, use_container_width=True):
+            state['cursors'].append(state['page']['next_cursor'])
+            state['page'] = None
             st.rerun()
 
-    if st.session_state.transaction_to_delete:
-        st.error(f"Bạn có chắc chắn muốn xóa vĩnh viễn giao dịch **{st.session_state.transaction_to_delete}** và hoàn trả tồn kho không?")
-        
-        col1, col2, _ = st.columns([2, 2, 8])
-        if col1.button("CÓ, TÔI CHẮC CHẮN", type="secondary"):
+    st.divider()
+    if not selected_ids:
+        st.caption("Chưa chọn giao dịch nào để xóa.")
+        return
+
+    st.write(f"**Danh sách chờ xóa ({len(selected_ids)}/{BULK_VOID_MAX_ORDERS}):** " + ", ".join(f"`{t}`" for t in selected_ids))
+    col1, col2, _ = st.columns([3, 2, 7])
+    if col1.button("Xóa Các Giao Dịch Đã Chọn...", type="primary"):
+        st.session_state.transaction_to_delete = list(selected_ids)
+        st.rerun()
+    if col2.button("Bỏ chọn tất cả"):
+        selected_ids.clear()
+        st.rerun()
+
+def render_void_confirmation(admin_mgr, current_user_id):
+    transaction_ids = st.session_state.transaction_to_delete
+    if len(transaction_ids) == 1:
+        st.error(f"Bạn có chắc chắn muốn xóa vĩnh viễn giao dịch **{transaction_ids[0]}** và hoàn trả tồn kho không?")
+    else:
+        st.error(f"Bạn có chắc chắn muốn xóa vĩnh viễn **{len(transaction_ids)} giao dịch** đã chọn và hoàn trả tồn kho không?")
+
+    col1, col2, _ = st.columns([2, 2, 8])
+    if col1.button("CÓ, TÔI CHẮC CHẮN", type="secondary"):
+        if len(transaction_ids) == 1:
             with st.spinner("Đang xử lý..."):
-                success, message = admin_mgr.delete_transaction_and_revert_stock(st.session_state.transaction_to_delete, current_user_id)
-                st.session_state.delete_result = (success, message)
-                if success:
-                    st.cache_data.clear()
-            st.session_state.transaction_to_delete = None
-            st.rerun()
+                st.session_state.delete_result = admin_mgr.delete_transaction_and_revert_stock(transaction_ids[0], current_user_id)
+        else:
+            progress = st.progress(0.0, text="Đang xóa giao dịch...")
+            result = admin_mgr.bulk_void_transactions(
+                transaction_ids, current_user_id,
+                progress_callback=lambda done, total: progress.progress(done / total, text=f"Đã xử lý {done}/{total} giao dịch")
+            )
+            message = f"Đã xóa {len(result['deleted'])} giao dịch và hoàn trả tồn kho."
+            if result['skipped']:
+                message += " Bỏ qua: " + "; ".join(f"{t} ({reason})" for t, reason in result['skipped'].items()) + "."
+            if result['failed']:
+                message += f" Lỗi ở {len(result['failed'])} giao dịch: " + "; ".join(dict.fromkeys(result['failed'].values()))
+            st.session_state.delete_result = (result['success'], message)
 
-        if col2.button("HỦY BỎ"):
-            st.session_state.transaction_to_delete = None
-            st.rerun()
+        st.cache_data.clear()
+        st.session_state.transaction_to_delete = None
+        st.session_state.void_selection = []
+        st.session_state.pop('admin_sale_search', None)
+        st.rerun()
+
+    if col2.button("HỦY BỎ"):
+        st.session_state.transaction_to_delete = None
+        st.rerun()
+
+ISSUE_LABELS = {
+    'quantity': "Lệch số lượng",
+    'average_cost': "Lệch giá vốn",
+    'missing_inventory': "Thiếu tài liệu tồn kho",
+    'missing_ledger': "Không có sổ kho",
+}
+
+def render_inventory_integrity_section(admin_mgr, current_user_id):
+    render_section_header("🔍 Đối soát Tồn kho với Sổ kho")
+    st.markdown("So sánh `inventory` (số lượng, giá vốn bình quân) với kết quả phát lại `inventory_transactions` của từng chi nhánh. Phiếu điều chỉnh đối soát đưa tồn kho về số lượng theo sổ kho và trở thành mốc cho các lần kiểm tra sau.")
+
+    if st.button("Chạy đối soát", key="run_integrity_check"):
+        with st.spinner("Đang đọc sổ kho và đối soát..."):
+            st.session_state.integrity_report = admin_mgr.integrity_checker.run_check()
+
+    report = st.session_state.get('integrity_report')
+    if not report:
+        return
+    if not report['success']:
+        st.error(f"Lỗi: {report['message']}")
+        return
+
+    discrepancies = report['discrepancies']
+    st.caption(f"Kiểm tra lúc {report['checked_at']:%H:%M:%S %d/%m/%Y}: {report['checked_items']:,} mặt hàng, {report['ledger_entries']:,} bút toán sổ kho.")
+    if discrepancies.empty:
+        st.success("Tồn kho khớp hoàn toàn với sổ kho.")
+        return
+
+    st.warning(f"Phát hiện {len(discrepancies)} chênh lệch.")
+    st.dataframe(discrepancies.assign(issue=discrepancies['issue'].map(ISSUE_LABELS)), use_container_width=True, hide_index=True)
+    quantity_issues = int((discrepancies['quantity_diff'] != 0).sum())
+    if quantity_issues and st.button(f"Tạo phiếu điều chỉnh cho {quantity_issues} mặt hàng lệch số lượng", type="primary"):
+        with st.spinner("Đang tạo phiếu điều chỉnh..."):
+            results = admin_mgr.integrity_checker.create_corrections(discrepancies, current_user_id)
+        st.cache_data.clear()
+        st.session_state.integrity_report = None
+        for branch_id, result in results.items():
+            if result['error']:
+                st.error(f"**{branch_id}:** {result['error']}")
+                continue
+            st.markdown(f"- **{branch_id}:** {result['voucher_id'] or 'Không tạo phiếu'}")
+            for sku, reason in result['skipped'].items():
+                st.warning(f"{branch_id} / {sku}: {reason}")
 
 def render_inventory_cleanup_tab(admin_mgr):
     render_section_header("🗑️ Dọn dẹp toàn bộ Dữ liệu Kho")
     st.markdown("Chức năng này sẽ xoá **TOÀN BỘ** dữ liệu trong các collection sau: `inventory`, `inventory_vouchers`, và `inventory_transactions`. Dữ liệu này sẽ bị xoá vĩnh viễn.")
+    st.info("Nên tạo một bản sao lưu ở tab **Sao Lưu & Khôi Phục** trước khi dọn dẹp.")
 
     if not st.session_state.confirm_delete_inventory and not st.session_state.show_result:
-        if st.button("Xóa Tất Cả Dữ Liệu Kho...", type="secondary"):
+        col1, col2, _ = st.columns([3, 3, 6])
+        if col1.button("Đếm thử (không xoá)", key="inventory_dry_run"):
+            with st.spinner("Đang đếm số tài liệu..."):
+                st.session_state.operation_result = {'dry_run': True, 'collections': admin_mgr.clear_inventory_data(dry_run=True)}
+            st.session_state.show_result = True
+            st.rerun()
+        if col2.button("Xóa Tất Cả Dữ Liệu Kho...", type="secondary"):
             st.session_state.confirm_delete_inventory = True
             st.session_state.operation_result = None
             st.session_state.show_result = False
@@ -109,11 +246,16 @@ def render_inventory_cleanup_tab(admin_mgr):
         col1, col2, _ = st.columns([2, 2, 8])
         
         if col1.button("CÓ, TÔI CHẮC CHẮN MUỐN XOÁ", type="secondary"):
-            with st.spinner("Đang xử lý... Quá trình này có thể mất vài phút."):
-                result = admin_mgr.clear_inventory_data()
-                st.session_state.operation_result = result
-                st.session_state.show_result = True
-                st.cache_data.clear() 
+            progress_placeholder = st.empty()
+
+            def on_progress(snapshots):
+                with progress_placeholder.container():
+                    render_deletion_progress(snapshots)
+
+            result = admin_mgr.clear_inventory_data(progress_callback=on_progress)
+            st.session_state.operation_result = {'dry_run': False, 'collections': result}
+            st.session_state.show_result = True
+            st.cache_data.clear() 
             st.session_state.confirm_delete_inventory = False
             st.rerun()
 
@@ -122,15 +264,232 @@ def render_inventory_cleanup_tab(admin_mgr):
             st.rerun()
 
     if st.session_state.show_result and st.session_state.operation_result:
-        result = st.session_state.operation_result
-        if "error" in result:
-            st.error(f"Lỗi: {result['error']}")
+        dry_run = st.session_state.operation_result['dry_run']
+        result = st.session_state.operation_result['collections']
+        errors = [r for r in result.values() if r['error'] or r['failed']]
+        if dry_run:
+            st.info("Chạy thử: chưa xoá tài liệu nào.")
+        elif errors:
+            st.error("Dọn dẹp chưa hoàn tất, một số tài liệu chưa được xoá.")
         else:
             st.success("Hoàn tất! Dữ liệu kho đã được dọn dẹp.")
-            st.write("**Kết quả:**")
-            for coll, count in result.items():
-                st.markdown(f"- **{coll}:** Đã xóa {count} tài liệu.")
+        st.write("**Kết quả:**")
+        for r in result.values():
+            total = f"{r['total']:,}" if r['total'] is not None else "?"
+            if dry_run:
+                st.markdown(f"- **{r['collection']}:** {total} tài liệu sẽ bị xoá.")
+            else:
+                line = f"- **{r['collection']}:** Đã xóa {r['deleted']:,}/{total} tài liệu trong {r['elapsed']:.1f}s ({r['docs_per_second']:,.0f} tài liệu/giây)"
+                if r['failed']:
+                    line += f", {r['failed']:,} lỗi"
+                if r['error']:
+                    line += f" — Lỗi: {r['error']}"
+                st.markdown(line)
         if st.button("OK"):
             st.session_state.show_result = False
             st.session_state.operation_result = None
             st.rerun()
+
+def render_deletion_progress(snapshots):
+    for snap in snapshots:
+        done = snap['deleted'] + snap['failed']
+        fraction = min(done / snap['total'], 1.0) if snap['total'] else (1.0 if snap['finished'] else 0.0)
+        st.progress(fraction, text=f"{snap['collection']}: {done:,}/{snap['total'] if snap['total'] is not None else '?'} — {snap['docs_per_second']:,.0f} tài liệu/giây")
+
+def render_rollup_rebuild_tab(admin_mgr):
+    render_section_header("🔄 Tính lại Dữ liệu Tổng hợp Báo cáo")
+    st.markdown("Các báo cáo đọc từ dữ liệu tổng hợp theo ngày (`daily_sales_rollups`, `daily_sku_rollups`). Dùng chức năng này để khởi tạo tổng hợp cho các giao dịch cũ hoặc sửa sai lệch trong khoảng thời gian đã chọn.")
+
+    col1, col2 = st.columns(2)
+    today = datetime.now()
+    start_date = col1.date_input("Từ ngày", today - timedelta(days=30), key="rollup_start_date")
+    end_date = col2.date_input("Đến ngày", today, key="rollup_end_date")
+
+    if st.button("Tính lại dữ liệu tổng hợp", type="primary"):
+        if start_date > end_date:
+            st.error("Ngày bắt đầu không được lớn hơn ngày kết thúc.")
+            return
+        with st.spinner("Đang tính lại dữ liệu tổng hợp..."):
+            success, result = admin_mgr.rebuild_report_rollups(
+                datetime.combine(start_date, datetime.min.time()),
+                datetime.combine(end_date, datetime.max.time())
+            )
+        if success:
+            st.cache_data.clear()
+            st.success(f"Hoàn tất! Đã ghi {result['daily']} tổng hợp ngày và {result['sku']} tổng hợp sản phẩm.")
+        else:
+            st.error(f"Lỗi: {result}")
+
+def render_analytics_export_section(report_mgr):
+    render_section_header("📦 Kho Dữ liệu Phân tích Cục bộ (Parquet)")
+    st.markdown("Sao chép tăng dần `transactions`, `inventory_transactions` và `cost_entries` sang kho Parquet cục bộ (phân vùng theo chi nhánh/năm/tháng). Mỗi lần chạy chỉ đọc các tài liệu mới kể từ mốc lần trước.")
+
+    state = report_mgr.analytics_store.summary()
+    if state:
+        st.write("**Mốc đồng bộ hiện tại:**")
+        for coll, hwm in state.items():
+            st.markdown(f"- **{coll}:** `{hwm}`")
+
+    full_refresh = st.checkbox("Đồng bộ lại toàn bộ (xoá kho cục bộ và sao chép lại từ đầu)", key="analytics_full_refresh")
+    if st.button("Đồng bộ kho phân tích", type="primary"):
+        with st.spinner("Đang sao chép dữ liệu..."):
+            try:
+                result = report_mgr.export_analytics_store(full_refresh=full_refresh)
+            except Exception as e:
+                st.error(f"Lỗi: {e}")
+                return
+        st.cache_data.clear()
+        st.success("Hoàn tất đồng bộ kho phân tích.")
+        for coll, count in result.items():
+            st.markdown(f"- **{coll}:** {count} tài liệu mới.")
+
+def render_report_precompute_section(report_mgr):
+    render_section_header("⚡ Báo cáo Tính sẵn")
+    scheduler = report_mgr.scheduler
+    if scheduler is None:
+        st.info("Luồng tính sẵn báo cáo đang tắt (`report_precompute_enabled = false`).")
+        return
+
+    status = scheduler.status()
+    st.markdown(f"Các kỳ đã khép lại (hôm qua, tháng trước) được tính sẵn cho từng chi nhánh và toàn hệ thống vào các mốc: **{', '.join(status['run_times'])}**.")
+    last_run = status['last_run_at'].strftime('%H:%M:%S %d/%m/%Y') if status['last_run_at'] else "Chưa chạy"
+    st.write(f"**Trạng thái:** {'Đang hoạt động' if status['running'] else 'Đã dừng'} — **Lần tính gần nhất:** {last_run}")
+    if status['last_error']:
+        st.warning(f"Lỗi lần chạy gần nhất: {status['last_error']}")
+    if st.button("Tính lại ngay", key="precompute_trigger"):
+        scheduler.trigger()
+        st.success("Đã yêu cầu tính lại. Kết quả sẽ sẵn sàng sau ít phút.")
+
+def render_backup_progress(placeholder, counts, totals=None):
+    with placeholder.container():
+        for collection, done in counts.items():
+            total = (totals or {}).get(collection)
+            st.progress(min(done / total, 1.0) if total else 0.0, text=f"{collection}: {done:,}" + (f"/{total:,}" if total else ""))
+
+def render_backup_tab(admin_mgr):
+    backup_mgr = admin_mgr.backup_mgr
+    render_section_header("💾 Sao lưu & Khôi phục Dữ liệu")
+    st.markdown(f"Sao lưu toàn bộ các collection ra thư mục `{backup_mgr.backup_dir}` (mỗi collection một tệp JSONL nén gzip, kèm số tài liệu và checksum SHA-256). Khôi phục ghi đè các tài liệu cùng mã, không xoá tài liệu phát sinh sau thời điểm sao lưu.")
+
+    if st.button("Tạo bản sao lưu", type="primary"):
+        placeholder = st.empty()
+        result = backup_mgr.create_backup(progress_callback=lambda counts: render_backup_progress(placeholder, counts))
+        total = sum(r['documents'] for r in result['collections'].values())
+        if result['success']:
+            st.success(f"Đã sao lưu {total:,} tài liệu từ {len(result['collections'])} collection vào `{result['name']}`.")
+        else:
+            st.error("Sao lưu chưa hoàn tất: " + "; ".join(f"{c}: {e}" for c, e in result['errors'].items()))
+
+    backups = backup_mgr.list_backups()
+    if not backups:
+        st.info("Chưa có bản sao lưu nào.")
+        return
+
+    st.divider()
+    backup_names = [b['name'] for b in backups]
+    selected = st.selectbox("Chọn bản sao lưu", backup_names)
+    backup = backups[backup_names.index(selected)]
+    if backup.get('read_time'):
+        st.caption(f"Ảnh chụp dữ liệu tại {backup['read_time']} (UTC).")
+    st.dataframe(pd.DataFrame([
+        {"Collection": c, "Số tài liệu": spec['documents'], "SHA-256": spec['sha256'][:16] + "…"}
+        for c, spec in backup['collections'].items()
+    ]), use_container_width=True, hide_index=True)
+
+    col1, col2, _ = st.columns([2, 3, 7])
+    if col1.button("Kiểm tra checksum"):
+        with st.spinner("Đang kiểm tra..."):
+            report = backup_mgr.verify_backup(selected)
+        problems = {c: p for c, p in report.items() if p}
+        if problems:
+            st.error("Bản sao lưu bị lỗi: " + "; ".join(f"{c}: {p}" for c, p in problems.items()))
+        else:
+            st.success("Tất cả tệp khớp số tài liệu và checksum.")
+
+    confirm_key = f"confirm_restore_{selected}"
+    if col2.button("Khôi phục bản sao lưu này...", type="secondary"):
+        st.session_state[confirm_key] = True
+    if st.session_state.get(confirm_key):
+        st.error(f"Ghi đè dữ liệu hiện tại bằng bản sao lưu **{selected}**?")
+        c1, c2, _ = st.columns([2, 2, 8])
+        if c1.button("CÓ, KHÔI PHỤC", type="secondary"):
+            placeholder = st.empty()
+            totals = {c: spec['documents'] for c, spec in backup['collections'].items()}
+            result = backup_mgr.restore_backup(selected, progress_callback=lambda counts: render_backup_progress(placeholder, counts, totals))
+            st.session_state[confirm_key] = False
+            st.cache_data.clear()
+            if result['success']:
+                st.success(f"Đã khôi phục {len(result['collections'])} collection.")
+            else:
+                st.error("Khôi phục có lỗi: " + "; ".join(f"{c}: {e}" for c, e in result['errors'].items()))
+        if c2.button("HỦY", key="cancel_restore"):
+            st.session_state[confirm_key] = False
+            st.rerun()
+
+def render_image_cache_section():
+    render_section_header("🖼️ Bộ đệm Ảnh")
+    stats = get_image_cache().stats()
+    mb = 1024 * 1024
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Tỷ lệ trúng", f"{stats['hit_rate']:.0%}")
+    col2.metric("Bộ nhớ", f"{stats['memory_bytes'] / mb:,.1f}/{stats['memory_max_bytes'] / mb:,.0f} MB", f"{stats['memory_items']} ảnh", delta_color="off")
+    col3.metric("Đĩa", f"{stats['disk_bytes'] / mb:,.1f}/{stats['disk_max_bytes'] / mb:,.0f} MB", delta_color="off")
+    st.caption(f"Trúng bộ nhớ: {stats['memory_hits']:,} — Trúng đĩa: {stats['disk_hits']:,} — Tải từ Drive: {stats['misses']:,} — "
+               f"Loại khỏi bộ nhớ: {stats['memory_evictions']:,} — Loại khỏi đĩa: {stats['disk_evictions']:,}")
+
+def render_image_gc_section(admin_mgr):
+    render_section_header("🧹 Dọn Ảnh Mồ Côi trên Drive")
+    st.markdown("Tìm các tệp trong thư mục ảnh sản phẩm/chứng từ trên Drive mà không còn sản phẩm hay bút toán chi phí nào tham chiếu (ví dụ: ảnh cũ bị thay, tạo sản phẩm lỗi giữa chừng) và xoá chúng.")
+    image_handler = st.session_state.product_mgr.image_handler if 'product_mgr' in st.session_state else None
+    if not image_handler:
+        st.warning("Trình xử lý ảnh chưa được cấu hình.")
+        return
+
+    min_age_hours = st.number_input("Bỏ qua ảnh tải lên trong vòng (giờ)", min_value=1, value=DEFAULT_MIN_AGE_HOURS, step=1, key="image_gc_min_age",
+                                    help="Ảnh mới có thể chưa kịp được ghi vào sản phẩm (đang trong hàng đợi tải lên).")
+    progress_text = st.empty()
+
+    def _on_progress(phase, done, total):
+        if phase == 'scan':
+            progress_text.caption(f"Đã quét {done:,} tệp...")
+        else:
+            progress_text.caption(f"Đã xoá {done:,}/{total:,} tệp...")
+
+    if st.button("Quét thử (không xoá)", key="image_gc_dry_run"):
+        with st.spinner("Đang liệt kê Drive và đối chiếu tham chiếu..."):
+            st.session_state.image_gc_result = {'dry_run': True, **admin_mgr.image_gc.run(image_handler, dry_run=True, min_age_hours=min_age_hours, progress_callback=_on_progress)}
+        progress_text.empty()
+
+    result = st.session_state.get('image_gc_result')
+    if not result:
+        return
+    if not result['success']:
+        st.error(f"Lỗi: {result['message']}")
+        return
+
+    orphans = result['orphans']
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Tệp đã quét", f"{result['scanned']:,}")
+    col2.metric("Đang được dùng", f"{result['referenced']:,}")
+    col3.metric("Mồ côi", f"{len(orphans):,}", f"{result['orphan_bytes'] / (1024 * 1024):,.1f} MB", delta_color="off")
+    col4.metric("Bỏ qua (mới)", f"{result['skipped_recent']:,}")
+
+    if not result['dry_run']:
+        st.success(f"Đã xoá {len(result['deleted']):,} tệp mồ côi.")
+        if result['failed']:
+            st.error(f"{len(result['failed'])} tệp xoá không thành công.")
+            st.dataframe(pd.DataFrame([{'file_id': k, 'lỗi': v} for k, v in result['failed'].items()]), use_container_width=True, hide_index=True)
+        return
+    if not orphans:
+        st.success("Không có ảnh mồ côi.")
+        return
+
+    st.dataframe(pd.DataFrame(orphans[:500]), use_container_width=True, hide_index=True)
+    if len(orphans) > 500:
+        st.caption(f"Hiển thị 500/{len(orphans):,} tệp.")
+    confirmed = st.checkbox(f"Tôi hiểu {len(orphans):,} tệp sẽ bị xoá vĩnh viễn khỏi Drive.", key="image_gc_confirm")
+    if st.button("Xoá ảnh mồ côi", type="primary", disabled=not confirmed, key="image_gc_delete"):
+        with st.spinner("Đang quét lại và xoá..."):
+            st.session_state.image_gc_result = {'dry_run': False, **admin_mgr.image_gc.run(image_handler, dry_run=False, min_age_hours=min_age_hours, progress_callback=_on_progress)}
+        progress_text.empty()
+        st.rerun()
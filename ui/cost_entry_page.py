@@ -12,8 +12,8 @@ from utils.formatters import format_currency, format_number
 
 # --- Dialog for viewing receipt ---
 @st.dialog("Xem chứng từ")
-def view_receipt_dialog(image_bytes):
-    st.image(image_bytes, use_column_width=True)
+def view_receipt_dialog(image_src):
+    st.image(image_src, use_column_width=True)
     if st.button("Đóng", width='stretch'):
         st.session_state.viewing_attachment_id = None # Clear state
         st.rerun()
@@ -42,9 +42,9 @@ def render_cost_entry_page(cost_mgr: CostManager, branch_mgr: BranchManager, aut
     if 'viewing_attachment_id' in st.session_state and st.session_state.viewing_attachment_id:
         if cost_mgr.image_handler:
             with st.spinner("Đang tải ảnh chứng từ..."):
-                image_bytes = cost_mgr.image_handler.load_drive_image(st.session_state.viewing_attachment_id)
-                if image_bytes:
-                    view_receipt_dialog(image_bytes)
+                image_src = cost_mgr.image_handler.image_src(st.session_state.viewing_attachment_id, 'full')
+                if image_src:
+                    view_receipt_dialog(image_src)
                 else:
                     st.error("Không thể tải được ảnh chứng từ.")
                     st.session_state.viewing_attachment_id = None # Clear state on failure
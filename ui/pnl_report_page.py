@@ -3,7 +3,8 @@ import streamlit as st
 from datetime import datetime, timedelta
 import pandas as pd
 import plotly.express as px
-from ui._utils import render_page_title, render_section_header
+from ui._utils import render_page_title, render_section_header, render_period_selector, render_as_of_caption
+from managers.report_scheduler import standard_periods, PERIOD_LABELS
 from utils.formatters import format_currency, format_number
 
 def render_pnl_report_page(report_mgr, branch_mgr, auth_mgr):
@@ -23,11 +24,12 @@ def render_pnl_report_page(report_mgr, branch_mgr, auth_mgr):
         user_branches = user_info.get('branch_ids', [])
         branch_options = {bid: all_branches_map[bid] for bid in user_branches if bid in all_branches_map}
 
-    cols = st.columns([1, 1, 2])
+    cols = st.columns([2, 1])
     today = datetime.now()
-    start_date = cols[0].date_input("Từ ngày", today - timedelta(days=30))
-    end_date = cols[1].date_input("Đến ngày", today)
-    selected_branch_key = cols[2].selectbox(
+    with cols[0]:
+        presets = {PERIOD_LABELS[name]: period for name, period in standard_periods().items()}
+        start_date, end_date = render_period_selector(presets, today - timedelta(days=30), today, key_prefix="pnl")
+    selected_branch_key = cols[1].selectbox(
         "Xem báo cáo cho", 
         options=list(branch_options.keys()),
         format_func=lambda k: branch_options[k]
@@ -40,17 +42,19 @@ def render_pnl_report_page(report_mgr, branch_mgr, auth_mgr):
 
         try:
             with st.spinner("Đang tổng hợp dữ liệu..."):
-                pnl_data = report_mgr.get_profit_loss_statement(
+                pnl_result = report_mgr.get_profit_loss_statement(
                     start_date=start_datetime,
                     end_date=end_datetime,
-                    branch_id=branch_id_for_query
+                    branch_ids=[branch_id_for_query] if branch_id_for_query else None
                 )
             
-            if not pnl_data or not pnl_data.get("success"):
-                st.error("Không thể tạo báo cáo: " + pnl_data.get("message", "Không có dữ liệu."))
+            if not pnl_result or not pnl_result.get("success"):
+                st.error("Không thể tạo báo cáo: " + pnl_result.get("message", "Không có dữ liệu."))
                 return
+            pnl_data = pnl_result["data"]
 
             st.success(f"Báo cáo cho: **{branch_options[selected_branch_key]}** từ **{start_date}** đến **{end_date}**")
+            render_as_of_caption(pnl_result.get("as_of"))
             st.markdown("---")
 
             # --- 2. DISPLAY METRICS (using new formatter) ---
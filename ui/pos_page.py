@@ -1,9 +1,9 @@
 
 import streamlit as st
-import base64
 from datetime import datetime
 from ui._utils import render_page_title, render_section_header, render_sub_header, render_branch_selector, inject_custom_css
 from utils.formatters import format_currency, format_number
+from managers.image_prefetcher import get_image_prefetcher
 import os
 
 # --- State Management & Callbacks ---
@@ -26,24 +26,13 @@ def add_to_cart_callback(pos_mgr, branch_id, product_data, stock_quantity):
 
 # --- UI Rendering & Asset Functions ---
 
-@st.cache_data(show_spinner=False, ttl=3600)
-def get_placeholder_image_b64():
-    """Loads the placeholder image and returns its Base64 encoding."""
-    try:
-        with open(os.path.join("assets", "no-image.png"), "rb") as f:
-            return base64.b64encode(f.read()).decode()
-    except Exception:
-        return None
-
-@st.cache_data(show_spinner=False)
-def get_product_image_b64(_product_mgr, image_id):
-    """Loads a product image from Google Drive and returns its Base64 encoding."""
-    if not image_id or not _product_mgr.image_handler: return None
+PLACEHOLDER_IMAGE = os.path.join("assets", "no-image.png")
+
+def get_product_image(product_mgr, image_id, variant='card'):
+    """Image source for st.image(): a cacheable URL on the local image server (or bytes as a fallback); None if unavailable."""
+    if not image_id or not product_mgr.image_handler: return None
     try:
-        img_bytes = _product_mgr.image_handler.load_drive_image(image_id)
-        if img_bytes:
-            mime_type = "image/png" if img_bytes.startswith(b'\x89PNG') else "image/jpeg"
-            return f"data:{mime_type};base64,{base64.b64encode(img_bytes).decode()}"
+        return product_mgr.image_handler.image_src(image_id, variant)
     except Exception as e:
         st.error(f"Lỗi tải ảnh: {e}")
     return None
@@ -77,7 +66,8 @@ def render_product_gallery(product_mgr, inventory_mgr, pos_mgr, branch_id):
     if not filtered_products:
         st.info("Không tìm thấy sản phẩm nào phù hợp với lựa chọn của bạn.")
     else:
-        placeholder_b64 = f"data:image/png;base64,{get_placeholder_image_b64()}"
+        visible_image_ids = [p.get('image_id') for p in filtered_products if branch_inventory.get(p.get('sku'), {}).get('stock_quantity', 0) > 0]
+        get_image_prefetcher().prefetch(product_mgr.image_handler, visible_image_ids)
         cols = st.columns(4)
         for i, p in enumerate(filtered_products):
             sku = p.get('sku')
@@ -88,7 +78,7 @@ def render_product_gallery(product_mgr, inventory_mgr, pos_mgr, branch_id):
 
             with cols[i % 4]:
                 with st.container(border=True):
-                    image_src = get_product_image_b64(product_mgr, p.get('image_id')) or placeholder_b64
+                    image_src = get_product_image(product_mgr, p.get('image_id')) or PLACEHOLDER_IMAGE
                     st.image(image_src)
                     st.markdown(f"<div class='product-title'>{p['name']}</div>", unsafe_allow_html=True)
                     st.markdown(f"<div class='product-price'>{format_currency(p.get('selling_price', 0), 'đ')}</div>", unsafe_allow_html=True)
@@ -109,13 +99,14 @@ def render_cart_view(cart_state, pos_mgr, product_mgr):
         st.info("Giỏ hàng đang trống.")
         return
 
+    get_image_prefetcher().prefetch(product_mgr.image_handler, [item.get('image_id') for item in cart_state['items'].values()])
     with st.container(height=300):
         for sku, item in cart_state['items'].items():
             with st.container():
                 col_img, col_details = st.columns([1, 4])
                 with col_img:
-                    image_src = get_product_image_b64(product_mgr, item.get('image_id'))
-                    st.image(image_src or "assets/no-image.png", width=60)
+                    image_src = get_product_image(product_mgr, item.get('image_id'), variant='thumb')
+                    st.image(image_src or PLACEHOLDER_IMAGE, width=60)
 
                 with col_details:
                     st.markdown(f"**{item['name']}** (`{sku}`)")
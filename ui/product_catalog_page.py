@@ -2,19 +2,35 @@
 import streamlit as st
 from managers.product_manager import ProductManager
 from managers.auth_manager import AuthManager
+from managers.image_prefetcher import get_image_prefetcher
+from managers.image_upload_queue import IMAGE_STATUS_PENDING, IMAGE_STATUS_FAILED
 from ui._utils import render_page_title, render_section_header
 
+CATALOG_PAGE_SIZE = 30
+
 # Helper function to display image safely
 def _display_image(image_id, prod_mgr, width=150):
     if image_id and prod_mgr.image_handler:
-        image_bytes = prod_mgr.image_handler.load_drive_image(image_id)
-        if image_bytes:
-            st.image(image_bytes, width=width)
+        image_src = prod_mgr.image_handler.image_src(image_id, 'thumb' if width <= 160 else 'card')
+        if image_src:
+            st.image(image_src, width=width)
         else:
             st.image("assets/no-image.png", width=width)
     else:
         st.image("assets/no-image.png", width=width)
 
+def _display_image_status(product, prod_mgr, key_prefix="img"):
+    """Shows the background upload state of a product image (pending / failed with a retry button)."""
+    status = product.get('image_status')
+    if status == IMAGE_STATUS_PENDING:
+        st.caption("⏳ Đang tải ảnh lên...")
+    elif status == IMAGE_STATUS_FAILED:
+        st.caption("⚠️ Tải ảnh lỗi", help=product.get('image_error'))
+        if st.button("Thử lại", key=f"{key_prefix}_retry_{product['id']}"):
+            success, message = prod_mgr.retry_image_upload(product['id'])
+            (st.toast if success else st.error)(message)
+            st.rerun()
+
 def _render_product_form(prod_mgr: ProductManager, is_manager_or_admin: bool):
     """Renders the form for adding or editing a product."""
     if not is_manager_or_admin:
@@ -85,11 +101,13 @@ def _render_product_list(prod_mgr: ProductManager, products: list, cat_names: di
     h_cols[5].markdown("**Hành động**")
     st.markdown("<hr style='margin:0.5rem 0'>", unsafe_allow_html=True)
 
+    get_image_prefetcher().prefetch(prod_mgr.image_handler, [p.get('image_id') for p in products])
     for p in products:
         p_cols = st.columns([1, 1, 4, 2, 1, 2])
         p_cols[0].write(p['sku'])
         with p_cols[1]:
             _display_image(p.get('image_id'), prod_mgr, width=60)
+            _display_image_status(p, prod_mgr)
         p_cols[2].write(p['name'])
         p_cols[3].write(cat_names.get(p.get('category_id'), "N/A"))
 
@@ -156,12 +174,19 @@ def render_product_catalog_page(prod_mgr: ProductManager, auth_mgr: AuthManager)
     render_section_header("Toàn bộ sản phẩm trong danh mục")
     
     # Fetch data for the list
-    products = prod_mgr.get_all_products(active_only=False)
+    products = prod_mgr.get_all_products(active_only=False, full=True)
     if not products:
         st.info("Chưa có sản phẩm nào.")
         return
         
     cat_names = {c['id']: c['category_name'] for c in prod_mgr.get_all_category_items("ProductCategories")}
 
+    # Chỉ hiển thị (và tải trước ảnh) một trang sản phẩm mỗi lần
+    page_count = max(1, -(-len(products) // CATALOG_PAGE_SIZE))
+    page = 1
+    if page_count > 1:
+        page = st.number_input(f"Trang (1-{page_count})", min_value=1, max_value=page_count, value=1, step=1, key="catalog_page")
+    page_products = products[(page - 1) * CATALOG_PAGE_SIZE:page * CATALOG_PAGE_SIZE]
+
     # Render the product list
-    _render_product_list(prod_mgr, products, cat_names, is_admin, is_manager_or_admin)
+    _render_product_list(prod_mgr, page_products, cat_names, is_admin, is_manager_or_admin)
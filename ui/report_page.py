@@ -10,7 +10,8 @@ from managers.branch_manager import BranchManager
 from managers.auth_manager import AuthManager
 
 # Import UI utils and formatters
-from ui._utils import render_page_title, render_section_header, render_sub_header
+from ui._utils import render_page_title, render_section_header, render_sub_header, render_period_selector, render_as_of_caption
+from managers.report_scheduler import standard_periods, PERIOD_LABELS
 from utils.formatters import format_currency, format_number
 
 def render_report_page(report_mgr: ReportManager, branch_mgr: BranchManager, auth_mgr: AuthManager):
@@ -55,10 +56,9 @@ def render_report_page(report_mgr: ReportManager, branch_mgr: BranchManager, aut
                 key="inv_branch_multiselect"
             )
         else:
-            col1, col2 = st.columns(2)
             today = datetime.now()
-            start_date = col1.date_input("Từ ngày", today - timedelta(days=30), key="date_start")
-            end_date = col2.date_input("Đến ngày", today, key="date_end")
+            presets = {PERIOD_LABELS[name]: period for name, period in standard_periods().items()}
+            start_date, end_date = render_period_selector(presets, today - timedelta(days=30), today, key_prefix="report")
             selected_branch_ids = st.multiselect(
                 "Chọn chi nhánh",
                 options=list(allowed_branches_map.keys()),
@@ -67,6 +67,18 @@ def render_report_page(report_mgr: ReportManager, branch_mgr: BranchManager, aut
                 key="std_branch_multiselect"
             )
 
+        report_backend = report_mgr.backend
+        if not is_inventory_report and report_mgr.analytics_store.has_data():
+            backend_labels = {'firestore': "Firestore (trực tuyến)", 'parquet': "Kho phân tích cục bộ (Parquet)"}
+            report_backend = st.radio(
+                "Nguồn dữ liệu",
+                options=list(backend_labels.keys()),
+                format_func=lambda x: backend_labels[x],
+                index=list(backend_labels.keys()).index(report_mgr.backend),
+                horizontal=True,
+                key="report_backend_selector"
+            )
+
         if st.button("📈 Xem báo cáo", type="primary", use_container_width=True):
             if not selected_branch_ids:
                 st.warning("Vui lòng chọn ít nhất một chi nhánh.")
@@ -74,6 +86,7 @@ def render_report_page(report_mgr: ReportManager, branch_mgr: BranchManager, aut
                 st.session_state.run_report = True
                 st.session_state.report_type = report_type
                 st.session_state.selected_branch_ids = selected_branch_ids
+                st.session_state.report_backend = report_backend
                 if not is_inventory_report:
                     st.session_state.start_date = start_date
                     st.session_state.end_date = end_date
@@ -87,21 +100,28 @@ def render_report_page(report_mgr: ReportManager, branch_mgr: BranchManager, aut
 
     report_type = st.session_state.report_type
     selected_branch_ids = st.session_state.selected_branch_ids
+    report_backend = st.session_state.get('report_backend', report_mgr.backend)
 
     with st.spinner("Đang xử lý và tải dữ liệu báo cáo..."):
         # --- BÁO CÁO DOANH THU -- -
         if report_type == "Báo cáo Doanh thu":
             start_datetime = datetime.combine(st.session_state.start_date, datetime.min.time())
             end_datetime = datetime.combine(st.session_state.end_date, datetime.max.time())
-            success, data, message = report_mgr.get_revenue_report(start_datetime, end_datetime, selected_branch_ids)
-            if success and data:
+            # KPI đầu trang: truy vấn tổng hợp phía máy chủ (chỉ trả về các con số), hiển thị trước bảng chi tiết.
+            kpi_result = report_mgr.get_revenue_kpis(start_datetime, end_datetime, selected_branch_ids, backend=report_backend)
+            kpis = kpi_result.get('data')
+            if kpi_result.get('success') and kpis:
                 render_section_header("Tổng quan Doanh thu")
+                render_as_of_caption(kpi_result.get('as_of'))
                 kpi_cols = st.columns(4)
-                kpi_cols[0].metric("Tổng Doanh thu", format_currency(data.get('total_revenue', 0)))
-                kpi_cols[1].metric("Tổng Lợi nhuận gộp", format_currency(data.get('total_profit', 0)))
-                kpi_cols[2].metric("Số lượng hóa đơn", format_number(data.get('total_orders', 0)))
-                kpi_cols[3].metric("Giá trị/hóa đơn", format_currency(data.get('average_order_value', 0)))
+                kpi_cols[0].metric("Tổng Doanh thu", format_currency(kpis.get('total_revenue', 0)))
+                kpi_cols[1].metric("Tổng Lợi nhuận gộp", format_currency(kpis.get('total_profit', 0)))
+                kpi_cols[2].metric("Số lượng hóa đơn", format_number(kpis.get('total_orders', 0)))
+                kpi_cols[3].metric("Giá trị/hóa đơn", format_currency(kpis.get('average_order_value', 0)))
                 st.divider()
+            result = report_mgr.get_revenue_report(start_datetime, end_datetime, selected_branch_ids, backend=report_backend)
+            data = result.get('data')
+            if result.get('success') and data:
                 render_sub_header("Biểu đồ doanh thu theo ngày")
                 revenue_df = data.get('revenue_by_day')
                 if revenue_df is not None and not revenue_df.empty:
@@ -114,8 +134,10 @@ def render_report_page(report_mgr: ReportManager, branch_mgr: BranchManager, aut
                     st.dataframe(top_products_df.style.format({'Doanh thu': format_currency, 'Lợi nhuận': format_currency, 'Số lượng': format_number}), use_container_width=True)
                 else:
                     st.info("Không có dữ liệu về sản phẩm bán chạy.")
+            elif result.get('success'):
+                st.info(result.get('message', "Không có giao dịch trong kỳ."))
             else:
-                st.error(f"Lỗi khi lấy báo cáo: {message}")
+                st.error(f"Lỗi khi lấy báo cáo: {result.get('message')}")
 
         # --- BÁO CÁO TỒN KHO -- -
         elif report_type == "Báo cáo Tồn kho":
@@ -154,12 +176,13 @@ def render_report_page(report_mgr: ReportManager, branch_mgr: BranchManager, aut
         elif report_type == "Phân tích Lợi nhuận":
             start_datetime = datetime.combine(st.session_state.start_date, datetime.min.time())
             end_datetime = datetime.combine(st.session_state.end_date, datetime.max.time())
-            result = report_mgr.get_profit_analysis_report(start_datetime, end_datetime, selected_branch_ids)
+            result = report_mgr.get_profit_analysis_report(start_datetime, end_datetime, selected_branch_ids, backend=report_backend)
             if result.get('success') and result.get('data'):
                 report_data = result['data']
                 product_df = report_data['product_profit_df']
                 category_df = report_data['category_profit_df']
                 render_section_header("Phân tích Lợi nhuận")
+                render_as_of_caption(result.get('as_of'))
                 tab1, tab2 = st.tabs(["Lợi nhuận theo Sản phẩm", "Lợi nhuận theo Danh mục"])
                 with tab1:
                     render_sub_header("Top 10 sản phẩm lợi nhuận cao nhất")
@@ -1,7 +1,10 @@
 # ui/transactions_page.py
+import os
+from functools import partial
 import streamlit as st
 from datetime import datetime, date
 from ui._utils import render_section_header
+from managers.transaction_search import prefix_conflict_message
 import pandas as pd
 
 def render_transactions_page(txn_manager, branch_mgr, auth_mgr):
@@ -12,6 +15,12 @@ def render_transactions_page(txn_manager, branch_mgr, auth_mgr):
 
     render_section_header("Lịch Sử Giao Dịch")
 
+    # FIX: Use the correct method `list_branches` instead of `get_all_branches`
+    branch_options = branch_mgr.list_branches()
+    branch_map = {b['id']: b['name'] for b in branch_options}
+
+    render_search_section(txn_manager, auth_mgr, branch_map, None if user_role == 'admin' else user_branch_id)
+
     # --- Date Range and Branch Filters ---
     col1, col2, col3 = st.columns([1, 1, 2])
     with col1:
@@ -19,10 +28,6 @@ def render_transactions_page(txn_manager, branch_mgr, auth_mgr):
     with col2:
         end_date = st.date_input("Đến ngày", date.today())
 
-    # FIX: Use the correct method `list_branches` instead of `get_all_branches`
-    branch_options = branch_mgr.list_branches()
-    branch_map = {b['id']: b['name'] for b in branch_options}
-    
     selected_branch_id = None
     if user_role == 'admin':
         with col3:
@@ -41,51 +46,196 @@ def render_transactions_page(txn_manager, branch_mgr, auth_mgr):
         if start_date > end_date:
             st.error("Ngày bắt đầu không được lớn hơn ngày kết thúc.")
             return
+        # Chỉ giữ bộ lọc, con trỏ các trang đã qua và trang hiện tại trong session (không giữ toàn bộ kết quả).
+        st.session_state.txn_history = {
+            'filters': (start_date, end_date, selected_branch_id),
+            'cursors': [None], 'page': None,
+        }
+        st.session_state.pop('queried_transactions', None)
+
+    render_export_section(txn_manager, start_date, end_date, selected_branch_id)
+
+    # --- Display Queried Transactions (one page at a time) ---
+    history = st.session_state.get('txn_history')
+    if history:
+        render_transaction_history(txn_manager, history, branch_map)
 
+def render_transaction_history(txn_manager, history, branch_map):
+    start_date, end_date, branch_id = history['filters']
+    render_paged_transactions(
+        txn_manager, history, branch_map, key="txn_table",
+        fetch_page=lambda cursor: txn_manager.get_transaction_page(start_date, end_date, branch_id, cursor=cursor),
+        empty_message="Không tìm thấy giao dịch nào trong khoảng thời gian và chi nhánh đã chọn."
+    )
+
+def render_paged_transactions(txn_manager, state, branch_map, key, fetch_page, empty_message, allowed_branch_id=None):
+    """Hiển thị một trang kết quả (bảng chọn một dòng + nút chuyển trang) và chi tiết dòng được chọn."""
+    if state['page'] is None:
         try:
             with st.spinner("Đang tải dữ liệu giao dịch..."):
-                transactions = txn_manager.query_transactions(start_date, end_date, selected_branch_id)
-            
-            if not transactions:
-                st.info("Không tìm thấy giao dịch nào trong khoảng thời gian và chi nhánh đã chọn.")
-            else:
-                st.session_state.queried_transactions = transactions
-
+                state['page'] = fetch_page(state['cursors'][-1])
         except Exception as e:
             st.error(f"Đã xảy ra lỗi khi tải giao dịch: {e}")
-    
-    # --- Display Queried Transactions ---
-    if 'queried_transactions' in st.session_state:
-        transactions = st.session_state.queried_transactions
-        st.write(f"**Tìm thấy {len(transactions)} giao dịch:**")
-
-        for txn in transactions:
-            txn_time = txn.get('created_at').strftime("%H:%M %d/%m/%Y") if txn.get('created_at') else "N/A"
-            branch_name = branch_map.get(txn.get('branch_id'), txn.get('branch_id'))
-            total_amount_formatted = f"{txn.get('total_amount', 0):,}"
-
-            expander_title = f"`{txn['id']}` - **{total_amount_formatted}đ** - {branch_name} - {txn_time}"
-            with st.expander(expander_title):
-                st.write(f"**Nhân viên:** {txn.get('cashier_id', 'N/A')}")
-                st.write(f"**Khách hàng:** {txn.get('customer_name', 'Khách lẻ')} ({txn.get('customer_phone', 'N/A')})")
-                
-                st.markdown("##### Chi tiết đơn hàng")
-                items_data = []
-                for item in txn.get('items', []):
-                    items_data.append({
-                        "Tên SP": item.get('product_name'),
-                        "SL": item.get('quantity'),
-                        "Đơn giá": f"{item.get('price', 0):,}",
-                        "Thành tiền": f"{item.get('total', 0):,}"
-                    })
-                st.table(pd.DataFrame(items_data).set_index("Tên SP"))
-
-                st.markdown("--- Tóm tắt ---")
-                summary_col1, summary_col2 = st.columns(2)
-                summary_col1.metric("Tổng tiền hàng", f"{txn.get('sub_total', 0):,}đ")
-                summary_col1.metric("Giảm giá", f"- {txn.get('discount_amount', 0):,}đ")
-                summary_col1.metric("**Tổng cộng**", f"**{txn.get('total_amount', 0):,}đ**")
-                
-                summary_col2.write(f"**Tiền khách đưa:** {txn.get('payment_received', 0):,}đ")
-                summary_col2.write(f"**Tiền thối:** {txn.get('payment_change', 0):,}đ")
-                summary_col2.write(f"**Phương thức:** {txn.get('payment_method', 'Tiền mặt')}")
+            return
+
+    page = state['page']
+    transactions = page['transactions']
+    if allowed_branch_id:
+        transactions = [t for t in transactions if t.get('branch_id') == allowed_branch_id]
+    page_number = len(state['cursors'])
+    if not transactions:
+        st.info(empty_message)
+        return
+
+    st.write(f"**Trang {page_number}** — {len(transactions)} giao dịch")
+    summary_df = pd.DataFrame([{
+        "Mã giao dịch": txn['id'],
+        "Thời gian": txn['created_at'].strftime("%H:%M %d/%m/%Y") if txn.get('created_at') else "N/A",
+        "Chi nhánh": branch_map.get(txn.get('branch_id'), txn.get('branch_id')),
+        "Loại": txn.get('type', ''),
+        "Tổng cộng": f"{txn.get('total_amount', 0):,.0f}đ",
+    } for txn in transactions])
+    selection = st.dataframe(
+        summary_df, use_container_width=True, hide_index=True,
+        on_select="rerun", selection_mode="single-row", key=f"{key}_{page_number}"
+    )
+
+    nav_prev, nav_next = st.columns(2)
+    if nav_prev.button("← Trang trước", disabled=page_number == 1, use_container_width=True, key=f"{key}_prev"):
+        state['cursors'].pop()
+        state['page'] = None
+        st.rerun()
+    if nav_next.button("Trang sau →", disabled=page['next_cursor'] is None, use_container_width=True, key=f"{key}_next"):
+        state['cursors'].append(page['next_cursor'])
+        state['page'] = None
+        st.rerun()
+
+    selected_rows = selection.selection.rows if selection else []
+    if selected_rows:
+        render_transaction_details(txn_manager, transactions[selected_rows[0]]['id'])
+    else:
+        st.caption("Chọn một dòng để xem chi tiết đơn hàng.")
+
+def render_transaction_details(txn_manager, transaction_id):
+    txn = txn_manager.get_transaction_details(transaction_id)
+    if not txn:
+        st.warning(f"Không tìm thấy giao dịch `{transaction_id}`.")
+        return
+
+    with st.container(border=True):
+        st.markdown(f"##### Chi tiết đơn hàng `{transaction_id}`")
+        st.write(f"**Nhân viên:** {txn.get('cashier_id', 'N/A')}")
+        st.write(f"**Khách hàng:** {txn.get('customer_name') or txn.get('customer_id') or 'Khách lẻ'}")
+
+        items_data = []
+        for item in txn.get('items', []):
+            quantity = item.get('quantity', 0)
+            unit_price = item.get('final_price', item.get('price', 0))
+            items_data.append({
+                "Tên SP": item.get('name', item.get('product_name')),
+                "SL": quantity,
+                "Đơn giá": f"{unit_price:,.0f}",
+                "Thành tiền": f"{item.get('total', unit_price * quantity):,.0f}"
+            })
+        if items_data:
+            st.table(pd.DataFrame(items_data).set_index("Tên SP"))
+
+        st.markdown("--- Tóm tắt ---")
+        summary_col1, summary_col2 = st.columns(2)
+        summary_col1.metric("Tổng tiền hàng", f"{txn.get('sub_total', 0):,.0f}đ")
+        summary_col1.metric("Giảm giá", f"- {txn.get('discount_amount', 0):,.0f}đ")
+        summary_col1.metric("**Tổng cộng**", f"**{txn.get('total_amount', 0):,.0f}đ**")
+
+        summary_col2.write(f"**Tiền khách đưa:** {txn.get('payment_received', 0):,}đ")
+        summary_col2.write(f"**Tiền thối:** {txn.get('payment_change', 0):,}đ")
+        summary_col2.write(f"**Phương thức:** {txn.get('payment_method', 'Tiền mặt')}")
+
+def render_search_section(txn_manager, auth_mgr, branch_map, restricted_branch_id=None):
+    """Tìm một hoá đơn theo mã đơn, khách hàng, thu ngân hoặc khoảng số tiền bằng truy vấn có chỉ mục."""
+    with st.expander("🔍 Tìm giao dịch", expanded=bool(st.session_state.get('txn_search'))):
+        with st.form("txn_search_form"):
+            c1, c2, c3 = st.columns(3)
+            order_id_prefix = c1.text_input("Mã đơn (hoặc phần đầu mã đơn)", placeholder="VD: BR-1A2B3C-260115")
+            customer_id = c2.text_input("Mã khách hàng", placeholder="VD: CUS-1A2B3C")
+            if 'txn_search_users' not in st.session_state:
+                st.session_state.txn_search_users = {u['uid']: u.get('display_name', u['uid']) for u in auth_mgr.list_users()}
+            users = st.session_state.txn_search_users
+            cashier_id = c3.selectbox("Thu ngân", options=[None] + list(users.keys()), format_func=lambda x: "Tất cả" if x is None else users[x])
+            a1, a2, a3 = st.columns(3)
+            min_amount = a1.number_input("Số tiền từ", min_value=0, step=10000, value=0)
+            max_amount = a2.number_input("Số tiền đến (0 = không giới hạn)", min_value=0, step=10000, value=0)
+            date_range = a3.date_input("Khoảng ngày (tuỳ chọn)", value=(), format="DD/MM/YYYY")
+            submitted = st.form_submit_button("Tìm", use_container_width=True, type="primary")
+
+        if submitted:
+            criteria = {
+                'type': 'SALE',
+                'order_id_prefix': order_id_prefix.strip() or None,
+                'customer_id': customer_id.strip() or None,
+                'cashier_id': cashier_id,
+                'branch_id': restricted_branch_id,
+                'min_amount': min_amount or None,
+                'max_amount': max_amount or None,
+            }
+            if len(date_range) == 2:
+                criteria['start_date'], criteria['end_date'] = date_range
+            if not any(v for k, v in criteria.items() if k not in ('type', 'branch_id')):
+                st.warning("Vui lòng nhập ít nhất một tiêu chí tìm kiếm.")
+                st.session_state.pop('txn_search', None)
+            elif prefix_conflict_message(criteria):
+                st.warning(prefix_conflict_message(criteria))
+                st.session_state.pop('txn_search', None)
+            else:
+                st.session_state.txn_search = {'criteria': criteria, 'cursors': [None], 'page': None}
+
+        search_state = st.session_state.get('txn_search')
+        if search_state:
+            render_paged_transactions(
+                txn_manager, search_state, branch_map, key="txn_search_table",
+                fetch_page=lambda cursor: txn_manager.searcher.search(search_state['criteria'], cursor=cursor),
+                empty_message="Không tìm thấy giao dịch phù hợp.", allowed_branch_id=restricted_branch_id
+            )
+
+EXPORT_FORMAT_LABELS = {'csv.gz': "CSV nén (.csv.gz)", 'csv': "CSV (.csv)", 'xlsx': "Excel (.xlsx)"}
+
+def _read_export_file(path: str) -> bytes:
+    with open(path, 'rb') as export_file:
+        return export_file.read()
+
+def render_export_section(txn_manager, start_date, end_date, branch_id):
+    """Xuất giao dịch theo bộ lọc hiện tại ra tệp (ghi dần theo trang, không giữ dữ liệu trong session)."""
+    with st.expander("📥 Xuất dữ liệu giao dịch"):
+        export_format = st.radio(
+            "Định dạng tệp", options=list(EXPORT_FORMAT_LABELS.keys()),
+            format_func=lambda x: EXPORT_FORMAT_LABELS[x], horizontal=True, key="txn_export_format"
+        )
+        if st.button("Tạo tệp xuất", use_container_width=True, key="txn_export_button"):
+            if start_date > end_date:
+                st.error("Ngày bắt đầu không được lớn hơn ngày kết thúc.")
+                return
+            progress_bar = st.progress(0.0, text="Đang chuẩn bị xuất dữ liệu...")
+
+            def on_progress(done, total):
+                if total:
+                    progress_bar.progress(min(done / total, 1.0), text=f"Đã xử lý {done:,}/{total:,} giao dịch")
+                else:
+                    progress_bar.progress(0.0, text=f"Đã xử lý {done:,} giao dịch")
+
+            result = txn_manager.exporter.export_transactions(start_date, end_date, branch_id, fmt=export_format, progress_callback=on_progress)
+            previous = st.session_state.pop('transaction_export', None)
+            if previous and os.path.exists(previous['path']):
+                os.remove(previous['path'])
+            if result['success']:
+                progress_bar.progress(1.0, text=f"Hoàn tất: {result['transactions']:,} giao dịch, {result['rows']:,} dòng.")
+                st.session_state.transaction_export = result
+            else:
+                progress_bar.empty()
+                st.error(f"Lỗi khi xuất dữ liệu: {result['message']}")
+
+        export = st.session_state.get('transaction_export')
+        if export and os.path.exists(export['path']):
+            # Truyền hàm thay cho nội dung: tệp chỉ được đọc khi người dùng bấm tải, không phải ở mỗi lần rerun.
+            st.download_button(
+                f"⬇️ Tải về {export['file_name']}", data=partial(_read_export_file, export['path']),
+                file_name=export['file_name'], mime=export['mime'], use_container_width=True
+            )